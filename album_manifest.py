@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+专辑清单
+用一个清单文件描述整张专辑：专辑级标签（专辑、艺术家、日期、封面等）加每首曲目的
+标题、音轨号、输入文件、歌词和裁剪范围，不必为每首曲目写一个几乎相同的元数据文件。
+封面只下载/转换一次，所有曲目嵌入同一份图片数据
+
+清单格式一（扩展的元数据文件格式，.txt）：
+    专辑(ALBUM)：专辑名
+    艺术家(ARTIST)：歌手
+    封面图片(COVER_IMAGE)：https://example.com/cover.jpg
+
+    [曲目 1]
+    标题(TITLE)：第一首
+    输入(INPUT)：01.mp4
+    歌词(LRC)：01.lrc
+    开始时间(START)：5
+    持续时间(DURATION)：00:03:30
+
+清单格式二（.json）：
+    {"album": {"ALBUM": "专辑名", "COVER_IMAGE": "cover.jpg"},
+     "tracks": [{"TITLE": "第一首", "INPUT": "01.mp4", "LRC": "01.lrc", "START": 5}]}
+
+相对路径相对于清单文件所在目录
+"""
+
+import re
+import sys
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from flac_metadata_utils import (
+    METADATA_TAG_MAPPING,
+    read_text_file,
+    parse_metadata_line,
+    write_metadata_file,
+    load_cover_bytes
+)
+from video_to_audio import parse_time, check_ffmpeg, process_media_job
+from compression_tuner import AUTO_FLAC_COMPRESSION
+from cpu_budget import parse_jobs, plan_concurrency, limit_ffmpeg_threads, describe_budget
+from job_context import JobContext, JobResult, scratch_dir
+
+# Constants
+# 曲目字段（不作为标签写入）
+TRACK_FIELDS = {'INPUT', 'LRC', 'START', 'DURATION', 'OUTPUT'}
+ALBUM_TAG_MAPPING = {
+    **METADATA_TAG_MAPPING,
+    '音轨号': 'TRACKNUMBER',
+    '输入': 'INPUT',
+    '歌词': 'LRC',
+    '开始时间': 'START',
+    '持续时间': 'DURATION',
+    '输出': 'OUTPUT',
+}
+# 曲目段落标题：[曲目 3]、[Track 3]、[曲目]
+TRACK_HEADER = re.compile(r'^\[\s*(?:曲目|track)\s*(\d*)\s*\]$', re.IGNORECASE)
+DEFAULT_ALBUM_JOBS = 2
+# 输出文件名中不能使用的字符
+UNSAFE_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+@dataclass
+class AlbumTrack:
+    """清单中的一首曲目"""
+    number: int
+    input_path: Path
+    tags: Dict[str, str] = field(default_factory=dict)
+    lrc_path: Optional[Path] = None
+    start_time: Optional[float] = None
+    duration: Optional[float] = None
+    output_path: Optional[Path] = None
+
+    @property
+    def title(self) -> str:
+        return self.tags.get('TITLE', self.input_path.stem)
+
+
+@dataclass
+class AlbumManifest:
+    """解析后的专辑清单"""
+    path: Path
+    tags: Dict[str, str] = field(default_factory=dict)
+    cover: Optional[str] = None
+    tracks: List[AlbumTrack] = field(default_factory=list)
+
+
+def _resolve(base_dir: Path, value: str) -> Path:
+    path = Path(value).expanduser()
+    return path if path.is_absolute() else base_dir / path
+
+
+def _parse_seconds(value: Any, label: str) -> Optional[float]:
+    if value is None or value == '':
+        return None
+    seconds = parse_time(str(value))
+    if seconds is None:
+        raise ValueError(f"无法解析{label} '{value}'")
+    return seconds
+
+
+def _build_track(number: int, fields: Dict[str, Any], base_dir: Path) -> AlbumTrack:
+    """由曲目字段（键为大写英文标签）构造AlbumTrack，缺少输入文件时抛出ValueError"""
+    fields = {str(key).upper(): value for key, value in fields.items()}
+    if not fields.get('INPUT'):
+        raise ValueError(f"曲目 {number} 没有指定输入文件(INPUT)")
+    if fields.get('TRACKNUMBER'):
+        number = int(str(fields['TRACKNUMBER']).split('/')[0])
+    tags = {key: str(value) for key, value in fields.items() if key not in TRACK_FIELDS and value not in (None, '')}
+    tags['TRACKNUMBER'] = str(number)
+    return AlbumTrack(
+        number=number,
+        input_path=_resolve(base_dir, str(fields['INPUT'])),
+        tags=tags,
+        lrc_path=_resolve(base_dir, str(fields['LRC'])) if fields.get('LRC') else None,
+        start_time=_parse_seconds(fields.get('START'), f"曲目 {number} 的开始时间"),
+        duration=_parse_seconds(fields.get('DURATION'), f"曲目 {number} 的持续时间"),
+        output_path=_resolve(base_dir, str(fields['OUTPUT'])) if fields.get('OUTPUT') else None,
+    )
+
+
+def _parse_text_manifest(content: str) -> Tuple[Dict[str, str], List[Tuple[int, Dict[str, str]]]]:
+    """扩展的元数据文件格式：第一个曲目段落之前为专辑字段，之后每个[曲目 N]段落为一首曲目"""
+    album: Dict[str, str] = {}
+    sections: List[Tuple[int, Dict[str, str]]] = []
+    for line in content.split('\n'):
+        header = TRACK_HEADER.match(line.strip())
+        if header:
+            number = int(header.group(1)) if header.group(1) else len(sections) + 1
+            sections.append((number, {}))
+            continue
+        parsed = parse_metadata_line(line, ALBUM_TAG_MAPPING)
+        if parsed:
+            tag, value = parsed
+            (sections[-1][1] if sections else album)[tag.upper()] = value
+    return album, sections
+
+
+def _parse_json_manifest(content: str) -> Tuple[Dict[str, str], List[Tuple[int, Dict[str, Any]]]]:
+    data = json.loads(content)
+    if not isinstance(data, dict) or not isinstance(data.get('tracks'), list):
+        raise ValueError("JSON清单需要包含tracks列表")
+    album = {str(key).upper(): str(value) for key, value in (data.get('album') or {}).items()
+             if value not in (None, '')}
+    tracks = []
+    for index, track in enumerate(data['tracks'], start=1):
+        if not isinstance(track, dict):
+            raise ValueError(f"曲目 {index} 格式错误")
+        tracks.append((index, track))
+    return album, tracks
+
+
+def parse_album_manifest(manifest_path: Union[str, Path]) -> AlbumManifest:
+    """
+    解析专辑清单（.json为JSON格式，其他为扩展的元数据文件格式）
+    清单无效时抛出ValueError
+    """
+    manifest_path = Path(manifest_path)
+    content = read_text_file(manifest_path)
+    if content is None:
+        raise ValueError(f"无法读取清单文件 {manifest_path}")
+    if manifest_path.suffix.lower() == '.json':
+        album, sections = _parse_json_manifest(content)
+    else:
+        album, sections = _parse_text_manifest(content)
+    if not sections:
+        raise ValueError("清单中没有曲目")
+
+    base_dir = manifest_path.parent
+    manifest = AlbumManifest(path=manifest_path)
+    cover = album.pop('COVER_IMAGE', None)
+    if cover and not cover.startswith(('http://', 'https://', 'data:image/')):
+        cover = str(_resolve(base_dir, cover))
+    manifest.cover = cover
+    manifest.tags = album
+
+    for number, fields in sections:
+        manifest.tracks.append(_build_track(number, fields, base_dir))
+    total = str(len(manifest.tracks))
+    for track in manifest.tracks:
+        # 专辑字段作为默认值，曲目中的同名字段优先
+        track.tags = {**album, 'TRACKTOTAL': total, **track.tags}
+    return manifest
+
+
+def track_output_path(track: AlbumTrack, output_dir: Path) -> Path:
+    """未指定OUTPUT时为 <输出目录>/<音轨号> - <标题>.flac"""
+    if track.output_path is not None:
+        return track.output_path
+    title = UNSAFE_FILENAME_CHARS.sub('_', track.title).strip(' .') or track.input_path.stem
+    return output_dir / f"{track.number:02d} - {title}.flac"
+
+
+def prepare_album_cover(cover_input: str, directory: Path) -> Optional[Path]:
+    """下载/解码/转换专辑封面一次，写到directory中，返回图片路径（JPEG或PNG）"""
+    cover_data = load_cover_bytes(cover_input)
+    if not cover_data:
+        return None
+    cover_path = directory / ('album_cover.png' if cover_data.startswith(b'\x89PNG') else 'album_cover.jpg')
+    cover_path.write_bytes(cover_data)
+    return cover_path
+
+
+def convert_album(manifest: AlbumManifest, output_dir: Optional[Path] = None, jobs: int = DEFAULT_ALBUM_JOBS,
+                  **options) -> List[Tuple[AlbumTrack, JobResult]]:
+    """
+    转换清单中的所有曲目，返回 [(曲目, 结果), ...]
+    封面在开始前准备一次，每首曲目的元数据文件都指向这份图片（prepare_cover_image直接使用本地JPEG/PNG，
+    不会重复下载或转换）；曲目在jobs个线程中并行转换，options与process_media的参数相同
+    """
+    output_dir = Path(output_dir) if output_dir else manifest.path.parent
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with JobContext('album'):
+        workspace = scratch_dir()
+        cover_path = None
+        if manifest.cover:
+            print(f"正在准备专辑封面: {manifest.cover}")
+            cover_path = prepare_album_cover(manifest.cover, workspace)
+            if cover_path is None:
+                print("警告: 未能准备专辑封面，曲目将不含封面")
+
+        def convert(track: AlbumTrack) -> JobResult:
+            metadata = dict(track.tags)
+            if cover_path is not None:
+                metadata['COVER_IMAGE'] = str(cover_path)
+            metadata_file = workspace / f"track_{track.number:02d}_{id(track)}.txt"
+            write_metadata_file(metadata_file, metadata)
+            return process_media_job(str(track.input_path), str(track_output_path(track, output_dir)),
+                                     start_time=track.start_time, duration=track.duration,
+                                     lrc_path=str(track.lrc_path) if track.lrc_path else None,
+                                     metadata_file=str(metadata_file), **options)
+
+        with ThreadPoolExecutor(max(1, jobs)) as pool:
+            results = list(pool.map(convert, manifest.tracks))
+    return list(zip(manifest.tracks, results))
+
+
+def check_manifest(manifest: AlbumManifest) -> List[str]:
+    """检查输入文件和歌词文件是否存在、音轨号是否重复，返回问题列表"""
+    problems = []
+    seen = set()
+    for track in manifest.tracks:
+        if not track.input_path.exists():
+            problems.append(f"曲目 {track.number}: 输入文件 '{track.input_path}' 不存在")
+        if track.lrc_path and not track.lrc_path.exists():
+            problems.append(f"曲目 {track.number}: 歌词文件 '{track.lrc_path}' 不存在")
+        if track.number in seen:
+            problems.append(f"曲目 {track.number}: 音轨号重复")
+        seen.add(track.number)
+    return problems
+
+
+def print_help():
+    """打印帮助信息"""
+    print("""
+专辑清单转换
+
+用法:
+    python album_manifest.py <清单文件> [选项]
+
+选项:
+    -o <目录>            输出目录（默认为清单文件所在目录）
+    -j <数量|auto>       同时转换的曲目数（默认2）
+    -c <级别>            FLAC压缩级别 (0-8或auto)
+    --no-cache           不使用编码缓存
+    --list               只列出清单内容，不转换
+    -h, --help           显示帮助信息
+
+说明:
+    清单文件为扩展的元数据文件格式（.txt）或JSON（.json），格式见album_manifest.py开头的说明；
+    专辑字段（专辑、艺术家、日期、流派、封面等）写入每首曲目，曲目中的同名字段优先；
+    封面只下载/转换一次；未指定输出文件名时为 "<音轨号> - <标题>.flac"
+
+示例:
+    python album_manifest.py album.txt -o flac/ -j 4
+    python album_manifest.py album.json --list
+    """)
+
+
+def main():
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args or len(args) == 0:
+        print_help()
+        sys.exit(0)
+
+    manifest_file = None
+    output_dir = None
+    jobs = DEFAULT_ALBUM_JOBS
+    list_only = False
+    options: Dict[str, Any] = {}
+
+    i = 0
+    while i < len(args):
+        if args[i] == '-o' and i + 1 < len(args):
+            output_dir = Path(args[i + 1])
+            i += 2
+        elif args[i] == '-j' and i + 1 < len(args):
+            try:
+                jobs = parse_jobs(args[i + 1])
+            except ValueError:
+                print("错误: 任务数必须是正整数或auto")
+                sys.exit(1)
+            i += 2
+        elif args[i] == '-c' and i + 1 < len(args):
+            if args[i + 1] == AUTO_FLAC_COMPRESSION:
+                options['flac_compression'] = AUTO_FLAC_COMPRESSION
+            else:
+                try:
+                    options['flac_compression'] = int(args[i + 1])
+                    if not 0 <= options['flac_compression'] <= 8:
+                        raise ValueError
+                except ValueError:
+                    print("错误: FLAC压缩级别必须是0-8或auto")
+                    sys.exit(1)
+            i += 2
+        elif args[i] == '--no-cache':
+            options['use_cache'] = False
+            i += 1
+        elif args[i] == '--list':
+            list_only = True
+            i += 1
+        elif args[i].startswith('-'):
+            print(f"警告: 未知选项 {args[i]}")
+            i += 1
+        else:
+            manifest_file = Path(args[i])
+            i += 1
+
+    if manifest_file is None:
+        print("错误: 请指定清单文件")
+        sys.exit(1)
+
+    try:
+        manifest = parse_album_manifest(manifest_file)
+    except (ValueError, OSError) as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
+    print(f"专辑: {manifest.tags.get('ALBUM', '（未命名）')}，共{len(manifest.tracks)}首")
+    for track in manifest.tracks:
+        print(f"  {track.number:>2}. {track.title}  <- {track.input_path.name}"
+              + (f"（歌词 {track.lrc_path.name}）" if track.lrc_path else ""))
+    problems = check_manifest(manifest)
+    for problem in problems:
+        print(f"错误: {problem}")
+    if problems:
+        sys.exit(1)
+    if list_only:
+        sys.exit(0)
+
+    if not check_ffmpeg():
+        print("错误: 未找到FFmpeg")
+        sys.exit(1)
+
+    jobs, threads = plan_concurrency(jobs)
+    limit_ffmpeg_threads(threads)
+    print(f"{describe_budget()}: {jobs}首同时转换，每个FFmpeg {threads}个线程")
+
+    results = convert_album(manifest, output_dir, jobs, **options)
+    failed = 0
+    print("\n转换结果:")
+    for track, result in results:
+        if result.success:
+            print(f"  ✓ {track.number:>2}. {result.output_path}")
+        else:
+            failed += 1
+            print(f"  ✗ {track.number:>2}. {track.input_path}" + (f"（{result.error}）" if result.error else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
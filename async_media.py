@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio接口
+在一个事件循环中同时运行多个转换，不需要为每个进行中的FFmpeg占用一个线程：
+ffprobe/FFmpeg用asyncio.create_subprocess_exec运行，进度以异步迭代器（ProgressStream）的形式给出，
+取消asyncio任务时终止正在运行的FFmpeg并删除任务的临时文件；封面下载和格式转换在线程池中进行，不阻塞事件循环
+每个asyncio任务有独立的任务上下文（见job_context），日志和结果互不影响
+"""
+
+import sys
+import asyncio
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, Optional, TextIO, Union
+
+from video_to_audio import (
+    DEFAULT_FLAC_COMPRESSION,
+    default_output_path,
+    flac_encode_command,
+    format_time,
+    process_media,
+    _stream_tags
+)
+from flac_metadata_utils import load_cover_bytes
+from compression_tuner import (
+    AUTO_FLAC_COMPRESSION,
+    DEFAULT_MIN_ENCODE_SPEED,
+    auto_tune_compression_async,
+    format_tune_report
+)
+from audio_streams import DEFAULT_STREAM_POLICY, resolve_audio_stream
+from media_probe import probe_media_async
+from media_trace import span, annotate, file_size
+from process_runner import ProcessCancelled, cancel_scope, run_process_async
+from conversion_cache import ConversionCache
+from job_context import JobContext, JobResult, update_result, scratch_path, sibling_temp_path
+
+# Constants
+# FFmpeg只输出错误信息，进度从-progress读取
+QUIET_ARGS = ['-nostdin', '-hide_banner', '-loglevel', 'error']
+
+_END = object()
+
+
+@dataclass
+class ConversionProgress:
+    """一条进度事件"""
+    stage: str                          # probe/tune/cover/cache/encode/remux/done/failed
+    fraction: Optional[float] = None    # 编码进度（0~1），总时长未知时为None
+    seconds: float = 0.0                # 已编码的音频秒数
+    speed: Optional[float] = None       # 编码速度（倍实时）
+    message: str = ''
+
+
+class ProgressStream:
+    """
+    进度事件的异步迭代器：async for event in progress
+    转换结束（成功、失败或被取消）后迭代结束
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._closed = False
+
+    def emit(self, event: ConversionProgress) -> None:
+        if not self._closed:
+            self._queue.put_nowait(event)
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._queue.put_nowait(_END)
+
+    def __aiter__(self) -> 'ProgressStream':
+        return self
+
+    async def __anext__(self) -> ConversionProgress:
+        event = await self._queue.get()
+        if event is _END:
+            raise StopAsyncIteration
+        return event
+
+
+class _ProgressParser:
+    """解析FFmpeg -progress 输出（约每0.5秒一组key=value，以progress=continue/end结束）"""
+
+    def __init__(self, total_seconds: Optional[float], emit: Callable[[ConversionProgress], None]):
+        self.total_seconds = total_seconds
+        self.emit = emit
+        self.seconds = 0.0
+        self.speed = None
+
+    def __call__(self, line: str) -> None:
+        key, _, value = line.partition('=')
+        value = value.strip()
+        if key in ('out_time_us', 'out_time_ms'):
+            # 两者的单位都是微秒
+            try:
+                self.seconds = max(int(value), 0) / 1_000_000
+            except ValueError:
+                pass
+        elif key == 'speed':
+            try:
+                self.speed = float(value.rstrip('x'))
+            except ValueError:
+                self.speed = None
+        elif key == 'progress':
+            fraction = None
+            if self.total_seconds:
+                fraction = 1.0 if value == 'end' else min(self.seconds / self.total_seconds, 1.0)
+            self.emit(ConversionProgress('encode', fraction, self.seconds, self.speed))
+
+
+async def process_media_async(input_path: str, output_path: Optional[str] = None,
+                              start_time: Optional[float] = None, duration: Optional[float] = None,
+                              lrc_path: Optional[str] = None,
+                              flac_compression: Union[int, str] = DEFAULT_FLAC_COMPRESSION,
+                              metadata_file: Optional[str] = None,
+                              min_encode_speed: float = DEFAULT_MIN_ENCODE_SPEED, use_cache: bool = True,
+                              extra_outputs: Optional[List[str]] = None, replaygain: bool = False,
+                              audio_stream: Union[int, str] = DEFAULT_STREAM_POLICY,
+                              audio_language: Optional[str] = None, subtitle_stream: Optional[int] = None,
+                              session_cache: bool = False, progress: Optional[ProgressStream] = None,
+                              log_sink: Optional[TextIO] = None) -> JobResult:
+    """
+    process_media的asyncio版本，参数相同，返回JobResult（见process_media_job）
+
+    progress: 接收进度事件的ProgressStream，转换结束时关闭
+    log_sink: 本任务日志的输出位置（默认为标准输出）
+
+    音频先编码为任务工作目录中的FLAC（使用与process_media相同的编码缓存），
+    再用一次流复制写入标签、歌词和封面；
+    附加输出、ReplayGain、字幕歌词和会话缓存仍由process_media在线程中完成（取消时同样会终止FFmpeg）
+    """
+    def emit(stage: str, message: str = '', fraction: Optional[float] = None) -> None:
+        if progress is not None:
+            progress.emit(ConversionProgress(stage, fraction, message=message))
+
+    success = False
+    try:
+        with JobContext('process_media_async', log_sink) as job:
+            with span('process_media_async'):
+                if extra_outputs or replaygain or subtitle_stream is not None or session_cache:
+                    success = await _process_media_in_thread(
+                        input_path, output_path, start_time=start_time, duration=duration, lrc_path=lrc_path,
+                        flac_compression=flac_compression, metadata_file=metadata_file,
+                        min_encode_speed=min_encode_speed, use_cache=use_cache, extra_outputs=extra_outputs,
+                        replaygain=replaygain, audio_stream=audio_stream, audio_language=audio_language,
+                        subtitle_stream=subtitle_stream, session_cache=session_cache)
+                else:
+                    try:
+                        success = await _convert(Path(input_path), output_path, start_time, duration,
+                                                 Path(lrc_path) if lrc_path else None, flac_compression,
+                                                 Path(metadata_file) if metadata_file else None,
+                                                 min_encode_speed, use_cache, audio_stream, audio_language,
+                                                 emit, progress)
+                    except Exception as e:
+                        print(f"错误: {e}")
+                        update_result(error=str(e))
+                        success = False
+            update_result(success=success)
+    finally:
+        if progress is not None:
+            emit('done' if success else 'failed', fraction=1.0 if success else None)
+            progress.close()
+    return job.result
+
+
+async def _process_media_in_thread(input_path: str, output_path: Optional[str], **options) -> bool:
+    """在线程中运行process_media；asyncio任务被取消时通过cancel_scope终止其中的FFmpeg，等线程结束后再抛出"""
+    cancelled = threading.Event()
+
+    def run() -> bool:
+        with cancel_scope(cancelled.is_set):
+            return process_media(input_path, output_path, **options)
+
+    # to_thread复制当前上下文，线程中的输出和结果仍属于本任务
+    future = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancelled.set()
+        try:
+            await future
+        except ProcessCancelled:
+            pass
+        raise
+
+
+async def _convert(input_path: Path, output_path: Optional[str], start_time: Optional[float],
+                   duration: Optional[float], lrc_path: Optional[Path], flac_compression: Union[int, str],
+                   metadata_file: Optional[Path], min_encode_speed: float, use_cache: bool,
+                   audio_stream: Union[int, str], audio_language: Optional[str],
+                   emit: Callable, progress: Optional[ProgressStream]) -> bool:
+    output_path = default_output_path(input_path, output_path, bool(lrc_path or metadata_file))
+
+    # 检查文件
+    if not input_path.exists():
+        print(f"错误: 文件 '{input_path}' 不存在")
+        return False
+    for label, path in (('LRC文件', lrc_path), ('元数据文件', metadata_file)):
+        if path and not path.exists():
+            print(f"错误: {label} '{path}' 不存在")
+            return False
+
+    annotate(input=str(input_path), output=str(output_path), bytes_in=file_size(input_path))
+    update_result(input_path=str(input_path), output_path=str(output_path))
+    print(f"\n输入文件: {input_path}")
+    print(f"输出文件: {output_path}")
+    if start_time is not None:
+        print(f"开始时间: {format_time(start_time)}")
+    if duration is not None:
+        print(f"持续时间: {format_time(duration)}")
+
+    emit('probe')
+    info = await probe_media_async(input_path)
+    # 探测结果已在缓存中，选择音频流不再运行ffprobe
+    audio_selection = resolve_audio_stream(input_path, audio_stream, audio_language)
+
+    tags, cover_input = _stream_tags(lrc_path, metadata_file)
+    cover_path = None
+    if cover_input:
+        emit('cover')
+        cover_data = await asyncio.to_thread(load_cover_bytes, cover_input)
+        if cover_data:
+            cover_path = scratch_path('.png' if cover_data.startswith(b'\x89PNG') else '.jpg', 'cover_')
+            await asyncio.to_thread(cover_path.write_bytes, cover_data)
+        else:
+            print("警告：未能读取封面图片")
+
+    # 只添加歌词/元数据时直接复制FLAC中的音频
+    if input_path.suffix.lower() == '.flac' and start_time is None and duration is None and tags:
+        audio_path = input_path
+    else:
+        audio_path = scratch_path('.flac', 'audio_')
+        total = duration
+        if total is None and info is not None and info.duration is not None:
+            total = max(info.duration - (start_time or 0.0), 0.0)
+        returncode = await _encode_cached(input_path, audio_path, start_time, duration, flac_compression,
+                                          min_encode_speed, audio_selection, use_cache, total, emit, progress)
+        update_result(returncode=returncode)
+        if returncode != 0:
+            print(f"处理失败，返回码: {returncode}")
+            return False
+
+    emit('remux')
+    returncode = await _remux(audio_path, output_path, tags, cover_path)
+    if returncode != 0:
+        print(f"写入标签失败，返回码: {returncode}")
+        return False
+
+    annotate(bytes_out=file_size(output_path))
+    print("处理成功!")
+    print(f"文件大小: {output_path.stat().st_size / (1024 * 1024):.2f} MB")
+    return True
+
+
+async def _encode_cached(input_path: Path, audio_path: Path, start_time: Optional[float],
+                         duration: Optional[float], flac_compression: Union[int, str], min_encode_speed: float,
+                         audio_selection, use_cache: bool, total_seconds: Optional[float],
+                         emit: Callable, progress: Optional[ProgressStream]) -> int:
+    """
+    把选中的音频编码到audio_path，返回FFmpeg返回码
+    缓存键与process_media相同；不持有缓存锁（锁会阻塞事件循环），同时转换同一输入时可能重复编码，缓存条目原子替换
+    """
+    cache = None
+    cache_key = None
+    if use_cache:
+        try:
+            cache = ConversionCache()
+        except OSError as e:
+            print(f"警告: 无法使用编码缓存（{e}）")
+    if cache is not None:
+        cache_key = await asyncio.to_thread(
+            cache.key_for, input_path, start_time=start_time, duration=duration,
+            flac_compression=flac_compression, replaygain=False, audio_map=audio_selection[1],
+            min_encode_speed=min_encode_speed if flac_compression == AUTO_FLAC_COMPRESSION else None)
+        cached_method = await asyncio.to_thread(cache.fetch, cache_key, audio_path)
+        if cached_method:
+            annotate(cache_hit=cached_method)
+            update_result(cache_hit=cached_method)
+            emit('cache', f"使用缓存的编码结果（{cached_method}）")
+            print(f"使用缓存的编码结果（{cached_method}），跳过音频编码")
+            return 0
+
+    level = flac_compression
+    if level == AUTO_FLAC_COMPRESSION:
+        emit('tune')
+        print("\n正在自动选择压缩级别...")
+        level, tune_report = await auto_tune_compression_async(input_path, start_time, duration,
+                                                               min_speed=min_encode_speed,
+                                                               audio_selection=audio_selection)
+        print(format_tune_report(tune_report))
+        if level is None:
+            level = DEFAULT_FLAC_COMPRESSION
+            print(f"取样失败，使用默认压缩级别 {level}")
+        else:
+            print(f"自动选择压缩级别: {level}")
+        update_result(tune_report=tune_report)
+    update_result(compression_level=level)
+
+    cmd = flac_encode_command(input_path, audio_path, start_time, duration, level, audio_selection)
+    cmd[1:1] = [*QUIET_ARGS, '-nostats', '-progress', 'pipe:1']
+    emit('encode', fraction=0.0 if total_seconds else None)
+    parser = _ProgressParser(total_seconds, progress.emit if progress is not None else lambda event: None)
+    with span('ffmpeg_encode', bytes_in=file_size(input_path), compression_level=level) as encode_span:
+        result = await run_process_async(cmd, 'ffmpeg_encode', capture_output=True, line_handler=parser)
+        encode_span.set(bytes_out=file_size(audio_path))
+    if result.returncode != 0:
+        _print_stderr(result.stderr)
+    elif cache_key:
+        with span('cache_store', bytes_in=file_size(audio_path)):
+            await asyncio.to_thread(cache.store, cache_key, audio_path)
+    return result.returncode
+
+
+async def _remux(audio_path: Path, output_path: Path, tags, cover_path: Optional[Path]) -> int:
+    """流复制音频，写入标签、歌词和封面，完成后原子替换输出文件"""
+    temp_output = sibling_temp_path(output_path, 'temp_async')
+    cmd = ['ffmpeg', *QUIET_ARGS, '-i', str(audio_path)]
+    if cover_path:
+        cmd.extend(['-i', str(cover_path)])
+    cmd.extend(['-map', '0:a', '-c:a', 'copy'])
+    if cover_path:
+        cmd.extend(['-map', '1:v', '-c:v', 'copy', '-disposition:v', 'attached_pic'])
+    else:
+        # 保留输入FLAC中原有的封面
+        cmd.extend(['-map', '0:v?', '-c:v', 'copy'])
+    for tag, value in tags.items():
+        cmd.extend(['-metadata', f"{tag}={value}"])
+    cmd.extend(['-f', 'flac', '-y', str(temp_output)])
+
+    try:
+        with span('ffmpeg_remux', tags=len(tags), cover=bool(cover_path)) as remux_span:
+            result = await run_process_async(cmd, 'ffmpeg_remux', capture_output=True)
+            remux_span.set(bytes_out=file_size(temp_output))
+        if result.returncode != 0:
+            _print_stderr(result.stderr)
+            return result.returncode
+        temp_output.replace(output_path)
+        return 0
+    finally:
+        temp_output.unlink(missing_ok=True)
+
+
+def _print_stderr(stderr: Optional[bytes]) -> None:
+    if stderr:
+        print(stderr.decode('utf-8', errors='replace').rstrip())
+
+
+async def _main(paths: List[str]) -> int:
+    """转换多个文件（同时进行），显示进度"""
+    async def convert(path: str) -> JobResult:
+        progress = ProgressStream()
+        task = asyncio.create_task(process_media_async(path, progress=progress, log_sink=sys.stderr))
+        async for event in progress:
+            if event.stage == 'encode' and event.fraction is not None:
+                print(f"{Path(path).name}: {event.fraction * 100:5.1f}%", file=sys.stderr)
+        return await task
+
+    results = await asyncio.gather(*(convert(path) for path in paths))
+    for result in results:
+        print(f"{'成功' if result.success else '失败'}: {result.input_path} -> {result.output_path} "
+              f"({result.elapsed:.1f}秒)")
+    return 0 if all(result.success for result in results) else 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print("用法: python async_media.py <媒体文件>...")
+        print("在一个事件循环中同时把多个文件转换为FLAC（默认输出文件名）")
+        sys.exit(0)
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+曲库重复检测（声学指纹）
+同一首歌常来自多个MV，转换出的FLAC裁剪位置和响度都不同，文件哈希无法识别。
+每个文件解码为低采样率单声道PCM，用NumPy批量计算分帧频谱，按对数频带能量的时间/频率差分符号
+得到每帧一个32位子指纹（与增益无关）；指纹保存在SQLite索引中，文件未变化时不会重新解码。
+
+查找时不两两比较：按子指纹的值抽取约1/16的帧建立有序倒排表，每个文件的子指纹用二分查找命中候选，
+按帧偏移差投票（裁剪只改变偏移，同一首歌的命中集中在同一个偏移上），
+只对得票足够的候选对齐完整指纹、计算比特误差率，区分重复和近似重复
+"""
+
+import json
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from process_runner import run_process
+from media_trace import span, traced, file_size
+from conversion_cache import default_cache_dir
+from audio_streams import DEMUX_IGNORE_ARGS, DEFAULT_AUDIO_MAP
+from cpu_budget import ffmpeg_thread_args, parse_jobs, plan_concurrency, limit_ffmpeg_threads, describe_budget
+from flac_metadata_utils import collect_flac_files
+
+# Constants
+FINGERPRINT_VERSION = 1
+FP_SAMPLE_RATE = 5512             # 指纹用的解码采样率（只需要300~2000Hz）
+FRAME_SAMPLES = 1024              # 每帧约186ms
+HOP_SAMPLES = 256                 # 帧移约46ms，裁剪位置不在帧边界上时相邻帧仍大部分重叠
+FRAMES_PER_SECOND = FP_SAMPLE_RATE / HOP_SAMPLES
+BAND_COUNT = 33                   # 33个对数频带 -> 32个频率差分 -> 每帧32位
+BAND_LOW_HZ = 300.0
+BAND_HIGH_HZ = 2000.0
+FFT_BATCH_FRAMES = 2048           # 每批做FFT的帧数（限制长文件的内存占用）
+SILENCE_RATIO = 1e-4              # 帧能量低于中位数的该比例视为静音，子指纹记为0（不参与索引和比较）
+INDEX_SAMPLE_SHIFT = 28           # 子指纹混合后高4位为0的帧进入倒排表（约1/16）
+MAX_HASH_POSTINGS = 64            # 出现次数超过该值的子指纹区分度太低，查找时忽略
+QUERY_FLIP_BITS = 5               # 查找时同时尝试翻转每帧最不可靠的几位（有损转码后整帧32位完全一致的概率很低）
+MIN_VOTES = 4                     # 同一偏移上的最少命中数，达到后才对齐比较
+MIN_OVERLAP_SECONDS = 10.0
+DUPLICATE_BER = 0.20              # 比特误差率不超过该值且覆盖较短文件的大部分：重复
+NEAR_DUPLICATE_BER = 0.32         # 不超过该值：近似重复（不同混音、部分重叠等）；无关音频约为0.5
+DUPLICATE_COVERAGE = 0.9
+DEFAULT_DEDUPE_REPORT = 'dedupe_report.json'
+
+MATCH_DUPLICATE = 'duplicate'
+MATCH_NEAR_DUPLICATE = 'near_duplicate'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    frames INTEGER NOT NULL,
+    fingerprint BLOB NOT NULL,
+    weak_bits BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    hash INTEGER NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    frame INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS postings_file ON postings(file_id);
+"""
+
+
+def default_index_path() -> Path:
+    """指纹索引默认保存在编码缓存目录下"""
+    return default_cache_dir() / 'fingerprints.db'
+
+
+def _band_edges() -> np.ndarray:
+    """频带边界在rfft结果中的下标（对数间隔），相邻边界至少相差一个频点"""
+    bin_hz = FP_SAMPLE_RATE / FRAME_SAMPLES
+    edges = np.round(np.geomspace(BAND_LOW_HZ, BAND_HIGH_HZ, BAND_COUNT + 1) / bin_hz).astype(np.int64)
+    steps = np.arange(len(edges))
+    return np.maximum.accumulate(edges - steps) + steps
+
+
+BAND_EDGES = _band_edges()
+
+
+def band_energies(samples: np.ndarray) -> np.ndarray:
+    """把样本分帧（汉宁窗）并按对数频带求能量，返回形状为(帧数, BAND_COUNT)的float32数组"""
+    if len(samples) < FRAME_SAMPLES:
+        return np.empty((0, BAND_COUNT), dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples.astype(np.float32), FRAME_SAMPLES)[::HOP_SAMPLES]
+    window = np.hanning(FRAME_SAMPLES).astype(np.float32)
+    energies = np.empty((len(frames), BAND_COUNT), dtype=np.float32)
+    low, high = BAND_EDGES[0], BAND_EDGES[-1]
+    for start in range(0, len(frames), FFT_BATCH_FRAMES):
+        spectrum = np.fft.rfft(frames[start:start + FFT_BATCH_FRAMES] * window, axis=1)[:, low:high]
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        energies[start:start + len(power)] = np.add.reduceat(power, BAND_EDGES[:-1] - low, axis=1)
+    return energies
+
+
+def compute_fingerprint(samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    由FP_SAMPLE_RATE单声道样本计算子指纹序列（uint32，每帧一个，比帧数少一个）
+    第m位 = (E[n,m] - E[n,m+1]) - (E[n-1,m] - E[n-1,m+1]) > 0，E为对数频带能量；
+    整体增益只给E加一个常数，差分后抵消。静音帧的子指纹为0
+    返回(子指纹, 每帧最不可靠的QUERY_FLIP_BITS位的位置)，差分的绝对值越小越容易被转码翻转
+    """
+    energies = band_energies(samples)
+    if len(energies) < 2:
+        return np.empty(0, dtype=np.uint32), np.empty((0, QUERY_FLIP_BITS), dtype=np.uint8)
+    log_energy = np.log(energies + 1e-6)
+    band_diff = log_energy[:, :-1] - log_energy[:, 1:]
+    difference = band_diff[1:] - band_diff[:-1]
+    hashes = np.packbits(difference > 0, axis=1, bitorder='little').view('<u4').ravel().astype(np.uint32)
+    weak_bits = np.argpartition(np.abs(difference), QUERY_FLIP_BITS, axis=1)[:, :QUERY_FLIP_BITS].astype(np.uint8)
+
+    loudness = energies.sum(axis=1)
+    silent = loudness < max(float(np.median(loudness)) * SILENCE_RATIO, 1e-3)
+    hashes[silent[1:] | silent[:-1]] = 0
+    return hashes, weak_bits
+
+
+def query_variants(hashes: np.ndarray, weak_bits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    每个非静音帧的子指纹及其翻转不可靠位的所有组合（2**QUERY_FLIP_BITS个），返回(查询值, 帧号)
+    """
+    frames = np.flatnonzero(hashes)
+    flips = (np.arange(2 ** weak_bits.shape[1])[:, None] >> np.arange(weak_bits.shape[1])) & 1
+    masks = np.bitwise_or.reduce(flips[:, None, :].astype(np.uint32) << weak_bits[frames][None, :, :].astype(np.uint32),
+                                 axis=2)
+    return (hashes[frames][None, :] ^ masks).ravel(), np.tile(frames, len(flips))
+
+
+def index_sample(hashes: np.ndarray) -> np.ndarray:
+    """按子指纹的值（而不是帧位置）抽样进入倒排表，同一段音频无论裁剪位置如何都会抽到相同的帧"""
+    mixed = (hashes.astype(np.uint64) * np.uint64(2654435761)) & np.uint64(0xFFFFFFFF)
+    return np.flatnonzero(((mixed >> np.uint64(INDEX_SAMPLE_SHIFT)) == 0) & (hashes != 0))
+
+
+def bit_error_rate(a: np.ndarray, b: np.ndarray, delta: int) -> Tuple[float, int]:
+    """
+    把b相对a偏移delta帧（a的第i帧对应b的第i+delta帧）后比较重叠部分
+    返回(比特误差率, 参与比较的帧数)，两边都不是静音的帧才参与
+    """
+    start = max(0, -delta)
+    end = min(len(a), len(b) - delta)
+    if end <= start:
+        return 1.0, 0
+    left = a[start:end]
+    right = b[start + delta:end + delta]
+    valid = (left != 0) & (right != 0)
+    count = int(valid.sum())
+    if count == 0:
+        return 1.0, 0
+    errors = int(np.unpackbits((left[valid] ^ right[valid]).view(np.uint8)).sum())
+    return errors / (32 * count), count
+
+
+@traced('fingerprint_decode')
+def decode_for_fingerprint(media_path: Union[str, Path]) -> Optional[np.ndarray]:
+    """把第一条音频流解码为FP_SAMPLE_RATE单声道PCM（一首歌约2MB），失败时返回None"""
+    cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', *ffmpeg_thread_args(), *DEMUX_IGNORE_ARGS,
+           '-i', str(media_path), '-map', DEFAULT_AUDIO_MAP,
+           '-ac', '1', '-ar', str(FP_SAMPLE_RATE), '-f', 's16le', '-acodec', 'pcm_s16le', 'pipe:1']
+    with span('ffmpeg_fingerprint', bytes_in=file_size(media_path)):
+        result = run_process(cmd, 'ffmpeg_fingerprint', capture_output=True)
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return np.frombuffer(result.stdout, dtype='<i2')
+
+
+def fingerprint_file(media_path: Union[str, Path]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """解码并计算一个文件的指纹（见compute_fingerprint），失败时返回None"""
+    samples = decode_for_fingerprint(media_path)
+    if samples is None:
+        return None
+    with span('fingerprint_compute', samples=len(samples)):
+        return compute_fingerprint(samples)
+
+
+@dataclass
+class DuplicateMatch:
+    """两个文件的匹配结果；offset为second相对first的开始时间差（秒，正数表示second裁掉了开头）"""
+    first: str
+    second: str
+    kind: str
+    bit_error_rate: float
+    overlap_seconds: float
+    offset_seconds: float
+    first_seconds: float
+    second_seconds: float
+
+    def to_dict(self) -> Dict:
+        return {
+            'first': self.first,
+            'second': self.second,
+            'kind': self.kind,
+            'bit_error_rate': round(self.bit_error_rate, 4),
+            'overlap_seconds': round(self.overlap_seconds, 1),
+            'offset_seconds': round(self.offset_seconds, 2),
+            'first_seconds': round(self.first_seconds, 1),
+            'second_seconds': round(self.second_seconds, 1),
+        }
+
+
+class PostingTable:
+    """内存中的有序倒排表：子指纹值 -> (文件id, 帧号)，查找为向量化的二分查找"""
+
+    def __init__(self, hashes: np.ndarray, file_ids: np.ndarray, frames: np.ndarray):
+        order = np.argsort(hashes, kind='stable')
+        hashes, file_ids, frames = hashes[order], file_ids[order], frames[order]
+        values, starts, counts = np.unique(hashes, return_index=True, return_counts=True)
+        # 去掉出现次数过多的子指纹（常见的频谱形状），否则会给大量无关文件投票
+        keep = counts <= MAX_HASH_POSTINGS
+        self.values = values[keep]
+        self.starts = starts[keep]
+        self.counts = counts[keep]
+        self.file_ids = file_ids
+        self.frames = frames
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    def lookup(self, query: np.ndarray, query_frames: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        查找每个查询值，返回所有命中的(文件id, 帧偏移差)
+        帧偏移差 = 命中文件中的帧号 - 查询帧号
+        """
+        # 查询值先排序，二分查找按顺序访问倒排表（乱序查找几百万条的表时大部分时间耗在缓存未命中上）
+        order = np.argsort(query)
+        query, query_frames = query[order], query_frames[order]
+        position = np.searchsorted(self.values, query).clip(max=max(len(self.values) - 1, 0))
+        found = np.flatnonzero(self.values[position] == query) if len(self.values) else position[:0]
+        counts = self.counts[position[found]]
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        # 把每个命中值的[start, start + count)区间展开为连续的下标
+        positions = np.repeat(self.starts[position[found]] - np.cumsum(counts) + counts, counts) + np.arange(total)
+        deltas = self.frames[positions] - np.repeat(query_frames[found], counts)
+        return self.file_ids[positions], deltas
+
+
+def vote_candidates(file_ids: np.ndarray, deltas: np.ndarray, min_votes: int = MIN_VOTES) -> List[Tuple[int, int, int]]:
+    """
+    按(文件id, 帧偏移差)统计命中数，相邻偏移差（帧边界不对齐时命中会分散到两个偏移上）合并计票
+    返回每个文件得票最多的偏移 [(文件id, 偏移差, 票数), ...]，只保留票数达到min_votes的
+    """
+    if len(file_ids) == 0:
+        return []
+    span_width = int(deltas.max() - deltas.min()) + 3
+    keys = file_ids.astype(np.int64) * span_width + (deltas - deltas.min() + 1)
+    unique_keys, counts = np.unique(keys, return_counts=True)
+    neighbours = counts.copy()
+    for shift in (-1, 1):
+        position = np.searchsorted(unique_keys, unique_keys + shift)
+        position = position.clip(max=len(unique_keys) - 1)
+        neighbours += np.where(unique_keys[position] == unique_keys + shift, counts[position], 0)
+
+    candidate_ids = unique_keys // span_width
+    best: Dict[int, Tuple[int, int]] = {}
+    for index in np.flatnonzero(neighbours >= min_votes):
+        file_id = int(candidate_ids[index])
+        if file_id not in best or neighbours[index] > best[file_id][1]:
+            delta = int(unique_keys[index] % span_width) + int(deltas.min()) - 1
+            best[file_id] = (delta, int(neighbours[index]))
+    return [(file_id, delta, votes) for file_id, (delta, votes) in best.items()]
+
+
+def classify_match(ber: float, overlap_frames: int, first_frames: int, second_frames: int) -> Optional[str]:
+    """
+    按比特误差率和重叠长度判断匹配类型，不算重复时返回None
+    帧数都只计非静音帧：重叠覆盖较短文件的DUPLICATE_COVERAGE以上才算重复（较短的一方是另一方裁剪后的版本）
+    """
+    if ber > NEAR_DUPLICATE_BER or overlap_frames / FRAMES_PER_SECOND < MIN_OVERLAP_SECONDS:
+        return None
+    shorter = max(min(first_frames, second_frames), 1)
+    if ber <= DUPLICATE_BER and overlap_frames >= shorter * DUPLICATE_COVERAGE:
+        return MATCH_DUPLICATE
+    return MATCH_NEAR_DUPLICATE
+
+
+class FingerprintIndex:
+    """SQLite指纹索引：每个文件的完整子指纹和抽样后的倒排表；按路径、大小和修改时间判断是否需要重新计算"""
+
+    def __init__(self, db_path: Union[str, Path]):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path))
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> 'FingerprintIndex':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def stale_files(self, paths: List[Path]) -> List[Path]:
+        """索引中没有、或大小/修改时间已变化的文件"""
+        known = {row[0]: row[1:] for row in self._conn.execute(
+            "SELECT path, size, mtime_ns, version FROM files")}
+        stale = []
+        for path in paths:
+            stat = path.stat()
+            if known.get(str(path)) != (stat.st_size, stat.st_mtime_ns, FINGERPRINT_VERSION):
+                stale.append(path)
+        return stale
+
+    def store(self, path: Path, hashes: np.ndarray, weak_bits: np.ndarray) -> None:
+        stat = path.stat()
+        sampled = index_sample(hashes)
+        with self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (str(path),))
+            cursor = self._conn.execute(
+                "INSERT INTO files (path, size, mtime_ns, version, frames, fingerprint, weak_bits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(path), stat.st_size, stat.st_mtime_ns, FINGERPRINT_VERSION, len(hashes),
+                 hashes.astype('<u4').tobytes(), weak_bits.astype(np.uint8).tobytes()))
+            file_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO postings (hash, file_id, frame) VALUES (?, ?, ?)",
+                ((int(hashes[frame]), file_id, int(frame)) for frame in sampled))
+
+    def prune_missing(self) -> int:
+        """删除已不存在的文件的记录，返回删除数"""
+        missing = [(row[0],) for row in self._conn.execute("SELECT path FROM files")
+                   if not Path(row[0]).exists()]
+        with self._conn:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", missing)
+        return len(missing)
+
+    def file_ids(self, paths: Optional[List[Path]] = None) -> Dict[int, str]:
+        """已建立索引的文件 {id: 路径}，paths不为空时只返回其中的文件"""
+        wanted = {str(path) for path in paths} if paths is not None else None
+        return {row[0]: row[1] for row in self._conn.execute("SELECT id, path FROM files")
+                if wanted is None or row[1] in wanted}
+
+    def load_fingerprint(self, file_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(子指纹, 不可靠位的位置)"""
+        row = self._conn.execute("SELECT fingerprint, weak_bits FROM files WHERE id = ?", (file_id,)).fetchone()
+        return np.frombuffer(row[0], dtype='<u4'), np.frombuffer(row[1], dtype=np.uint8).reshape(-1, QUERY_FLIP_BITS)
+
+    def posting_table(self, file_ids: Dict[int, str]) -> PostingTable:
+        """读取倒排表到内存（每个文件约几百条），只保留file_ids中的文件"""
+        rows = np.array(self._conn.execute("SELECT hash, file_id, frame FROM postings").fetchall(),
+                        dtype=np.int64).reshape(-1, 3)
+        rows = rows[np.isin(rows[:, 1], np.fromiter(file_ids, dtype=np.int64, count=len(file_ids)))]
+        return PostingTable(rows[:, 0].astype(np.uint32), rows[:, 1], rows[:, 2])
+
+
+def update_index(index: FingerprintIndex, paths: List[Path], workers: int = 1) -> Tuple[int, List[str]]:
+    """为新增或变化的文件计算指纹并写入索引（并行解码，写入在主线程），返回(更新数, 失败的文件)"""
+    stale = index.stale_files(paths)
+    if not stale:
+        return 0, []
+    print(f"正在计算 {len(stale)} 个文件的指纹（{workers}个并行）...")
+    updated = 0
+    failed = []
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        futures = {pool.submit(fingerprint_file, path): path for path in stale}
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"警告: 计算指纹失败 {path}: {e}")
+                result = None
+            if result is None or not np.any(result[0]):
+                failed.append(str(path))
+                continue
+            index.store(path, *result)
+            updated += 1
+            if done % 100 == 0:
+                print(f"[{done}/{len(stale)}] 已计算")
+    return updated, failed
+
+
+def find_duplicates(index: FingerprintIndex, paths: Optional[List[Path]] = None) -> List[DuplicateMatch]:
+    """
+    在索引（或其中的paths）里查找重复：每个文件只查找倒排表并对得票足够的候选做对齐比较，
+    耗时与文件数成线性关系，而不是两两比较
+    """
+    file_ids = index.file_ids(paths)
+    with span('dedupe_postings') as load_span:
+        table = index.posting_table(file_ids)
+        load_span.set(postings=len(table))
+
+    matches = []
+    with span('dedupe_search', files=len(file_ids)) as search_span:
+        for file_id in sorted(file_ids):
+            hashes, weak_bits = index.load_fingerprint(file_id)
+            hit_ids, deltas = table.lookup(*query_variants(hashes, weak_bits))
+            for other_id, delta, _ in vote_candidates(hit_ids, deltas):
+                # 每对文件只在id较大的一方查找时比较一次
+                if other_id >= file_id:
+                    continue
+                other = index.load_fingerprint(other_id)[0]
+                # 得票的偏移可能差一帧，在相邻偏移中取误差率最低的
+                ber, overlap, offset_frames = min((*bit_error_rate(hashes, other, shift), shift)
+                                                  for shift in (delta - 1, delta, delta + 1))
+                kind = classify_match(ber, overlap, int(np.count_nonzero(hashes)), int(np.count_nonzero(other)))
+                if kind is None:
+                    continue
+                matches.append(DuplicateMatch(
+                    first=file_ids[other_id], second=file_ids[file_id], kind=kind, bit_error_rate=ber,
+                    overlap_seconds=overlap / FRAMES_PER_SECOND,
+                    offset_seconds=offset_frames / FRAMES_PER_SECOND,
+                    first_seconds=len(other) / FRAMES_PER_SECOND,
+                    second_seconds=len(hashes) / FRAMES_PER_SECOND))
+        search_span.set(matches=len(matches))
+    return matches
+
+
+def group_matches(matches: List[DuplicateMatch]) -> List[List[str]]:
+    """把两两匹配合并为重复组（并查集），每组按路径排序"""
+    parent: Dict[str, str] = {}
+
+    def root(path: str) -> str:
+        parent.setdefault(path, path)
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    for match in matches:
+        parent[root(match.first)] = root(match.second)
+    groups: Dict[str, List[str]] = {}
+    for path in parent:
+        groups.setdefault(root(path), []).append(path)
+    return sorted(sorted(group) for group in groups.values())
+
+
+def dedupe_library(sources: List[Union[str, Path]], index_path: Optional[Union[str, Path]] = None,
+                   workers: int = 1, report_path: Optional[Union[str, Path]] = DEFAULT_DEDUPE_REPORT) -> Dict:
+    """更新指纹索引并查找sources中的重复文件，结果写入JSON报告并返回"""
+    files = [path.resolve() for path in collect_flac_files(sources)]
+    started = time.perf_counter()
+    with FingerprintIndex(index_path or default_index_path()) as index:
+        pruned = index.prune_missing()
+        updated, failed = update_index(index, files, workers)
+        print(f"指纹索引: 新增/更新{updated}个，删除{pruned}个已不存在的文件")
+        matches = find_duplicates(index, files)
+
+    report = {
+        'generated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'files': len(files),
+        'seconds': round(time.perf_counter() - started, 1),
+        'failed': failed,
+        'groups': group_matches(matches),
+        'matches': [match.to_dict() for match in sorted(matches, key=lambda m: (m.first, m.second))],
+    }
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"重复检测报告: {report_path}")
+    return report
+
+
+def format_match(match: DuplicateMatch) -> str:
+    label = '重复' if match.kind == MATCH_DUPLICATE else '近似重复'
+    return (f"  [{label}] 误差率{match.bit_error_rate:.1%}，重叠{match.overlap_seconds:.0f}秒，"
+            f"偏移{match.offset_seconds:+.1f}秒\n"
+            f"    {match.first} ({match.first_seconds:.0f}秒)\n"
+            f"    {match.second} ({match.second_seconds:.0f}秒)")
+
+
+def print_help():
+    """打印帮助信息"""
+    print("""
+曲库重复检测（声学指纹）
+
+用法:
+    python audio_dedupe.py <目录或FLAC文件>... [选项]
+
+选项:
+    -j, --jobs N|auto     并行计算指纹的文件数（默认: auto，按CPU预算）
+    --index <文件>        指纹索引数据库（默认: 缓存目录下的fingerprints.db）
+    --report <文件>       JSON报告（默认: dedupe_report.json）
+    -h, --help            显示帮助
+
+说明:
+    - 首次运行为每个文件计算指纹（解码为5.5kHz单声道），之后只计算新增或修改过的文件
+    - 裁剪位置和音量不同的同一首歌会被识别为重复；不同版本、部分重叠的报告为近似重复
+    - 只生成报告，不删除任何文件
+    - 有重复时以返回码2退出
+
+示例:
+    python audio_dedupe.py /music
+    python audio_dedupe.py /music /downloads -j 8 --report dupes.json
+    """)
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] in ('-h', '--help'):
+        print_help()
+        sys.exit(0)
+
+    sources = []
+    jobs = None
+    index_path = None
+    report_path = DEFAULT_DEDUPE_REPORT
+    i = 0
+    while i < len(args):
+        if args[i] in ('-j', '--jobs') and i + 1 < len(args):
+            try:
+                jobs = parse_jobs(args[i + 1])
+            except ValueError:
+                print("错误: -j 必须是正整数或auto")
+                sys.exit(1)
+            i += 2
+        elif args[i] == '--index' and i + 1 < len(args):
+            index_path = args[i + 1]
+            i += 2
+        elif args[i] == '--report' and i + 1 < len(args):
+            report_path = args[i + 1]
+            i += 2
+        elif args[i].startswith('-'):
+            print(f"警告: 未知选项 {args[i]}")
+            i += 1
+        else:
+            sources.append(args[i])
+            i += 1
+
+    if not sources:
+        print("错误: 请指定要检查的目录或FLAC文件")
+        sys.exit(1)
+
+    jobs, threads = plan_concurrency(jobs)
+    limit_ffmpeg_threads(threads)
+    print(describe_budget())
+    report = dedupe_library(sources, index_path, jobs, report_path)
+
+    matches = report['matches']
+    for match in matches:
+        print(format_match(DuplicateMatch(**match)))
+    print(f"检查了{report['files']}个文件：{len(report['groups'])}组重复"
+          f"（{sum(m['kind'] == MATCH_DUPLICATE for m in matches)}对重复，"
+          f"{sum(m['kind'] == MATCH_NEAR_DUPLICATE for m in matches)}对近似重复）")
+    if report['failed']:
+        print(f"无法计算指纹: {len(report['failed'])}个文件")
+    sys.exit(2 if matches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多音轨容器的音频流选择
+FFmpeg默认按自己的规则挑选音频流，MKV中有解说音轨、立体声缩混和无损5.1等多条音轨时经常选错。
+这里从探测缓存（media_probe）读取所有音频流，按策略（无损优先、声道数优先、采样率优先、语言、明确的序号）选出一条，
+转换时只-map这一条；视频、字幕、数据流和其余音频流在解复用时就丢弃，不再解码
+"""
+
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from media_trace import traced, annotate
+from media_probe import MediaStream, probe_media
+
+# Constants
+STREAM_POLICY_LOSSLESS = 'lossless'   # 无损优先，其次声道数、采样率（默认）
+STREAM_POLICY_CHANNELS = 'channels'   # 声道数优先
+STREAM_POLICY_RATE = 'rate'           # 采样率/位深优先
+STREAM_POLICIES = (STREAM_POLICY_LOSSLESS, STREAM_POLICY_CHANNELS, STREAM_POLICY_RATE)
+DEFAULT_STREAM_POLICY = STREAM_POLICY_LOSSLESS
+
+# 无探测结果时的映射（与之前的行为一致）
+DEFAULT_AUDIO_MAP = '0:a:0'
+# 放在-i之前：视频、字幕、数据流在解复用时丢弃
+DEMUX_IGNORE_ARGS = ['-vn', '-sn', '-dn']
+
+LOSSLESS_CODECS = {'flac', 'alac', 'truehd', 'mlp', 'wavpack', 'tta', 'ape', 'tak', 'shorten', 'mp4als'}
+COMMENTARY_KEYWORDS = ('commentary', '解说', '评论')
+
+
+def _is_lossless(stream: MediaStream) -> bool:
+    codec = stream.codec
+    if codec in LOSSLESS_CODECS or codec.startswith('pcm_'):
+        return True
+    # DTS-HD MA的codec_name是dts，用profile区分
+    return codec == 'dts' and 'MA' in stream.profile
+
+
+@traced('probe_audio_streams')
+def probe_audio_streams(media_path: Union[str, Path]) -> Optional[List[Dict[str, Any]]]:
+    """
+    列出所有音频流，探测失败时返回None
+    每项包含index（在文件中的序号）、audio_index（第几条音频流，对应-map 0:a:N）、
+    codec、channels、sample_rate、bits、language、title、default、commentary、lossless
+    """
+    info = probe_media(media_path)
+    if info is None:
+        return None
+
+    streams = []
+    for audio_index, stream in enumerate(info.audio_streams):
+        tags = {key.lower(): value for key, value in stream.tags.items()}
+        title = tags.get('title', '')
+        streams.append({
+            'index': stream.index,
+            'audio_index': audio_index,
+            'codec': stream.codec,
+            'channels': stream.channels,
+            'sample_rate': stream.sample_rate,
+            'bits': stream.bits,
+            'language': tags.get('language', ''),
+            'title': title,
+            'default': bool(stream.disposition.get('default')),
+            'commentary': bool(stream.disposition.get('comment')) or
+                          any(keyword in title.lower() for keyword in COMMENTARY_KEYWORDS),
+            'lossless': _is_lossless(stream),
+        })
+    return streams
+
+
+def _rank(stream: Dict[str, Any], policy: str) -> Tuple:
+    """排序键，越大越好；最后按默认标记和文件中的先后顺序"""
+    tail = (stream['default'], -stream['audio_index'])
+    if policy == STREAM_POLICY_CHANNELS:
+        return (stream['channels'], stream['lossless'], stream['sample_rate'], stream['bits']) + tail
+    if policy == STREAM_POLICY_RATE:
+        return (stream['sample_rate'], stream['bits'], stream['lossless'], stream['channels']) + tail
+    return (stream['lossless'], stream['channels'], stream['sample_rate'], stream['bits']) + tail
+
+
+def select_audio_stream(streams: List[Dict[str, Any]], policy: Union[int, str] = DEFAULT_STREAM_POLICY,
+                        language: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    按策略选出一条音频流
+    policy为整数时直接取第几条音频流（超出范围返回None）；
+    指定language时只在该语言的音轨中选择（没有该语言时忽略语言）；解说音轨只在没有其他音轨时才会被选中
+    """
+    if not streams:
+        return None
+    if isinstance(policy, int):
+        return streams[policy] if 0 <= policy < len(streams) else None
+
+    candidates = streams
+    if language:
+        matching = [s for s in streams if s['language'].lower() == language.lower()]
+        if matching:
+            candidates = matching
+        else:
+            print(f"警告: 没有语言为 '{language}' 的音轨，忽略语言条件")
+    candidates = [s for s in candidates if not s['commentary']] or candidates
+    return max(candidates, key=lambda stream: _rank(stream, policy))
+
+
+def describe_stream(stream: Dict[str, Any]) -> str:
+    parts = [f"#{stream['audio_index']}", stream['codec'], f"{stream['channels']}声道"]
+    if stream['sample_rate']:
+        parts.append(f"{stream['sample_rate']}Hz")
+    if stream['bits']:
+        parts.append(f"{stream['bits']}bit")
+    if stream['language']:
+        parts.append(stream['language'])
+    if stream['title']:
+        parts.append(f"「{stream['title']}」")
+    return ' '.join(parts)
+
+
+def parse_stream_policy(value: str) -> Union[int, str]:
+    """解析命令行的音频流参数：音频流序号或策略名，无效时抛出ValueError"""
+    if value in STREAM_POLICIES:
+        return value
+    index = int(value)
+    if index < 0:
+        raise ValueError(value)
+    return index
+
+
+@traced('select_audio_stream')
+def resolve_audio_stream(input_path: Union[str, Path, None], policy: Union[int, str] = DEFAULT_STREAM_POLICY,
+                         language: Optional[str] = None) -> Tuple[List[str], str]:
+    """
+    确定转换时使用的音频流
+    返回 (放在-i之前的输入参数, -map/滤镜图使用的流标识)；
+    输入参数让解复用器丢弃视频、字幕、数据流和未选中的音频流。
+    无法探测（如标准输入或没有ffprobe）时按序号映射，未指定序号时使用第一条音频流
+    """
+    streams = probe_audio_streams(input_path) if input_path is not None else None
+    if not streams:
+        index = policy if isinstance(policy, int) else 0
+        return list(DEMUX_IGNORE_ARGS), f"0:a:{index}"
+
+    selected = select_audio_stream(streams, policy, language)
+    if selected is None:
+        print(f"警告: 音频流序号 {policy} 超出范围（共{len(streams)}条音频流），使用第一条")
+        selected = streams[0]
+
+    if len(streams) > 1:
+        print(f"音频流: {describe_stream(selected)}（共{len(streams)}条音频流）")
+    annotate(audio_stream=selected['audio_index'], audio_streams=len(streams))
+
+    input_args = list(DEMUX_IGNORE_ARGS)
+    for stream in streams:
+        if stream is not selected and stream['index'] is not None:
+            input_args.extend([f"-discard:{stream['index']}", 'all'])
+    return input_args, f"0:{selected['index']}"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print("用法: python audio_streams.py <媒体文件> [策略或序号] [语言]")
+        sys.exit(0)
+    streams = probe_audio_streams(sys.argv[1])
+    if not streams:
+        print("错误: 无法读取音频流（需要ffprobe）")
+        sys.exit(1)
+    policy = parse_stream_policy(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_STREAM_POLICY
+    selected = select_audio_stream(streams, policy, sys.argv[3] if len(sys.argv) > 3 else None)
+    for stream in streams:
+        print(f"{'*' if stream is selected else ' '} {describe_stream(stream)}")
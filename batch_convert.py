@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可断点续跑的批量转换
+把目录（含子目录）中的媒体文件批量转换为FLAC，每个文件的状态
+（queued/running/done/failed，完成时记录输出文件SHA-256）保存在SQLite日志中。
+中途因重启、内存不足、FFmpeg崩溃等原因中断后，用同样的命令重新运行：
+已完成的文件直接跳过，中断时正在转换的文件删除不完整的输出后从头重新转换
+"""
+
+import sys
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from job_queue import (
+    JobStore,
+    JobRunner,
+    DEFAULT_WORKERS,
+    JOB_QUEUED,
+    JOB_DONE,
+    JOB_FAILED,
+    hash_file,
+    cleanup_partial_output
+)
+from watch_folder import MEDIA_EXTENSIONS, LRC_EXTENSION, METADATA_EXTENSION
+from video_to_audio import parse_time, check_ffmpeg
+from compression_tuner import AUTO_FLAC_COMPRESSION
+from cpu_budget import parse_jobs, plan_concurrency, describe_budget
+from audio_streams import STREAM_POLICIES, parse_stream_policy
+from input_staging import InputStager, DEFAULT_STAGE_BUDGET, parse_size
+
+# Constants
+DEFAULT_JOURNAL_NAME = 'batch_journal.db'
+
+
+def collect_inputs(sources: List[Path]) -> List[Tuple[Path, Path]]:
+    """
+    收集要转换的媒体文件
+    返回 [(媒体文件, 计算输出相对路径时的根目录), ...]
+    """
+    inputs = []
+    for source in sources:
+        if source.is_dir():
+            for path in sorted(source.rglob('*')):
+                if path.is_file() and path.suffix.lower() in MEDIA_EXTENSIONS and not path.name.startswith('.'):
+                    inputs.append((path, source))
+        elif source.is_file():
+            inputs.append((source, source.parent))
+        else:
+            print(f"警告: '{source}' 不存在，已跳过")
+    return inputs
+
+
+def output_path_for(media: Path, root: Path, output_dir: Optional[Path]) -> Path:
+    """有输出目录时保留子目录结构，否则输出到源文件旁边"""
+    if output_dir is None:
+        return media.with_suffix('.flac')
+    return output_dir / media.relative_to(root).with_suffix('.flac')
+
+
+def source_key_for(media: Path, output: Path, options: Dict[str, Any]) -> str:
+    """源文件（路径、大小、修改时间）+ 输出路径 + 转换参数相同才视为同一个任务"""
+    stat = media.stat()
+    return (f"{media.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{output.resolve()}|"
+            f"{json.dumps(options, sort_keys=True)}")
+
+
+def plan_batch(store: JobStore, inputs: List[Tuple[Path, Path]], output_dir: Optional[Path],
+               options: Dict[str, Any], retry_failed: bool = True, verify: bool = False) -> Dict[str, int]:
+    """
+    把输入文件写入日志
+    已完成且输出文件仍在（verify时还要求SHA-256一致）的跳过，其余重新排队
+    """
+    summary = {'new': 0, 'skipped': 0, 'requeued': 0, 'pending': 0, 'failed': 0}
+    for media, root in inputs:
+        output = output_path_for(media, root, output_dir)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        lrc = media.with_suffix(LRC_EXTENSION)
+        metadata = media.with_suffix(METADATA_EXTENSION)
+        source_key = source_key_for(media, output, options)
+
+        job = store.find(source_key)
+        if job is None:
+            store.add(media, output, lrc if lrc.exists() else None,
+                      metadata if metadata.exists() else None,
+                      options=options, source_key=source_key)
+            summary['new'] += 1
+        elif job['state'] == JOB_DONE:
+            if not output.exists():
+                print(f"[重做] {media}（输出文件已不存在）")
+            elif verify and job['output_hash'] and hash_file(output) != job['output_hash']:
+                print(f"[重做] {media}（输出文件校验不一致）")
+            else:
+                summary['skipped'] += 1
+                continue
+            cleanup_partial_output(output, media)
+            store.requeue(job['id'])
+            summary['requeued'] += 1
+        elif job['state'] == JOB_FAILED:
+            if retry_failed:
+                cleanup_partial_output(output, media)
+                store.requeue(job['id'])
+                summary['requeued'] += 1
+            else:
+                summary['failed'] += 1
+        elif job['state'] == JOB_QUEUED:
+            summary['pending'] += 1
+    return summary
+
+
+def print_help():
+    """打印帮助信息"""
+    print("""
+可断点续跑的批量转换
+
+用法:
+    python batch_convert.py <输入目录或文件>... [选项]
+
+选项:
+    -o <目录>            输出目录（默认与源文件同目录），保留子目录结构
+    -j <数量|auto>       同时转换的任务数（默认2；auto为按可用CPU数），
+                         每个FFmpeg的线程数按可用CPU数平均分配
+    --journal <文件>     任务日志数据库（默认 <输出目录>/batch_journal.db）
+    -ss <时间>           每个文件从指定时间开始裁剪
+    -t <时长>            每个文件裁剪指定时长
+    -c <级别>            FLAC压缩级别 (0-8或auto)
+    --skip-failed        重新运行时不重试上次失败的文件
+    --verify             重新运行时校验已完成文件的SHA-256，不一致则重新转换
+    --no-cache           不使用编码缓存（默认相同输入只编码一次）
+    --audio-stream <序号|策略>  多音轨时使用的音频流（序号或lossless/channels/rate，默认lossless）
+    --audio-lang <语言>  优先选择该语言的音轨
+    --stage              预读暂存：转换当前文件时把接下来的输入文件复制到本地临时目录
+                         （源文件在SMB/NFS等慢速存储上时使用）
+    --stage-dir <目录>   暂存目录的位置（默认系统临时目录）
+    --stage-budget <大小>  暂存目录最多占用的磁盘空间（默认8G，如 20G、512M）
+    -h, --help           显示帮助信息
+
+说明:
+    与视频同名的 .lrc 文件作为歌词嵌入，同名的 .txt 文件作为元数据文件
+    中断后用同样的命令重新运行即可继续：已完成的跳过，中断时正在转换的文件
+    会删除不完整的输出后重新转换
+    预读暂存的副本在对应任务结束后立即删除，超过预算的文件直接从原位置读取
+
+示例:
+    python batch_convert.py capture/ -o flac/ -j 4
+    python batch_convert.py /mnt/nas/mv -o flac/ --stage --stage-budget 20G
+    """)
+
+
+def main():
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args or len(args) == 0:
+        print_help()
+        sys.exit(0)
+
+    sources = []
+    output_dir = None
+    workers = DEFAULT_WORKERS
+    journal = None
+    options: Dict[str, Any] = {}
+    retry_failed = True
+    verify = False
+    stage = False
+    stage_dir = None
+    stage_budget = DEFAULT_STAGE_BUDGET
+
+    i = 0
+    while i < len(args):
+        if args[i] == '-o' and i + 1 < len(args):
+            output_dir = Path(args[i + 1])
+            i += 2
+        elif args[i] == '-j' and i + 1 < len(args):
+            try:
+                workers = parse_jobs(args[i + 1])
+            except ValueError:
+                print("错误: 任务数必须是正整数或auto")
+                sys.exit(1)
+            i += 2
+        elif args[i] == '--journal' and i + 1 < len(args):
+            journal = Path(args[i + 1])
+            i += 2
+        elif args[i] in ('-ss', '-t') and i + 1 < len(args):
+            seconds = parse_time(args[i + 1])
+            if seconds is None:
+                print(f"错误: 无法解析时间 '{args[i + 1]}'")
+                sys.exit(1)
+            options['start_time' if args[i] == '-ss' else 'duration'] = seconds
+            i += 2
+        elif args[i] == '-c' and i + 1 < len(args):
+            if args[i + 1] == AUTO_FLAC_COMPRESSION:
+                options['flac_compression'] = AUTO_FLAC_COMPRESSION
+            else:
+                try:
+                    options['flac_compression'] = int(args[i + 1])
+                    if not 0 <= options['flac_compression'] <= 8:
+                        raise ValueError
+                except ValueError:
+                    print("错误: FLAC压缩级别必须是0-8或auto")
+                    sys.exit(1)
+            i += 2
+        elif args[i] == '--skip-failed':
+            retry_failed = False
+            i += 1
+        elif args[i] == '--no-cache':
+            options['use_cache'] = False
+            i += 1
+        elif args[i] == '--audio-stream' and i + 1 < len(args):
+            try:
+                options['audio_stream'] = parse_stream_policy(args[i + 1])
+            except ValueError:
+                print(f"错误: 音频流必须是序号或 {'/'.join(STREAM_POLICIES)}")
+                sys.exit(1)
+            i += 2
+        elif args[i] == '--audio-lang' and i + 1 < len(args):
+            options['audio_language'] = args[i + 1]
+            i += 2
+        elif args[i] == '--verify':
+            verify = True
+            i += 1
+        elif args[i] == '--stage':
+            stage = True
+            i += 1
+        elif args[i] == '--stage-dir' and i + 1 < len(args):
+            stage = True
+            stage_dir = Path(args[i + 1])
+            i += 2
+        elif args[i] == '--stage-budget' and i + 1 < len(args):
+            try:
+                stage_budget = parse_size(args[i + 1])
+            except ValueError as e:
+                print(f"错误: {e}")
+                sys.exit(1)
+            stage = True
+            i += 2
+        elif args[i].startswith('-'):
+            print(f"警告: 未知选项 {args[i]}")
+            i += 1
+        else:
+            sources.append(Path(args[i]))
+            i += 1
+
+    if not check_ffmpeg():
+        print("错误: 未找到FFmpeg")
+        sys.exit(1)
+
+    if journal is None:
+        journal = (output_dir / DEFAULT_JOURNAL_NAME) if output_dir else Path(DEFAULT_JOURNAL_NAME)
+    journal.parent.mkdir(parents=True, exist_ok=True)
+
+    store = JobStore(journal)
+    # 上次中断时正在转换的文件：删除不完整的输出，重新排队
+    for job in store.requeue_running():
+        removed = cleanup_partial_output(job['output'], job['input'])
+        print(f"[恢复] {job['input']}" + (f"（已删除不完整的输出 {len(removed)}个）" if removed else ""))
+
+    inputs = collect_inputs(sources)
+    summary = plan_batch(store, inputs, output_dir, options, retry_failed, verify)
+    print(f"共{len(inputs)}个文件: 新增{summary['new']}，跳过已完成{summary['skipped']}，"
+          f"重新转换{summary['requeued']}，上次未开始{summary['pending']}"
+          + (f"，跳过失败{summary['failed']}" if summary['failed'] else ""))
+    print(f"任务日志: {journal}")
+
+    stager = InputStager(stage_budget, stage_dir, lookahead=plan_concurrency(workers)[0]) if stage else None
+    runner = JobRunner(store, workers, stager=stager)
+    print(f"{describe_budget()}: {runner.workers}个并行任务，每个FFmpeg {runner.ffmpeg_threads}个线程")
+    if stager is not None:
+        print(f"预读暂存目录: {stager.root}（预算{stage_budget / 1024 / 1024 / 1024:.1f}GB）")
+    try:
+        runner.drain()
+    except KeyboardInterrupt:
+        print("\n已中断，重新运行同样的命令即可继续")
+    finally:
+        runner.shutdown()
+        counts = store.counts()
+        store.close()
+        if stager is not None:
+            print(stager.describe())
+
+    print(f"队列状态: {counts}")
+    if counts.get(JOB_FAILED) or counts.get(JOB_QUEUED):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端吞吐量基准测试
+使用FFmpeg lavfi信号源在本地生成确定性的合成素材（含配套LRC和元数据文件），
+逐一运行process_media的各条处理路径，记录耗时、CPU时间、写入字节数和每小时处理文件数，
+结果保存为JSON基线，可与其他版本的基线对比
+"""
+
+import sys
+import os
+import io
+import json
+import time
+import platform
+import contextlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from video_to_audio import process_media, check_ffmpeg
+from process_runner import run_process, job_resources
+
+# Constants
+DEFAULT_CORPUS_DIR = Path('bench_corpus')
+DEFAULT_OUTPUT = Path('bench_baseline.json')
+CORPUS_DURATIONS = {'short': 20, 'long': 300}
+CORPUS_SAMPLE_RATES = (44100, 48000, 96000)
+CORPUS_LAYOUTS = {'stereo': 2, '5.1': 6}
+LRC_LINE_INTERVAL = 5
+TRIM_START = 5.0
+TRIM_DURATION = 10.0
+# 对比时耗时变化超过此比例视为回退
+REGRESSION_THRESHOLD = 0.10
+
+# 每个声道使用不同频率的正弦波，保证各声道内容不同且可重现
+CHANNEL_FREQUENCIES = (220, 330, 440, 550, 660, 880)
+
+
+def _run_ffmpeg(args: List[str]) -> bool:
+    """运行FFmpeg生成素材"""
+    cmd = ['ffmpeg', '-v', 'error', '-y', *args]
+    result = run_process(cmd, 'corpus_generate',
+                         capture_output=True,
+                         text=True)
+    if result.returncode != 0:
+        print(f"生成素材失败: {result.stderr[:300]}")
+        return False
+    return True
+
+
+def _audio_source(seconds: int, sample_rate: int, channels: int) -> str:
+    """构建aevalsrc表达式：每个声道一个正弦波，叠加缓慢的音量起伏"""
+    exprs = '|'.join(
+        f"0.3*sin(2*PI*{CHANNEL_FREQUENCIES[i]}*t)*(0.6+0.4*sin(2*PI*0.2*t))"
+        for i in range(channels)
+    )
+    layout = 'stereo' if channels == 2 else '5.1'
+    return f"aevalsrc=exprs={exprs}:s={sample_rate}:c={layout}:d={seconds}"
+
+
+def write_lrc(path: Path, seconds: int) -> None:
+    """生成与素材时长匹配的LRC文件"""
+    lines = ['[ti:基准测试]', '[ar:合成信号]', '[al:Benchmark]']
+    for index, position in enumerate(range(0, seconds, LRC_LINE_INTERVAL)):
+        minutes, secs = divmod(position, 60)
+        lines.append(f"[{minutes:02d}:{secs:02d}.00]第{index + 1}句歌词")
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+
+def write_metadata(path: Path, name: str, cover_path: Path) -> None:
+    """生成元数据文件（封面使用本地图片，避免网络影响测量）"""
+    path.write_text(
+        f"标题(TITLE)：{name}\n"
+        f"艺术家(ARTIST)：合成信号\n"
+        f"专辑(ALBUM)：Benchmark\n"
+        f"日期(DATE)：2025-01-01\n"
+        f"流派(GENRE)：测试\n"
+        f"封面图片(COVER_IMAGE)：{cover_path.resolve()}\n",
+        encoding='utf-8'
+    )
+
+
+def generate_corpus(corpus_dir: Path, durations: Optional[List[str]] = None) -> List[Dict]:
+    """
+    生成合成素材库，已存在的文件不会重新生成
+    组合：时长(short/long) x 采样率(44.1/48/96kHz) x 声道(立体声/5.1) x 是否带视频
+    """
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    durations = durations or list(CORPUS_DURATIONS)
+
+    cover_path = corpus_dir / 'cover.png'
+    if not cover_path.exists():
+        _run_ffmpeg(['-f', 'lavfi', '-i', 'testsrc2=size=600x600:rate=1',
+                     '-frames:v', '1', str(cover_path)])
+
+    entries = []
+    for duration_name in durations:
+        seconds = CORPUS_DURATIONS[duration_name]
+        for sample_rate in CORPUS_SAMPLE_RATES:
+            for layout_name, channels in CORPUS_LAYOUTS.items():
+                for with_video in (True, False):
+                    name = (f"{duration_name}_{sample_rate // 1000}k_{layout_name.replace('.', '')}"
+                            f"_{'video' if with_video else 'audio'}")
+                    media_path = corpus_dir / (f"{name}.mp4" if with_video else f"{name}.m4a")
+
+                    if not media_path.exists():
+                        args = ['-f', 'lavfi', '-i', _audio_source(seconds, sample_rate, channels)]
+                        if with_video:
+                            args += ['-f', 'lavfi', '-i', f"testsrc2=size=320x240:rate=25:d={seconds}",
+                                     '-c:v', 'mpeg4', '-q:v', '5']
+                        args += ['-c:a', 'aac', '-b:a', '256k',
+                                 '-fflags', '+bitexact', '-flags:a', '+bitexact',
+                                 '-shortest', str(media_path)]
+                        if not _run_ffmpeg(args):
+                            continue
+
+                    lrc_path = corpus_dir / f"{name}.lrc"
+                    if not lrc_path.exists():
+                        write_lrc(lrc_path, seconds)
+                    metadata_path = corpus_dir / f"{name}.txt"
+                    if not metadata_path.exists():
+                        write_metadata(metadata_path, name, cover_path)
+
+                    entries.append({
+                        'name': name,
+                        'media': media_path,
+                        'lrc': lrc_path,
+                        'metadata': metadata_path,
+                        'seconds': seconds,
+                    })
+    return entries
+
+
+def _benchmark_cases(entry: Dict) -> List[Dict]:
+    """每个素材要运行的process_media路径"""
+    return [
+        {'case': 'plain', 'kwargs': {}},
+        {'case': 'trim', 'kwargs': {'start_time': TRIM_START, 'duration': TRIM_DURATION}},
+        {'case': 'lyrics', 'kwargs': {'lrc_path': entry['lrc']}},
+        {'case': 'metadata_cover', 'kwargs': {'metadata_file': entry['metadata']}},
+    ]
+
+
+def run_case(entry: Dict, case: Dict, output_dir: Path, verbose: bool = False) -> Dict:
+    """运行一次转换并记录测量结果"""
+    output_path = output_dir / f"{entry['name']}_{case['case']}.flac"
+    if output_path.exists():
+        output_path.unlink()
+
+    times_before = os.times()
+    wall_start = time.perf_counter()
+    # process_media的print输出会干扰结果显示，默认丢弃
+    sink = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with sink, job_resources(entry['name']) as job:
+        # 不使用编码缓存，每次都测量完整的编码
+        success = process_media(str(entry['media']), str(output_path), use_cache=False, **case['kwargs'])
+    wall_seconds = time.perf_counter() - wall_start
+    times_after = os.times()
+
+    # CPU时间包括本进程和已结束的FFmpeg子进程（Windows上子进程时间不可用）
+    cpu_seconds = ((times_after.user - times_before.user) +
+                   (times_after.system - times_before.system) +
+                   (times_after.children_user - times_before.children_user) +
+                   (times_after.children_system - times_before.children_system))
+
+    bytes_written = output_path.stat().st_size if output_path.exists() else 0
+    audio_seconds = case['kwargs'].get('duration', entry['seconds'])
+
+    return {
+        'input': entry['name'],
+        'case': case['case'],
+        'success': bool(success),
+        'wall_seconds': round(wall_seconds, 4),
+        'cpu_seconds': round(cpu_seconds, 4),
+        'bytes_written': bytes_written,
+        'audio_seconds': audio_seconds,
+        'files_per_hour': round(3600 / wall_seconds, 1) if wall_seconds > 0 else None,
+        'realtime_factor': round(audio_seconds / wall_seconds, 1) if wall_seconds > 0 else None,
+        'child_stages': job.by_stage(),
+    }
+
+
+def _ffmpeg_version() -> str:
+    try:
+        result = run_process(['ffmpeg', '-version'], 'check_ffmpeg',
+                             capture_output=True,
+                             text=True)
+        return result.stdout.split('\n', 1)[0]
+    except OSError:
+        return 'unknown'
+
+
+def _git_revision() -> str:
+    try:
+        result = run_process(['git', 'rev-parse', '--short', 'HEAD'], 'git',
+                             capture_output=True,
+                             text=True,
+                             cwd=Path(__file__).parent)
+        return result.stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+def summarize(results: List[Dict]) -> Dict[str, Dict]:
+    """按处理路径汇总"""
+    summary = {}
+    for result in results:
+        if not result['success']:
+            continue
+        item = summary.setdefault(result['case'], {
+            'runs': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'bytes_written': 0
+        })
+        item['runs'] += 1
+        item['wall_seconds'] += result['wall_seconds']
+        item['cpu_seconds'] += result['cpu_seconds']
+        item['bytes_written'] += result['bytes_written']
+
+    for item in summary.values():
+        item['wall_seconds'] = round(item['wall_seconds'], 4)
+        item['cpu_seconds'] = round(item['cpu_seconds'], 4)
+        item['files_per_hour'] = round(item['runs'] * 3600 / item['wall_seconds'], 1) \
+            if item['wall_seconds'] > 0 else None
+    return summary
+
+
+def compare_baselines(current: Dict, previous: Dict) -> bool:
+    """对比两个基线，打印各路径的耗时变化，有回退时返回False"""
+    print(f"\n对比基线: {previous.get('revision')} -> {current.get('revision')}")
+    print(f"  {'路径':<16}{'旧耗时(s)':>12}{'新耗时(s)':>12}{'变化':>10}")
+
+    ok = True
+    for case, item in current['summary'].items():
+        old = previous.get('summary', {}).get(case)
+        if not old or not old.get('wall_seconds'):
+            print(f"  {case:<16}{'-':>12}{item['wall_seconds']:>12.2f}{'新增':>10}")
+            continue
+        change = item['wall_seconds'] / old['wall_seconds'] - 1
+        flag = ''
+        if change > REGRESSION_THRESHOLD:
+            flag = ' 回退'
+            ok = False
+        print(f"  {case:<16}{old['wall_seconds']:>12.2f}{item['wall_seconds']:>12.2f}"
+              f"{change * 100:>+9.1f}%{flag}")
+    return ok
+
+
+def print_help():
+    """打印帮助信息"""
+    print("""
+端到端吞吐量基准测试
+
+用法:
+    python benchmark.py [选项]
+
+选项:
+    --corpus <目录>      合成素材目录（默认 bench_corpus，已存在的素材会复用）
+    --output <文件>      基线JSON输出路径（默认 bench_baseline.json）
+    --compare <文件>     与已有基线对比，耗时回退超过10%时返回非零
+    --quick              只使用短素材
+    --verbose            显示process_media的输出
+    -h, --help           显示帮助信息
+
+示例:
+    # 生成基线
+    python benchmark.py --output baseline_v2.json
+
+    # 与旧版本基线对比
+    python benchmark.py --quick --compare baseline_v2.json
+    """)
+
+
+def main():
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args:
+        print_help()
+        sys.exit(0)
+
+    if not check_ffmpeg():
+        print("错误: 未找到FFmpeg")
+        sys.exit(1)
+
+    corpus_dir = DEFAULT_CORPUS_DIR
+    output_path = DEFAULT_OUTPUT
+    compare_path = None
+    durations = None
+    verbose = False
+
+    i = 0
+    while i < len(args):
+        if args[i] == '--corpus' and i + 1 < len(args):
+            corpus_dir = Path(args[i + 1])
+            i += 2
+        elif args[i] == '--output' and i + 1 < len(args):
+            output_path = Path(args[i + 1])
+            i += 2
+        elif args[i] == '--compare' and i + 1 < len(args):
+            compare_path = Path(args[i + 1])
+            i += 2
+        elif args[i] == '--quick':
+            durations = ['short']
+            i += 1
+        elif args[i] == '--verbose':
+            verbose = True
+            i += 1
+        else:
+            print(f"警告: 未知选项 {args[i]}")
+            i += 1
+
+    print("正在准备合成素材...")
+    entries = generate_corpus(corpus_dir, durations)
+    output_dir = corpus_dir / 'output'
+    output_dir.mkdir(exist_ok=True)
+
+    results = []
+    for entry in entries:
+        for case in _benchmark_cases(entry):
+            result = run_case(entry, case, output_dir, verbose)
+            results.append(result)
+            status = "成功" if result['success'] else "失败"
+            print(f"  {entry['name']:<28}{case['case']:<16}{result['wall_seconds']:>8.2f}s  "
+                  f"CPU {result['cpu_seconds']:>7.2f}s  {result['bytes_written'] / 1024:>9.1f} KB  {status}")
+
+    baseline = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'ffmpeg': _ffmpeg_version(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+        'summary': summarize(results),
+    }
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+    print(f"\n基线已保存: {output_path}")
+
+    for case, item in baseline['summary'].items():
+        print(f"  {case:<16}{item['runs']:>4}次  {item['wall_seconds']:>8.2f}s  "
+              f"{item['files_per_hour']} 文件/小时")
+
+    if compare_path:
+        with open(compare_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        if not compare_baselines(baseline, previous):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
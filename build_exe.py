@@ -54,9 +54,9 @@ def build_exe():
         "--hidden-import=tkinter",
         "--hidden-import=PIL",
         "--hidden-import=requests",
+        "--hidden-import=numpy",
         # 排除不需要的模块（减小文件大小）
         "--exclude-module=matplotlib",
-        "--exclude-module=numpy",
         "--exclude-module=pandas",
         "--exclude-module=scipy",
         # 图标（如果有）
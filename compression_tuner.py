@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FLAC压缩级别自动调优
+从源文件中截取几段有代表性的片段，分别用不同压缩级别编码，
+测量输出体积和编码速度，按目标（默认：速度不低于40倍实时的前提下体积最小）选出压缩级别
+"""
+
+import asyncio
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from process_runner import run_process, run_process_async
+from cpu_budget import ffmpeg_thread_args
+from audio_streams import DEMUX_IGNORE_ARGS, DEFAULT_AUDIO_MAP
+from media_probe import probe_media, probe_media_async
+from job_context import scratch_dir
+
+# Constants
+AUTO_FLAC_COMPRESSION = 'auto'
+DEFAULT_MIN_ENCODE_SPEED = 40.0       # 最低编码速度（倍实时）
+DEFAULT_TUNE_LEVELS = tuple(range(9))
+DEFAULT_SLICE_COUNT = 3
+DEFAULT_SLICE_SECONDS = 10.0
+# 体积差距在此比例内时优先选择更低（更快）的级别
+SIZE_TOLERANCE = 0.005
+
+# 片段统一解码为与正式编码相同的PCM格式
+PCM_SAMPLE_RATE = 44100
+PCM_CHANNELS = 2
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * PCM_CHANNELS * 2
+
+
+def probe_duration(media_path: Union[str, Path]) -> Optional[float]:
+    """读取媒体时长（秒，来自探测缓存），失败时返回None"""
+    info = probe_media(media_path)
+    return info.duration if info else None
+
+
+def plan_slices(window_start: float, window_length: Optional[float],
+                slice_count: int = DEFAULT_SLICE_COUNT,
+                slice_seconds: float = DEFAULT_SLICE_SECONDS) -> List[Tuple[float, float]]:
+    """
+    在[window_start, window_start + window_length]内均匀选取片段
+    返回 [(开始时间, 长度), ...]
+    """
+    if window_length is None:
+        # 时长未知，从窗口开头连续截取
+        return [(window_start + i * slice_seconds, slice_seconds) for i in range(slice_count)]
+
+    if window_length <= slice_count * slice_seconds:
+        # 窗口太短，整段作为一个片段
+        return [(window_start, window_length)]
+
+    # 把窗口等分为slice_count段，取每段中间部分，避开片头片尾的静音
+    segment = window_length / slice_count
+    return [(window_start + i * segment + (segment - slice_seconds) / 2, slice_seconds)
+            for i in range(slice_count)]
+
+
+def decode_slice_command(input_path: Path, offset: float, length: float,
+                         audio_selection: Optional[Tuple[List[str], str]] = None) -> List[str]:
+    """把一个片段解码为原始PCM（输出到标准输出）的FFmpeg命令"""
+    input_args, audio_map = audio_selection or (DEMUX_IGNORE_ARGS, DEFAULT_AUDIO_MAP)
+    return [
+        'ffmpeg', '-v', 'error', *ffmpeg_thread_args(), *input_args,
+        '-ss', str(offset), '-t', str(length),
+        '-i', str(input_path),
+        '-map', audio_map, '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ar', str(PCM_SAMPLE_RATE), '-ac', str(PCM_CHANNELS),
+        'pipe:1'
+    ]
+
+
+def encode_level_command(pcm_path: Path, level: int) -> List[str]:
+    """用指定压缩级别编码PCM样本（输出到标准输出）的FFmpeg命令"""
+    return [
+        'ffmpeg', '-v', 'error', *ffmpeg_thread_args(),
+        '-f', 's16le', '-ar', str(PCM_SAMPLE_RATE), '-ac', str(PCM_CHANNELS),
+        '-i', str(pcm_path),
+        '-acodec', 'flac', '-compression_level', str(level),
+        '-f', 'flac', 'pipe:1'
+    ]
+
+
+def level_measurement(level: int, encoded_bytes: int, elapsed: float, audio_seconds: float) -> Dict[str, float]:
+    return {
+        'level': level,
+        'bytes': encoded_bytes,
+        'seconds': elapsed,
+        # 包含FFmpeg启动开销，测得的速度偏保守
+        'speed': audio_seconds / elapsed if elapsed > 0 else float('inf'),
+    }
+
+
+def tuning_window(input_path: Path, start_time: Optional[float],
+                  duration: Optional[float]) -> Tuple[float, Optional[float]]:
+    """取样范围 (开始时间, 长度)；未指定时长时从探测到的总时长推算，无法探测时长度为None"""
+    window_start = start_time or 0.0
+    window_length = duration
+    if window_length is None:
+        total = probe_duration(input_path)
+        if total is not None:
+            window_length = max(total - window_start, 0.0)
+    return window_start, window_length
+
+
+def new_tune_report(slices: List[Tuple[float, float]], min_speed: float) -> Dict:
+    return {
+        'objective': f"体积最小，且速度≥{min_speed:g}x实时",
+        'slices': slices,
+        'audio_seconds': 0.0,
+        'measurements': [],
+        'chosen_level': None,
+    }
+
+
+def _decode_slices(input_path: Path, slices: List[Tuple[float, float]], pcm_path: Path,
+                   audio_selection: Optional[Tuple[List[str], str]] = None) -> float:
+    """把所有片段解码并拼接为一个原始PCM文件，返回音频总秒数"""
+    total_bytes = 0
+    with open(pcm_path, 'wb') as pcm_file:
+        for offset, length in slices:
+            result = run_process(decode_slice_command(input_path, offset, length, audio_selection), 'tune_decode',
+                                 capture_output=True)
+            if result.returncode != 0:
+                continue
+            pcm_file.write(result.stdout)
+            total_bytes += len(result.stdout)
+
+    return total_bytes / PCM_BYTES_PER_SECOND
+
+
+def measure_level(pcm_path: Path, audio_seconds: float, level: int) -> Optional[Dict[str, float]]:
+    """用指定压缩级别编码PCM样本，返回体积和速度"""
+    start = time.perf_counter()
+    result = run_process(encode_level_command(pcm_path, level), 'tune_encode',
+                         capture_output=True)
+    elapsed = time.perf_counter() - start
+
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return level_measurement(level, len(result.stdout), elapsed, audio_seconds)
+
+
+def choose_level(measurements: List[Dict[str, float]],
+                 min_speed: float = DEFAULT_MIN_ENCODE_SPEED,
+                 size_tolerance: float = SIZE_TOLERANCE) -> Optional[int]:
+    """
+    目标：在速度不低于min_speed的级别中选体积最小的；
+    体积相差不超过size_tolerance时选更低的级别
+    """
+    if not measurements:
+        return None
+
+    candidates = [m for m in measurements if m['speed'] >= min_speed]
+    if not candidates:
+        # 没有级别达到速度要求，退而选最快的
+        return max(measurements, key=lambda m: m['speed'])['level']
+
+    # 体积最小的级别本身满足条件，一定能选出
+    smallest = min(m['bytes'] for m in candidates)
+    return next(m['level'] for m in sorted(candidates, key=lambda m: m['level'])
+                if m['bytes'] <= smallest * (1 + size_tolerance))
+
+
+def auto_tune_compression(
+    input_path: Union[str, Path],
+    start_time: Optional[float] = None,
+    duration: Optional[float] = None,
+    min_speed: float = DEFAULT_MIN_ENCODE_SPEED,
+    levels: Tuple[int, ...] = DEFAULT_TUNE_LEVELS,
+    slice_count: int = DEFAULT_SLICE_COUNT,
+    slice_seconds: float = DEFAULT_SLICE_SECONDS,
+    audio_selection: Optional[Tuple[List[str], str]] = None
+) -> Tuple[Optional[int], Dict]:
+    """
+    自动选择FLAC压缩级别
+
+    Args:
+        input_path: 输入媒体文件
+        start_time: 裁剪开始时间（只在裁剪范围内取样）
+        duration: 裁剪时长
+        min_speed: 最低编码速度（倍实时）
+        levels: 参与比较的压缩级别
+        slice_count: 取样片段数
+        slice_seconds: 每个片段的秒数
+        audio_selection: resolve_audio_stream的结果（取样与正式编码使用同一条音频流）
+
+    Returns:
+        (选中的级别, 报告)；取样失败时级别为None
+    """
+    input_path = Path(input_path)
+    window_start, window_length = tuning_window(input_path, start_time, duration)
+    slices = plan_slices(window_start, window_length, slice_count, slice_seconds)
+    report = new_tune_report(slices, min_speed)
+
+    temp_dir = Path(tempfile.mkdtemp(prefix='flac_tune_', dir=scratch_dir()))
+    try:
+        pcm_path = temp_dir / 'slices.pcm'
+        audio_seconds = _decode_slices(input_path, slices, pcm_path, audio_selection)
+        report['audio_seconds'] = audio_seconds
+        if audio_seconds <= 0:
+            return None, report
+
+        for level in levels:
+            measurement = measure_level(pcm_path, audio_seconds, level)
+            if measurement:
+                report['measurements'].append(measurement)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report['chosen_level'] = choose_level(report['measurements'], min_speed)
+    return report['chosen_level'], report
+
+
+async def auto_tune_compression_async(
+    input_path: Union[str, Path],
+    start_time: Optional[float] = None,
+    duration: Optional[float] = None,
+    min_speed: float = DEFAULT_MIN_ENCODE_SPEED,
+    levels: Tuple[int, ...] = DEFAULT_TUNE_LEVELS,
+    slice_count: int = DEFAULT_SLICE_COUNT,
+    slice_seconds: float = DEFAULT_SLICE_SECONDS,
+    audio_selection: Optional[Tuple[List[str], str]] = None
+) -> Tuple[Optional[int], Dict]:
+    """auto_tune_compression的asyncio版本（参数和返回值相同），取样和测速的FFmpeg用run_process_async运行"""
+    input_path = Path(input_path)
+    if duration is None:
+        # 预先探测，tuning_window读取时长时命中缓存
+        await probe_media_async(input_path)
+    window_start, window_length = tuning_window(input_path, start_time, duration)
+    slices = plan_slices(window_start, window_length, slice_count, slice_seconds)
+    report = new_tune_report(slices, min_speed)
+
+    pcm = bytearray()
+    for offset, length in slices:
+        result = await run_process_async(decode_slice_command(input_path, offset, length, audio_selection),
+                                         'tune_decode', capture_output=True)
+        if result.returncode == 0:
+            pcm += result.stdout
+    audio_seconds = len(pcm) / PCM_BYTES_PER_SECOND
+    report['audio_seconds'] = audio_seconds
+    if audio_seconds <= 0:
+        return None, report
+
+    temp_dir = Path(tempfile.mkdtemp(prefix='flac_tune_', dir=scratch_dir()))
+    try:
+        pcm_path = temp_dir / 'slices.pcm'
+        await asyncio.to_thread(pcm_path.write_bytes, bytes(pcm))
+        del pcm
+        for level in levels:
+            start = time.perf_counter()
+            result = await run_process_async(encode_level_command(pcm_path, level), 'tune_encode',
+                                             capture_output=True)
+            elapsed = time.perf_counter() - start
+            if result.returncode == 0 and result.stdout:
+                report['measurements'].append(level_measurement(level, len(result.stdout), elapsed,
+                                                                audio_seconds))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report['chosen_level'] = choose_level(report['measurements'], min_speed)
+    return report['chosen_level'], report
+
+
+def format_tune_report(report: Dict) -> str:
+    """格式化调优报告"""
+    lines = [
+        f"调优目标: {report['objective']}",
+        f"取样音频: {len(report['slices'])}段，共{report['audio_seconds']:.1f}秒",
+        "  级别      体积        速度",
+    ]
+    measurements = report['measurements']
+    smallest = min((m['bytes'] for m in measurements), default=0)
+    for m in measurements:
+        marker = " <- 选中" if m['level'] == report['chosen_level'] else ""
+        extra = (m['bytes'] / smallest - 1) * 100 if smallest else 0.0
+        lines.append(f"  {m['level']:>4}  {m['bytes'] / 1024:>8.1f} KB (+{extra:.2f}%)"
+                     f"  {m['speed']:>7.1f}x{marker}")
+    return '\n'.join(lines)
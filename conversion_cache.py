@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量转换缓存
+以输入文件指纹（大小、修改时间、首/中/尾部分内容的哈希）加编码参数（裁剪范围、采样率、
+压缩级别等）为键，缓存编码后的FLAC音频（不含歌词和标签）。
+只修改了歌词或元数据时直接复用缓存的音频，只重新写入歌词/标签；
+同一批次中相同的输入只编码一次，其余任务通过reflink/硬链接共享结果
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Constants
+CACHE_DIR_ENV = 'VIDEO_TO_AUDIO_CACHE_DIR'
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+# 超过这么久的<键>.<pid>.tmp是写入缓存时异常退出留下的
+CACHE_TEMP_MAX_AGE = 60 * 60
+# 编码命令（采样率、声道、位深等）改变时递增，使旧缓存失效
+CACHE_FORMAT_VERSION = 1
+
+# Linux下的reflink（ioctl FICLONE），Btrfs/XFS等文件系统支持
+FICLONE = 0x40049409
+
+# 同一进程内按键互斥（多个线程同时转换；Windows下没有flock）：键 -> [锁, 使用者数]
+_key_locks: Dict[str, list] = {}
+_key_locks_guard = threading.Lock()
+
+
+def default_cache_dir() -> Path:
+    """缓存目录：环境变量VIDEO_TO_AUDIO_CACHE_DIR，否则为系统的用户缓存目录"""
+    if os.environ.get(CACHE_DIR_ENV):
+        return Path(os.environ[CACHE_DIR_ENV])
+    if sys.platform == 'win32':
+        base = Path(os.environ.get('LOCALAPPDATA') or Path.home() / 'AppData' / 'Local')
+    else:
+        base = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache')
+    return base / 'video_to_audio' / 'encoded'
+
+
+def fingerprint(path: Union[str, Path], chunk_size: int = FINGERPRINT_CHUNK_SIZE) -> str:
+    """
+    输入文件指纹：大小 + 修改时间 + 开头、中间、结尾各一段内容的SHA-256
+    不读取整个文件，大文件也只需读取几MB
+    """
+    path = Path(path)
+    stat = path.stat()
+    digest = hashlib.sha256(f"{stat.st_size}|{stat.st_mtime_ns}".encode())
+    with open(path, 'rb') as f:
+        offsets = [0]
+        if stat.st_size > chunk_size:
+            offsets += [max((stat.st_size - chunk_size) // 2, 0), max(stat.st_size - chunk_size, 0)]
+        for offset in offsets:
+            f.seek(offset)
+            digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+
+def link_or_copy(source: Path, target: Path) -> str:
+    """
+    把source放到target：优先reflink（写时复制），其次硬链接，最后普通复制
+    返回实际使用的方式
+    """
+    if target.exists():
+        target.unlink()
+
+    if fcntl is not None and sys.platform.startswith('linux'):
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return 'reflink'
+        except OSError:
+            target.unlink(missing_ok=True)
+
+    try:
+        os.link(source, target)
+        return 'hardlink'
+    except OSError:
+        shutil.copyfile(source, target)
+        return 'copy'
+
+
+class ConversionCache:
+    """
+    缓存目录结构:
+        <键>.flac   编码结果
+        <键>.json   写入时的文件大小和修改时间（检测硬链接的输出被就地修改）
+        <键>.lock   编码期间持有的文件锁，相同输入的其他任务等待后直接复用；释放前删除
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None,
+                 max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key_for(self, input_path: Union[str, Path], **params: Any) -> str:
+        """输入文件指纹 + 编码参数 -> 缓存键"""
+        payload = json.dumps({'version': CACHE_FORMAT_VERSION, 'input': fingerprint(input_path),
+                              'params': params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.flac"
+
+    def _info(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _lock_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.lock"
+
+    def _open_locked(self, path: Path, blocking: bool = True):
+        """
+        打开并锁定锁文件，返回文件对象；非阻塞时已被锁定则返回None
+        锁文件在持有锁时会被删除，拿到锁后确认路径上仍是同一个文件，否则重新打开
+        """
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            lock_file = open(path, 'a')
+            try:
+                fcntl.flock(lock_file.fileno(), flags)
+            except BlockingIOError:
+                lock_file.close()
+                return None
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(lock_file.fileno())
+            if current is not None and (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+                return lock_file
+            # 等待期间锁文件已被持有者删除
+            lock_file.close()
+            if not blocking:
+                return None
+
+    @contextmanager
+    def locked(self, key: str):
+        """同一个键同一时间只有一个线程/进程编码（Windows下只在进程内互斥）"""
+        with _key_locks_guard:
+            entry = _key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if fcntl is None:
+                    yield
+                    return
+                lock_path = self._lock_path(key)
+                lock_file = self._open_locked(lock_path)
+                try:
+                    yield
+                finally:
+                    # 持有锁时删除，等待中的其他进程拿到锁后发现文件已删除会重新创建
+                    lock_path.unlink(missing_ok=True)
+                    lock_file.close()
+        finally:
+            with _key_locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del _key_locks[key]
+
+    def fetch(self, key: str, output_path: Union[str, Path]) -> Optional[str]:
+        """
+        命中时把缓存的音频放到output_path，返回放置方式（reflink/hardlink/copy）；
+        未命中或缓存条目已被修改时返回None
+        """
+        entry = self._entry(key)
+        try:
+            stat = entry.stat()
+            with open(self._info(key), 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if (stat.st_size, stat.st_mtime_ns) != (info.get('size'), info.get('mtime_ns')):
+            # 硬链接的输出文件被其他程序就地修改过，缓存不再可信
+            self.discard(key)
+            return None
+
+        method = link_or_copy(entry, Path(output_path))
+        # 更新访问时间，供按最近使用淘汰
+        os.utime(self._info(key))
+        return method
+
+    def store(self, key: str, encoded_path: Union[str, Path]) -> None:
+        """把刚编码好的输出（尚未写入歌词/标签）加入缓存"""
+        entry = self._entry(key)
+        temp_entry = entry.with_name(f"{key}.{os.getpid()}.tmp")
+        try:
+            link_or_copy(Path(encoded_path), temp_entry)
+            os.replace(temp_entry, entry)
+        finally:
+            temp_entry.unlink(missing_ok=True)
+        stat = entry.stat()
+        with open(self._info(key), 'w', encoding='utf-8') as f:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'stored': time.time()}, f)
+        self.prune()
+
+    def discard(self, key: str) -> None:
+        for path in (self._entry(key), self._info(key)):
+            path.unlink(missing_ok=True)
+        self._remove_lock(self._lock_path(key))
+
+    def _remove_lock(self, path: Path) -> bool:
+        """删除没有被持有的锁文件（进程异常退出时留下的），正在使用的保留；返回是否删除"""
+        if not path.exists():
+            return False
+        if fcntl is None:
+            path.unlink(missing_ok=True)
+            return True
+        try:
+            lock_file = self._open_locked(path, blocking=False)
+        except OSError:
+            return False
+        if lock_file is None:
+            return False
+        with lock_file:
+            path.unlink(missing_ok=True)
+        return True
+
+    def prune(self) -> None:
+        """总大小超过上限时按最近使用时间淘汰，并清理遗留的锁文件和临时文件"""
+        for lock_path in self.cache_dir.glob('*.lock'):
+            self._remove_lock(lock_path)
+        now = time.time()
+        for temp_path in self.cache_dir.glob('*.tmp'):
+            try:
+                if now - temp_path.stat().st_mtime > CACHE_TEMP_MAX_AGE:
+                    temp_path.unlink()
+            except OSError:
+                continue
+
+        entries = []
+        total = 0
+        for info in self.cache_dir.glob('*.json'):
+            entry = info.with_suffix('.flac')
+            try:
+                size = entry.stat().st_size
+                used = info.stat().st_mtime
+            except OSError:
+                continue
+            entries.append((used, info.stem, size))
+            total += size
+
+        for _used, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.discard(key)
+            total -= size
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CPU预算与并发分配
+os.cpu_count()返回的是整机核数，既不考虑进程的CPU亲和性，也不考虑容器的cgroup CPU配额；
+FFmpeg的解码线程和滤镜线程默认也按整机核数创建。并行运行多个转换时会严重超额订阅。
+这里检测实际可用的CPU数，在并行任务数和每个任务的FFmpeg -threads/-filter_threads之间分配，
+使可运行的线程总数与可用核数一致
+"""
+
+import os
+import math
+import functools
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Constants
+CPU_BUDGET_ENV = 'VIDEO_TO_AUDIO_CPUS'              # 手动指定可用CPU数
+FFMPEG_THREADS_ENV = 'VIDEO_TO_AUDIO_FFMPEG_THREADS'  # 每个FFmpeg进程的线程数（由任务调度设置）
+AUTO_JOBS = 'auto'
+
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+
+
+def _cgroup_paths(controller: str) -> List[Path]:
+    """当前进程所在的cgroup目录（v2统一层级或v1的指定控制器），从最内层到根"""
+    try:
+        lines = Path('/proc/self/cgroup').read_text().splitlines()
+    except OSError:
+        return []
+
+    paths = []
+    for line in lines:
+        _hierarchy, controllers, relative = line.split(':', 2)
+        if controllers == '':
+            base = CGROUP_ROOT
+        elif controller in controllers.split(','):
+            base = CGROUP_ROOT / controllers
+            if not base.exists():
+                base = CGROUP_ROOT / controller
+        else:
+            continue
+        current = base / relative.lstrip('/')
+        # 配额可能设置在上层cgroup中，逐级向上查找
+        while True:
+            paths.append(current)
+            if current == base:
+                break
+            current = current.parent
+    return paths
+
+
+def cgroup_cpu_quota() -> Optional[float]:
+    """cgroup CPU配额（可用核数，可以是小数），没有限制时返回None"""
+    limits = []
+    for path in _cgroup_paths('cpu'):
+        try:
+            # cgroup v2: cpu.max为"配额 周期"，无限制时配额为max
+            quota, period = (path / 'cpu.max').read_text().split()
+            if quota != 'max':
+                limits.append(int(quota) / int(period))
+            continue
+        except (OSError, ValueError):
+            pass
+        try:
+            # cgroup v1: cpu.cfs_quota_us为-1时无限制
+            quota = int((path / 'cpu.cfs_quota_us').read_text())
+            period = int((path / 'cpu.cfs_period_us').read_text())
+            if quota > 0 and period > 0:
+                limits.append(quota / period)
+        except (OSError, ValueError):
+            pass
+    return min(limits) if limits else None
+
+
+def affinity_cpus() -> int:
+    """进程可以运行的CPU数（taskset/cpuset限制后）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        # Windows/macOS没有sched_getaffinity
+        return os.cpu_count() or 1
+
+
+@functools.lru_cache(maxsize=None)
+def cpu_budget() -> int:
+    """
+    实际可用的CPU数：取亲和性和cgroup配额中较小的一个，配额的小数部分舍去（至少为1）
+    可用环境变量VIDEO_TO_AUDIO_CPUS手动指定
+    """
+    if os.environ.get(CPU_BUDGET_ENV):
+        try:
+            return max(1, int(os.environ[CPU_BUDGET_ENV]))
+        except ValueError:
+            pass
+    budget = affinity_cpus()
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        budget = min(budget, math.floor(quota))
+    return max(1, budget)
+
+
+def plan_concurrency(jobs: Optional[int] = None, budget: Optional[int] = None) -> Tuple[int, int]:
+    """
+    在并行任务数和每个任务的FFmpeg线程数之间分配CPU预算，返回(任务数, 每个任务的线程数)
+    未指定任务数时每个核一个任务（音频解码和FLAC编码基本是单线程的，任务级并行效率最高）
+    """
+    budget = budget or cpu_budget()
+    if jobs is None:
+        return budget, 1
+    jobs = max(1, jobs)
+    return jobs, max(1, budget // jobs)
+
+
+def parse_jobs(value: str) -> int:
+    """解析命令行的-j参数：正整数或auto（按CPU预算），无效时抛出ValueError"""
+    if value == AUTO_JOBS:
+        return plan_concurrency()[0]
+    jobs = int(value)
+    if jobs < 1:
+        raise ValueError(value)
+    return jobs
+
+
+def limit_ffmpeg_threads(threads: int) -> None:
+    """设置本进程（及之后启动的子进程）中每个FFmpeg使用的线程数，用作工作进程的initializer"""
+    os.environ[FFMPEG_THREADS_ENV] = str(max(1, threads))
+
+
+def ffmpeg_threads() -> int:
+    """当前进程中每个FFmpeg应使用的线程数：任务调度设置的值，否则为整个CPU预算"""
+    try:
+        return max(1, int(os.environ[FFMPEG_THREADS_ENV]))
+    except (KeyError, ValueError):
+        return cpu_budget()
+
+
+def ffmpeg_thread_args() -> List[str]:
+    """
+    放在第一个-i之前的FFmpeg参数：-threads限制解码线程，-filter_threads限制滤镜图线程
+    （FFmpeg默认按整机核数创建，不考虑cgroup配额）
+    """
+    threads = str(ffmpeg_threads())
+    return ['-threads', threads, '-filter_threads', threads]
+
+
+def describe_budget() -> str:
+    if os.environ.get(CPU_BUDGET_ENV):
+        return f"可用CPU {cpu_budget()}（{CPU_BUDGET_ENV}）"
+    quota = cgroup_cpu_quota()
+    return (f"可用CPU {cpu_budget()}（亲和性 {affinity_cpus()}"
+            + (f"，cgroup配额 {quota:g}" if quota is not None else "") + "）")
+
+
+if __name__ == "__main__":
+    jobs, threads = plan_concurrency()
+    print(describe_budget())
+    print(f"建议: {jobs}个并行任务，每个FFmpeg {threads}个线程")
@@ -31,7 +31,28 @@ def create_portable_package():
         "video_to_audio.py",
         "flac_metadata_utils.py",
         "lrc_time_adjuster.py",
-        "view_lyrics.py"
+        "view_lyrics.py",
+        "compression_tuner.py",
+        "media_trace.py",
+        "process_runner.py",
+        "run_profiler.py",
+        "job_queue.py",
+        "watch_folder.py",
+        "job_service.py",
+        "batch_convert.py",
+        "conversion_cache.py",
+        "replaygain.py",
+        "cpu_budget.py",
+        "audio_streams.py",
+        "waveform.py",
+        "media_probe.py",
+        "job_context.py",
+        "async_media.py",
+        "album_manifest.py",
+        "subtitle_lyrics.py",
+        "audio_dedupe.py",
+        "input_staging.py",
+        "session_cache.py"
     ]
 
     for file in files_to_copy:
@@ -93,7 +114,7 @@ if errorlevel 1 (
     echo [错误] 启动失败
     echo 请确保已安装Python和必要的依赖包
     echo 依赖安装命令：
-    echo   pip install Pillow requests
+    echo   pip install Pillow requests numpy
     echo.
 )
 
@@ -133,7 +154,7 @@ pause
    下载地址：https://www.python.org/downloads/
 
 2. 安装Python依赖包：
-   pip install Pillow requests
+   pip install Pillow requests numpy
 
 运行方法：
 - 双击"运行程序.bat"启动GUI界面
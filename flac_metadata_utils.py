@@ -5,18 +5,30 @@ FLAC文件元数据工具库（查看、写入封面图片）
 """
 
 import sys
-import subprocess
 import json
 import re
 import os
 import base64
-import tempfile
+import time
+import struct
+import hashlib
+import threading
+import multiprocessing
 import requests
 import urllib.parse
 from pathlib import Path
-from typing import Dict, Optional, Union, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Union, Tuple
 from PIL import Image
 import io
+from contextlib import nullcontext
+
+from media_trace import span, traced, annotate, file_size, sleep as traced_sleep
+from process_runner import run_process
+from media_probe import probe_media
+from job_context import scratch_path, sibling_temp_path
+from run_profiler import profile_run, pop_profile_option
+from cpu_budget import cpu_budget, ffmpeg_thread_args, limit_ffmpeg_threads, parse_jobs, plan_concurrency
 
 # 设置Windows控制台编码为UTF-8
 if sys.platform == 'win32':
@@ -26,94 +38,60 @@ if sys.platform == 'win32':
 def check_ffmpeg():
     """检查FFmpeg是否安装"""
     try:
-        result = subprocess.run(['ffmpeg', '-version'],
-                              capture_output=True,
-                              text=True,
-                              creationflags=subprocess.CREATE_NO_WINDOW)
+        result = run_process(['ffmpeg', '-version'], 'check_ffmpeg',
+                             capture_output=True,
+                             text=True)
         return result.returncode == 0
     except FileNotFoundError:
         return False
 
 
+@traced('get_flac_metadata')
 def get_flac_metadata(flac_path):
-    """获取FLAC文件的元数据"""
-    try:
-        # 使用ffprobe获取详细的元数据信息
-        cmd = [
-            'ffprobe',
-            '-v', 'quiet',
-            '-print_format', 'json',
-            '-show_streams',
-            '-show_format',
-            str(flac_path)
-        ]
-
-        result = subprocess.run(cmd,
-                              capture_output=True,
-                              text=True,
-                              encoding='utf-8',
-                              creationflags=subprocess.CREATE_NO_WINDOW)
-
-        if result.returncode != 0:
-            print(f"错误: 无法读取文件 {flac_path}")
-            print(f"错误信息: {result.stderr}")
-            return None
+    """获取FLAC文件的元数据（来自探测缓存）"""
+    info = probe_media(flac_path)
+    if info is None:
+        print(f"错误: 无法读取文件 {flac_path}")
+        return None
 
-        # 解析JSON输出
-        data = json.loads(result.stdout)
-
-        # 提取格式元数据
-        format_tags = data.get('format', {}).get('tags', {})
-
-        # 提取流元数据（对于FLAC通常只有一个音频流）
-        stream_tags = {}
-        if data.get('streams'):
-            stream_tags = data['streams'][0].get('tags', {})
-
-        # 合并元数据
-        all_metadata = {}
-        all_metadata.update(format_tags)
-        all_metadata.update(stream_tags)
-
-        # 提取视频流信息（封面图片）
-        video_streams = []
-        for stream in data.get('streams', []):
-            if stream.get('codec_type') == 'video':
-                video_streams.append({
-                    'codec': stream.get('codec_name', 'Unknown'),
-                    'width': stream.get('width', 'Unknown'),
-                    'height': stream.get('height', 'Unknown'),
-                    'pix_fmt': stream.get('pix_fmt', 'Unknown')
-                })
-
-        return {
-            'metadata': all_metadata,
-            'format_info': {
-                'format_name': data.get('format', {}).get('format_name', 'Unknown'),
-                'duration': data.get('format', {}).get('duration', 'Unknown'),
-                'size': data.get('format', {}).get('size', 'Unknown'),
-                'bit_rate': data.get('format', {}).get('bit_rate', 'Unknown')
-            },
-            'stream_info': {
-                'codec': data['streams'][0].get('codec_name', 'Unknown') if data.get('streams') else 'Unknown',
-                'sample_rate': data['streams'][0].get('sample_rate', 'Unknown') if data.get('streams') else 'Unknown',
-                'channels': data['streams'][0].get('channels', 'Unknown') if data.get('streams') else 'Unknown',
-                'channel_layout': data['streams'][0].get('channel_layout', 'Unknown') if data.get('streams') else 'Unknown'
-            },
-            'cover_info': {
-                'has_video_cover': len(video_streams) > 0,
-                'video_streams': video_streams,
-                'has_metadata_cover': any(tag in all_metadata for tag in ['METADATA_BLOCK_PICTURE', 'COVERART', 'COVERARTURL', 'ARTWORK'])
-            }
+    def known(value):
+        return value if value else 'Unknown'
+
+    # 合并格式元数据和第一条流的元数据（对于FLAC通常只有一个音频流）
+    first_stream = info.streams[0] if info.streams else None
+    all_metadata = {}
+    all_metadata.update(info.tags)
+    if first_stream:
+        all_metadata.update(first_stream.tags)
+
+    # 提取视频流信息（封面图片）
+    video_streams = [{
+        'codec': known(stream.codec),
+        'width': known(stream.width),
+        'height': known(stream.height),
+        'pix_fmt': known(stream.pix_fmt)
+    } for stream in info.video_streams]
+
+    return {
+        'metadata': all_metadata,
+        'format_info': {
+            'format_name': known(info.format_name),
+            'duration': known(info.duration),
+            'size': known(info.size),
+            'bit_rate': known(info.bit_rate)
+        },
+        'stream_info': {
+            'codec': known(first_stream.codec) if first_stream else 'Unknown',
+            'sample_rate': known(first_stream.sample_rate) if first_stream else 'Unknown',
+            'channels': known(first_stream.channels) if first_stream else 'Unknown',
+            'channel_layout': known(first_stream.channel_layout) if first_stream else 'Unknown'
+        },
+        'cover_info': {
+            'has_video_cover': len(video_streams) > 0,
+            'video_streams': video_streams,
+            'has_metadata_cover': any(tag in all_metadata for tag in ['METADATA_BLOCK_PICTURE', 'COVERART', 'COVERARTURL', 'ARTWORK'])
         }
-
-    except json.JSONDecodeError as e:
-        print(f"错误: 无法解析ffprobe输出")
-        print(f"原始输出: {result.stdout}")
-        return None
-    except Exception as e:
-        print(f"错误: {e}")
-        return None
+    }
 
 
 def format_size(size_bytes):
@@ -148,6 +126,7 @@ def format_duration(seconds):
         return seconds
 
 
+@traced('display_metadata')
 def display_metadata(file_path):
     """显示FLAC文件的元数据"""
     file_path = Path(file_path)
@@ -350,6 +329,130 @@ def parse_lrc_file(lrc_path: Union[str, Path]) -> Tuple[Dict[str, str], str, str
     return metadata, timed_lyrics, pure_lyrics
 
 
+def parse_timed_lines(timed_lyrics: str) -> List[Tuple[int, str]]:
+    """
+    把带时间戳的歌词拆成 [(毫秒, 歌词), ...]，按时间排序
+    一行有多个时间戳时每个时间戳各生成一条
+    """
+    entries = []
+    for line in timed_lyrics.split('\n'):
+        text = TIMESTAMP_PATTERN.sub('', line).strip()
+        for minutes, seconds, hundredths in TIMESTAMP_PATTERN.findall(line):
+            millis = (int(minutes) * 60 + int(seconds)) * 1000 + int(hundredths or 0) * 10
+            entries.append((millis, text))
+    entries.sort(key=lambda entry: entry[0])
+    return entries
+
+
+# ==================== MP3歌词（ID3v2 USLT/SYLT） ====================
+
+ID3_HEADER = struct.Struct('>3sBBB4s')
+ID3_FRAME_HEADER = struct.Struct('>4s4sH')
+ID3_ENCODING_UTF8 = 3
+ID3_LYRICS_LANGUAGE = b'zho'
+# ID3v2标志位：非同步化、扩展头、尾部
+ID3_FLAG_UNSYNC = 0x80
+ID3_FLAG_EXTENDED = 0x40
+ID3_FLAG_FOOTER = 0x10
+
+
+def _syncsafe_encode(value: int) -> bytes:
+    return bytes(((value >> shift) & 0x7F) for shift in (21, 14, 7, 0))
+
+
+def _syncsafe_decode(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _id3_frame(frame_id: bytes, payload: bytes) -> bytes:
+    return ID3_FRAME_HEADER.pack(frame_id, _syncsafe_encode(len(payload)), 0) + payload
+
+
+def _id3_frame_key(frame_id: bytes, payload: bytes) -> Tuple[bytes, bytes]:
+    """同一个键的帧只保留一个：TXXX按描述区分，其他按帧ID"""
+    if frame_id != b'TXXX' or not payload:
+        return frame_id, b''
+    terminator = b'\0\0' if payload[0] in (1, 2) else b'\0'
+    return frame_id, payload[1:].split(terminator, 1)[0]
+
+
+def build_lyrics_frames(timed_lyrics: str, pure_lyrics: str) -> List[Tuple[bytes, bytes]]:
+    """生成ID3v2.4的USLT（不同步歌词）和SYLT（同步歌词，毫秒时间戳）帧"""
+    frames = []
+    if pure_lyrics:
+        frames.append((b'USLT', bytes([ID3_ENCODING_UTF8]) + ID3_LYRICS_LANGUAGE + b'\0'
+                       + pure_lyrics.encode('utf-8')))
+    entries = parse_timed_lines(timed_lyrics) if timed_lyrics else []
+    if entries:
+        # 时间戳格式2=毫秒，内容类型1=歌词
+        payload = bytes([ID3_ENCODING_UTF8]) + ID3_LYRICS_LANGUAGE + bytes([2, 1]) + b'\0'
+        for millis, text in entries:
+            payload += text.encode('utf-8') + b'\0' + struct.pack('>I', millis)
+        frames.append((b'SYLT', payload))
+    return frames
+
+
+def build_txxx_frames(tags: Dict[str, str]) -> List[Tuple[bytes, bytes]]:
+    """自定义文本标签（如REPLAYGAIN_TRACK_GAIN）对应的TXXX帧"""
+    return [(b'TXXX', bytes([ID3_ENCODING_UTF8]) + name.encode('utf-8') + b'\0' + value.encode('utf-8'))
+            for name, value in tags.items()]
+
+
+@traced('rewrite_id3_frames')
+def rewrite_id3_frames(mp3_path: Union[str, Path], new_frames: List[Tuple[bytes, bytes]]) -> bool:
+    """
+    向MP3的ID3v2.4标签添加帧（FFmpeg不支持写SYLT，且流复制会丢掉它不认识的帧）
+    保留已有的其他帧，替换同一键的旧帧
+    """
+    mp3_path = Path(mp3_path)
+    if not new_frames:
+        return True
+
+    with open(mp3_path, 'rb') as f:
+        data = f.read()
+
+    replaced = {_id3_frame_key(frame_id, payload) for frame_id, payload in new_frames}
+    frames = b''
+    audio_offset = 0
+    if data[:3] == b'ID3':
+        _magic, major, _revision, flags, size = ID3_HEADER.unpack_from(data)
+        if major != 4 or flags & (ID3_FLAG_UNSYNC | ID3_FLAG_EXTENDED | ID3_FLAG_FOOTER):
+            print(f"警告：不支持的ID3v2.{major}标签格式，未写入")
+            return False
+        tag_end = ID3_HEADER.size + _syncsafe_decode(size)
+        audio_offset = tag_end
+        offset = ID3_HEADER.size
+        while offset + ID3_FRAME_HEADER.size <= tag_end:
+            frame_id, frame_size, _frame_flags = ID3_FRAME_HEADER.unpack_from(data, offset)
+            if frame_id == b'\0\0\0\0':
+                # 其余为填充
+                break
+            payload_start = offset + ID3_FRAME_HEADER.size
+            frame_end = payload_start + _syncsafe_decode(frame_size)
+            if _id3_frame_key(frame_id, data[payload_start:frame_end]) not in replaced:
+                frames += data[offset:frame_end]
+            offset = frame_end
+
+    frames += b''.join(_id3_frame(frame_id, payload) for frame_id, payload in new_frames)
+    header = ID3_HEADER.pack(b'ID3', 4, 0, 0, _syncsafe_encode(len(frames)))
+    temp_path = sibling_temp_path(mp3_path)
+    with span('id3_rewrite', bytes_out=len(header) + len(frames) + len(data) - audio_offset):
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            f.write(frames)
+            f.write(data[audio_offset:])
+        os.replace(temp_path, mp3_path)
+    return True
+
+
+def write_mp3_lyrics(mp3_path: Union[str, Path], timed_lyrics: str, pure_lyrics: str,
+                     extra_tags: Optional[Dict[str, str]] = None) -> bool:
+    """把歌词以USLT/SYLT帧（以及extra_tags的TXXX帧）写入MP3"""
+    return rewrite_id3_frames(mp3_path, build_lyrics_frames(timed_lyrics, pure_lyrics)
+                              + build_txxx_frames(extra_tags or {}))
+
+
+@traced('embed_lyrics_to_flac')
 def embed_lyrics_to_flac(
     flac_path: Union[str, Path],
     lrc_path: Union[str, Path],
@@ -357,7 +460,6 @@ def embed_lyrics_to_flac(
 ) -> bool:
     """嵌入歌词到FLAC（保留时间戳）"""
     import shutil
-    import time
 
     flac_path = Path(flac_path)
     lrc_path = Path(lrc_path)
@@ -366,8 +468,11 @@ def embed_lyrics_to_flac(
         output_path = flac_path
     output_path = Path(output_path)
 
+    annotate(bytes_in=file_size(flac_path))
+
     try:
-        metadata, timed_lyrics, pure_lyrics = parse_lrc_file(lrc_path)
+        with span('parse_lrc', bytes_in=file_size(lrc_path)):
+            metadata, timed_lyrics, pure_lyrics = parse_lrc_file(lrc_path)
 
         # 如果没有歌词，直接复制文件
         if not timed_lyrics:
@@ -382,15 +487,13 @@ def embed_lyrics_to_flac(
             print(f"注意: 歌词过长({original_length}字符)，已截断到{MAX_LYRICS_LENGTH}字符")
 
         # 等待一下，确保文件不被锁定
-        time.sleep(0.5)
+        traced_sleep(0.5)
 
         # 使用最简单直接的方法：创建带歌词的新文件
         # 首先确保输入输出文件不同
         if flac_path.resolve() == output_path.resolve():
-            # 如果相同，使用临时文件
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.flac')
-            temp_file.close()
-            actual_output = Path(temp_file.name)
+            # 如果相同，使用任务工作目录中的临时文件
+            actual_output = scratch_path('.flac', 'lyrics_')
         else:
             actual_output = output_path
 
@@ -410,22 +513,25 @@ def embed_lyrics_to_flac(
         ]
 
         # 执行命令
-        result = subprocess.run(cmd,
-                              capture_output=True,
-                              text=True,
-                              encoding='utf-8',
-                              creationflags=subprocess.CREATE_NO_WINDOW)
+        with span('ffmpeg_remux', bytes_in=file_size(flac_path)) as remux_span:
+            result = run_process(cmd, 'lyrics_remux',
+                                 capture_output=True,
+                                 text=True,
+                                 encoding='utf-8')
+            remux_span.set(bytes_out=file_size(actual_output))
 
         if result.returncode == 0:
             print(f"成功嵌入歌词({len(timed_lyrics)}字符)")
 
             # 如果使用了临时文件，移动到最终位置
             if actual_output != output_path:
-                time.sleep(0.2)  # 再次等待确保文件释放
-                if output_path.exists():
-                    output_path.unlink()
-                shutil.move(str(actual_output), str(output_path))
+                traced_sleep(0.2)  # 再次等待确保文件释放
+                with span('move', bytes_out=file_size(actual_output)):
+                    if output_path.exists():
+                        output_path.unlink()
+                    shutil.move(str(actual_output), str(output_path))
 
+            annotate(bytes_out=file_size(output_path))
             return True
         else:
             # 打印错误信息
@@ -445,6 +551,74 @@ def embed_lyrics_to_flac(
 
 # ==================== 元数据写入功能 ====================
 
+# 元数据文件中的中文标签 -> 英文标签
+METADATA_TAG_MAPPING = {
+    '标题': 'TITLE',
+    '艺术家': 'ARTIST',
+    '专辑': 'ALBUM',
+    '日期': 'DATE',
+    '流派': 'GENRE',
+    '作曲家': 'COMPOSER',
+    '词作者': 'LYRICIST',
+    '封面图片': 'COVER_IMAGE'
+}
+
+
+def read_text_file(path: Union[str, Path]) -> Optional[str]:
+    """依次尝试常见编码读取文本文件，都失败时返回None"""
+    encodings = ['utf-8', 'gbk', 'gb2312', 'big5', 'latin-1']
+    for encoding in encodings:
+        try:
+            with open(path, 'r', encoding=encoding) as f:
+                return f.read()
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def parse_metadata_line(line: str, tag_mapping: Optional[Dict[str, str]] = None) -> Optional[Tuple[str, str]]:
+    """
+    解析一行 中文标签(英文标签)：值，返回 (标签, 值)
+    空行、注释和无法识别的行返回None
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    # 处理格式：中文(英文)：值
+    # 使用冒号或中文冒号分割
+    if '：' in line:
+        tag_part, value = line.split('：', 1)
+    elif ':' in line:
+        tag_part, value = line.split(':', 1)
+    else:
+        return None
+
+    tag_part = tag_part.strip()
+    value = value.strip()
+
+    # 提取括号内的英文标签
+    if '(' in tag_part and ')' in tag_part:
+        # 中文标签(英文标签) -> 提取英文标签
+        match = re.search(r'\(([^)]+)\)', tag_part)
+        if match:
+            tag = match.group(1)
+        else:
+            tag = tag_part
+    else:
+        # 没有括号，使用整个标签部分
+        tag = tag_part
+
+    # 如果是中文标签，映射到英文
+    tag_mapping = tag_mapping or METADATA_TAG_MAPPING
+    if tag in tag_mapping:
+        tag = tag_mapping[tag]
+
+    if tag and value:
+        return tag, value
+    return None
+
+
 def parse_metadata_file(metadata_file_path: Union[str, Path]) -> Dict[str, str]:
     """
     解析元数据文件
@@ -453,69 +627,16 @@ def parse_metadata_file(metadata_file_path: Union[str, Path]) -> Dict[str, str]:
     metadata = {}
 
     try:
-        # 尝试不同编码读取
-        encodings = ['utf-8', 'gbk', 'gb2312', 'big5', 'latin-1']
-        content = None
-
-        for encoding in encodings:
-            try:
-                with open(metadata_file_path, 'r', encoding=encoding) as f:
-                    content = f.read()
-                break
-            except UnicodeDecodeError:
-                continue
-
+        content = read_text_file(metadata_file_path)
         if content is None:
             print(f"错误：无法读取元数据文件 {metadata_file_path}")
             return metadata
 
         # 解析每一行
         for line in content.split('\n'):
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-
-            # 处理格式：中文(英文)：值
-            # 使用冒号或中文冒号分割
-            if '：' in line:
-                tag_part, value = line.split('：', 1)
-            elif ':' in line:
-                tag_part, value = line.split(':', 1)
-            else:
-                continue
-
-            tag_part = tag_part.strip()
-            value = value.strip()
-
-            # 提取括号内的英文标签
-            if '(' in tag_part and ')' in tag_part:
-                # 中文标签(英文标签) -> 提取英文标签
-                match = re.search(r'\(([^)]+)\)', tag_part)
-                if match:
-                    tag = match.group(1)
-                else:
-                    tag = tag_part
-            else:
-                # 没有括号，使用整个标签部分
-                tag = tag_part
-
-            # 特殊处理标签映射
-            tag_mapping = {
-                '标题': 'TITLE',
-                '艺术家': 'ARTIST',
-                '专辑': 'ALBUM',
-                '日期': 'DATE',
-                '流派': 'GENRE',
-                '作曲家': 'COMPOSER',
-                '词作者': 'LYRICIST',
-                '封面图片': 'COVER_IMAGE'
-            }
-
-            # 如果是中文标签，映射到英文
-            if tag in tag_mapping:
-                tag = tag_mapping[tag]
-
-            if tag and value:
+            parsed = parse_metadata_line(line)
+            if parsed:
+                tag, value = parsed
                 metadata[tag] = value
 
         return metadata
@@ -525,6 +646,37 @@ def parse_metadata_file(metadata_file_path: Union[str, Path]) -> Dict[str, str]:
         return metadata
 
 
+def write_metadata_file(metadata_file_path: Union[str, Path], metadata: Dict[str, str]) -> None:
+    """按 标签：值 格式写出元数据文件（parse_metadata_file可以读回）"""
+    lines = [f"{tag}：{' '.join(str(value).splitlines())}" for tag, value in metadata.items() if value]
+    with open(metadata_file_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def _http_get_image(url: str) -> bytes:
+    """下载网络图片数据，支持bilibili等带压缩参数的URL"""
+    # 设置请求头，模拟浏览器
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+        'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+        'Referer': 'https://www.bilibili.com/',
+    }
+
+    # 处理bilibili等特殊URL
+    # 移除@后面的参数，只保留基础URL
+    clean_url = url
+    if '@' in url and ('.jpg@' in url or '.png@' in url or '.webp@' in url):
+        clean_url = url.split('@')[0]
+
+    with span('http_get', url=clean_url) as http_span:
+        response = requests.get(clean_url, headers=headers, timeout=30)
+        response.raise_for_status()
+        http_span.set(bytes_in=len(response.content), status=response.status_code)
+    return response.content
+
+
+@traced('download_image')
 def download_image(url: str, save_path: Union[str, Path]) -> bool:
     """
     下载网络图片到本地
@@ -532,26 +684,8 @@ def download_image(url: str, save_path: Union[str, Path]) -> bool:
     """
     try:
         print(f"正在下载图片：{url}")
-
-        # 设置请求头，模拟浏览器
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Referer': 'https://www.bilibili.com/',
-        }
-
-        # 处理bilibili等特殊URL
-        # 移除@后面的参数，只保留基础URL
-        clean_url = url
-        if '@' in url and ('.jpg@' in url or '.png@' in url or '.webp@' in url):
-            clean_url = url.split('@')[0]
-
-        response = requests.get(clean_url, headers=headers, timeout=30)
-        response.raise_for_status()
-
-        # 尝试识别图片格式
-        image_data = response.content
+        image_data = _http_get_image(url)
+        annotate(bytes_in=len(image_data))
 
         # 使用PIL尝试打开并转换图片
         try:
@@ -568,7 +702,9 @@ def download_image(url: str, save_path: Union[str, Path]) -> bool:
                     img = background
 
                 # 保存为JPEG
-                img.save(save_path, 'JPEG', quality=95)
+                with span('pil_convert', source_format=img.format) as convert_span:
+                    img.save(save_path, 'JPEG', quality=95)
+                    convert_span.set(bytes_out=file_size(save_path))
                 print(f"图片已转换为JPEG格式：{save_path}")
             else:
                 # 保存原始格式
@@ -582,6 +718,7 @@ def download_image(url: str, save_path: Union[str, Path]) -> bool:
                 f.write(image_data)
             print(f"图片下载完成（原始格式）：{save_path}")
 
+        annotate(bytes_out=file_size(save_path))
         return True
 
     except Exception as e:
@@ -620,24 +757,82 @@ def decode_base64_image(base64_data: str) -> Optional[bytes]:
         return None
 
 
+def _to_embeddable_image(image_data: bytes) -> bytes:
+    """JPEG/PNG原样返回，其他格式（如AVIF）在内存中转换为JPEG"""
+    try:
+        img = Image.open(io.BytesIO(image_data))
+        if img.format in ['JPEG', 'PNG']:
+            return image_data
+
+        if img.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+            img = background
+        with span('pil_convert', source_format=img.format) as convert_span:
+            buffer = io.BytesIO()
+            img.convert('RGB').save(buffer, 'JPEG', quality=95)
+            convert_span.set(bytes_out=buffer.tell())
+        return buffer.getvalue()
+    except Exception:
+        # PIL处理失败，使用原始数据
+        return image_data
+
+
+@traced('load_cover_bytes')
+def load_cover_bytes(cover_input: str) -> Optional[bytes]:
+    """
+    读取封面图片到内存（不写临时文件），用于流式输出
+    支持本地路径、网络URL和Base64编码，返回JPEG/PNG数据，失败时返回None
+    """
+    try:
+        if cover_input.startswith('data:image/'):
+            annotate(source='base64')
+            image_data = decode_base64_image(cover_input)
+        elif cover_input.startswith(('http://', 'https://')):
+            annotate(source='url')
+            image_data = _http_get_image(cover_input)
+        else:
+            cover_path = Path(cover_input)
+            annotate(source='local', bytes_in=file_size(cover_path))
+            if not cover_path.exists():
+                print(f"错误：封面图片文件不存在：{cover_path}")
+                return None
+            image_data = cover_path.read_bytes()
+    except Exception as e:
+        print(f"读取封面图片失败：{e}")
+        return None
+
+    if not image_data:
+        return None
+    image_data = _to_embeddable_image(image_data)
+    annotate(bytes_out=len(image_data))
+    return image_data
+
+
+@traced('prepare_cover_image')
 def prepare_cover_image(cover_input: str, temp_dir: Optional[Path] = None) -> Optional[Path]:
     """
     准备封面图片文件
     支持本地路径、网络URL和Base64编码
+    下载、解码或转换得到的图片写到temp_dir（默认为当前任务的工作目录）中不重名的临时文件
     """
     if temp_dir is None:
-        temp_dir = Path(tempfile.gettempdir())
-
-    temp_path = temp_dir / f"temp_cover_{os.getpid()}.jpg"
+        temp_path = scratch_path('.jpg', 'cover_')
+    else:
+        temp_path = Path(temp_dir) / scratch_path('.jpg', 'cover_').name
 
     try:
         # 检查是否是Base64编码
         if cover_input.startswith('data:image/'):
+            annotate(source='base64')
             print("检测到Base64编码图片")
             image_data = decode_base64_image(cover_input)
             if image_data:
                 with open(temp_path, 'wb') as f:
                     f.write(image_data)
+                annotate(bytes_out=len(image_data))
                 print(f"Base64图片已保存：{temp_path}")
                 return temp_path
             else:
@@ -647,6 +842,7 @@ def prepare_cover_image(cover_input: str, temp_dir: Optional[Path] = None) -> Op
         # 判断是URL还是本地路径
         elif cover_input.startswith(('http://', 'https://')):
             # 网络图片，需要下载
+            annotate(source='url')
             if download_image(cover_input, temp_path):
                 return temp_path
             else:
@@ -655,6 +851,7 @@ def prepare_cover_image(cover_input: str, temp_dir: Optional[Path] = None) -> Op
         else:
             # 本地路径
             cover_path = Path(cover_input)
+            annotate(source='local', bytes_in=file_size(cover_path))
             if cover_path.exists():
                 # 如果本地文件是特殊格式，转换为JPEG
                 try:
@@ -667,7 +864,9 @@ def prepare_cover_image(cover_input: str, temp_dir: Optional[Path] = None) -> Op
                                     img = img.convert('RGBA')
                                 background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
                                 img = background
-                            img.save(temp_path, 'JPEG', quality=95)
+                            with span('pil_convert', source_format=img.format) as convert_span:
+                                img.save(temp_path, 'JPEG', quality=95)
+                                convert_span.set(bytes_out=file_size(temp_path))
                             print(f"本地图片已转换为JPEG：{temp_path}")
                             return temp_path
                         else:
@@ -684,6 +883,7 @@ def prepare_cover_image(cover_input: str, temp_dir: Optional[Path] = None) -> Op
         return None
 
 
+@traced('write_metadata_to_flac')
 def write_metadata_to_flac(
     flac_path: Union[str, Path],
     metadata: Dict[str, str],
@@ -710,7 +910,7 @@ def write_metadata_to_flac(
 
     # 如果没有指定输出路径，使用临时文件
     if output_path is None:
-        temp_output = flac_path.with_name(f"{flac_path.stem}_temp_{os.getpid()}{flac_path.suffix}")
+        temp_output = sibling_temp_path(flac_path)
         final_output = flac_path
     else:
         temp_output = Path(output_path)
@@ -750,23 +950,25 @@ def write_metadata_to_flac(
 
         # 执行命令
         print("正在写入元数据...")
-        result = subprocess.run(cmd,
-                              capture_output=True,
-                              text=True,
-                              encoding='utf-8',
-                              creationflags=subprocess.CREATE_NO_WINDOW)
-
-        # 清理临时下载的图片
-        if cover_image_path and str(cover_image_path).startswith(('http://', 'https://')):
-            if cover_file and cover_file.exists():
-                cover_file.unlink()
+        annotate(bytes_in=file_size(flac_path))
+        with span('ffmpeg_remux', bytes_in=file_size(flac_path)) as remux_span:
+            result = run_process(cmd, 'metadata_remux',
+                                 capture_output=True,
+                                 text=True,
+                                 encoding='utf-8')
+            remux_span.set(bytes_out=file_size(temp_output))
+
+        # 清理下载、解码或转换得到的临时图片（用户提供的原图不删除）
+        if cover_file and cover_file != Path(str(cover_image_path)):
+            cover_file.unlink(missing_ok=True)
 
         if result.returncode == 0:
             # 如果使用临时文件，替换原文件
             if output_path is None:
-                flac_path.unlink()
-                temp_output.rename(flac_path)
+                with span('replace', bytes_out=file_size(temp_output)):
+                    os.replace(temp_output, flac_path)
 
+            annotate(bytes_out=file_size(final_output))
             print("元数据写入成功！")
 
             # 显示写入的元数据
@@ -811,7 +1013,8 @@ def write_metadata_from_file(
         bool: 是否成功
     """
     # 解析元数据文件
-    metadata = parse_metadata_file(metadata_file)
+    with span('parse_metadata', bytes_in=file_size(metadata_file)):
+        metadata = parse_metadata_file(metadata_file)
 
     if not metadata:
         print("错误：没有找到有效的元数据")
@@ -824,6 +1027,252 @@ def write_metadata_from_file(
     return write_metadata_to_flac(flac_path, metadata, cover_image, output_path)
 
 
+# ==================== 完整性校验 ====================
+
+# Constants
+FLAC_MAGIC = b'fLaC'
+STREAMINFO_BLOCK_TYPE = 0
+STREAMINFO_LENGTH = 34
+VERIFY_READ_CHUNK_SIZE = 8 * 1024 * 1024     # 每次持有I/O名额时顺序读取的大小
+VERIFY_PCM_CHUNK_SIZE = 1024 * 1024
+DEFAULT_VERIFY_WORKERS = cpu_budget()
+DEFAULT_VERIFY_IO_SLOTS = 2
+DEFAULT_VERIFY_REPORT = 'flac_verify_report.json'
+# FLAC的MD5按每个样本(位深+7)//8字节、有符号小端计算；FFmpeg可以直接输出的位深
+PCM_FORMATS = {8: ('pcm_s8', 's8'), 16: ('pcm_s16le', 's16le'),
+               24: ('pcm_s24le', 's24le'), 32: ('pcm_s32le', 's32le')}
+
+VERIFY_OK = 'ok'                     # 解码结果与STREAMINFO中的MD5一致
+VERIFY_MISMATCH = 'md5_mismatch'     # MD5不一致（音频数据已损坏）
+VERIFY_TRUNCATED = 'truncated'       # 没有帧错误，但样本数少于STREAMINFO记录的总样本数（在帧边界处截断）
+VERIFY_DECODE_ERROR = 'decode_error' # 解码时出现帧错误（损坏或被截断的帧，丢失的样本数见missing_samples）
+VERIFY_NO_MD5 = 'no_md5'             # 编码时未写入MD5（如流式输出），只检查了解码错误和样本数
+VERIFY_INVALID = 'invalid'           # 不是FLAC文件或STREAMINFO损坏
+VERIFY_UNSUPPORTED = 'unsupported'   # 位深无法按MD5要求的格式解码
+
+_verify_io_slots = None
+
+
+def read_streaminfo(flac_path: Union[str, Path]) -> Optional[Dict[str, Any]]:
+    """
+    直接读取STREAMINFO块（跳过文件开头可能存在的ID3v2标签）
+    返回采样率、声道数、位深、总样本数（0为未知）和MD5（全零表示未写入）
+    """
+    with open(flac_path, 'rb') as f:
+        header = f.read(ID3_HEADER.size)
+        if header[:3] == b'ID3':
+            f.seek(ID3_HEADER.size + _syncsafe_decode(header[6:10]))
+        else:
+            f.seek(0)
+        if f.read(4) != FLAC_MAGIC:
+            return None
+        block_header = f.read(4)
+        if len(block_header) < 4 or block_header[0] & 0x7F != STREAMINFO_BLOCK_TYPE:
+            return None
+        data = f.read(STREAMINFO_LENGTH)
+    if len(data) < STREAMINFO_LENGTH:
+        return None
+
+    # 采样率20位、声道数-1 3位、位深-1 5位、总样本数36位，共64位
+    packed = int.from_bytes(data[10:18], 'big')
+    return {
+        'sample_rate': packed >> 44,
+        'channels': ((packed >> 41) & 0x7) + 1,
+        'bits_per_sample': ((packed >> 36) & 0x1F) + 1,
+        'total_samples': packed & 0xFFFFFFFFF,
+        'md5': data[18:34].hex(),
+    }
+
+
+def _init_verify_worker(io_slots, ffmpeg_threads: int) -> None:
+    global _verify_io_slots
+    _verify_io_slots = io_slots
+    limit_ffmpeg_threads(ffmpeg_threads)
+
+
+def _feed_file(path: Path, write_fd: int, io_slots) -> None:
+    """
+    把文件分块写入FFmpeg的输入管道
+    每块都在持有I/O名额时读取，同时读盘的任务数有上限（机械硬盘上避免多个文件交替寻道）
+    """
+    try:
+        with open(path, 'rb') as source, open(write_fd, 'wb') as pipe:
+            while True:
+                if io_slots is not None:
+                    with io_slots:
+                        chunk = source.read(VERIFY_READ_CHUNK_SIZE)
+                else:
+                    chunk = source.read(VERIFY_READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                pipe.write(chunk)
+    except (BrokenPipeError, OSError):
+        pass
+
+
+def _hash_pcm(read_fd: int, digest, counter: List[int]) -> None:
+    with open(read_fd, 'rb') as pipe:
+        while True:
+            chunk = pipe.read(VERIFY_PCM_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            counter[0] += len(chunk)
+
+
+def _decode_md5_pipes(flac_path: Path, codec: str, pcm_format: str):
+    """文件经管道送入FFmpeg，解码出的PCM经另一个管道在本进程中计算MD5，都不落盘；返回(结果, MD5, PCM字节数)"""
+    in_read, in_write = os.pipe()
+    out_read, out_write = os.pipe()
+    cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', *ffmpeg_thread_args(),
+           '-f', 'flac', '-i', f'pipe:{in_read}',
+           '-map', '0:a:0', '-c:a', codec, '-f', pcm_format, f'pipe:{out_write}']
+
+    digest = hashlib.md5()
+    decoded = [0]
+    feeder = threading.Thread(target=_feed_file, args=(flac_path, in_write, _verify_io_slots), daemon=True)
+    hasher = threading.Thread(target=_hash_pcm, args=(out_read, digest, decoded), daemon=True)
+    feeder.start()
+    hasher.start()
+    try:
+        result = run_process(cmd, 'ffmpeg_verify', capture_output=True, pass_fds=(in_read, out_write))
+    finally:
+        # 子进程结束后关闭本进程持有的管道端，读写线程随之结束
+        os.close(in_read)
+        os.close(out_write)
+        feeder.join()
+        hasher.join()
+    return result, digest.hexdigest(), decoded[0]
+
+
+def _decode_md5_scratch(flac_path: Path, codec: str, pcm_format: str):
+    """
+    Windows不支持继承任意文件描述符：FFmpeg直接读取文件（持有I/O名额），PCM写到临时工作目录，
+    再分块计算MD5后删除；返回(结果, MD5, PCM字节数)
+    """
+    pcm_path = scratch_path(f'.{pcm_format}', 'verify_')
+    cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', *ffmpeg_thread_args(),
+           '-f', 'flac', '-i', str(flac_path),
+           '-map', '0:a:0', '-c:a', codec, '-f', pcm_format, '-y', str(pcm_path)]
+    digest = hashlib.md5()
+    decoded = [0]
+    try:
+        with _verify_io_slots if _verify_io_slots is not None else nullcontext():
+            result = run_process(cmd, 'ffmpeg_verify', capture_output=True)
+        if pcm_path.exists():
+            _hash_pcm(os.open(pcm_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0)), digest, decoded)
+    finally:
+        pcm_path.unlink(missing_ok=True)
+    return result, digest.hexdigest(), decoded[0]
+
+
+@traced('verify_flac')
+def verify_flac(flac_path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    完整解码一个FLAC文件，与STREAMINFO中的MD5比对，同时检查截断和帧错误
+    PCM经管道在本进程中计算MD5，不落盘（Windows下经临时文件，见_decode_md5_scratch）
+    """
+    flac_path = Path(flac_path)
+    started = time.perf_counter()
+    report: Dict[str, Any] = {'path': str(flac_path), 'status': VERIFY_INVALID, 'errors': []}
+    try:
+        info = read_streaminfo(flac_path)
+    except OSError as e:
+        report['errors'].append(str(e))
+        return report
+    if info is None:
+        report['errors'].append('没有有效的STREAMINFO块')
+        return report
+
+    expected_md5 = None if info['md5'] == '0' * 32 else info['md5']
+    report.update(expected_md5=expected_md5, expected_samples=info['total_samples'] or None)
+    if info['bits_per_sample'] not in PCM_FORMATS:
+        report['status'] = VERIFY_UNSUPPORTED
+        report['errors'].append(f"不支持的位深: {info['bits_per_sample']}")
+        return report
+
+    codec, pcm_format = PCM_FORMATS[info['bits_per_sample']]
+    frame_bytes = info['channels'] * ((info['bits_per_sample'] + 7) // 8)
+    decode = _decode_md5_scratch if sys.platform == 'win32' else _decode_md5_pipes
+    with span('ffmpeg_verify', bytes_in=file_size(flac_path)):
+        result, actual_md5, decoded_bytes = decode(flac_path, codec, pcm_format)
+
+    samples = decoded_bytes // frame_bytes
+    errors = [line for line in result.stderr.decode('utf-8', errors='replace').splitlines() if line.strip()]
+    missing = max(info['total_samples'] - samples, 0) if info['total_samples'] else None
+    report.update(actual_md5=actual_md5, samples=samples, missing_samples=missing, errors=errors,
+                  seconds=round(time.perf_counter() - started, 3))
+
+    if result.returncode != 0 or errors:
+        report['status'] = VERIFY_DECODE_ERROR
+    elif missing:
+        report['status'] = VERIFY_TRUNCATED
+    elif expected_md5 is None:
+        report['status'] = VERIFY_NO_MD5
+    elif actual_md5 != expected_md5:
+        report['status'] = VERIFY_MISMATCH
+    else:
+        report['status'] = VERIFY_OK
+    return report
+
+
+def collect_flac_files(sources: List[Union[str, Path]]) -> List[Path]:
+    """收集要校验的FLAC文件（目录递归查找）"""
+    files = []
+    for source in map(Path, sources):
+        if source.is_dir():
+            files.extend(sorted(p for p in source.rglob('*.flac') if p.is_file()))
+        elif source.is_file():
+            files.append(source)
+        else:
+            print(f"警告: '{source}' 不存在，已跳过")
+    return files
+
+
+def verify_library(sources: List[Union[str, Path]], workers: int = DEFAULT_VERIFY_WORKERS,
+                   io_slots: int = DEFAULT_VERIFY_IO_SLOTS,
+                   report_path: Optional[Union[str, Path]] = DEFAULT_VERIFY_REPORT) -> Dict[str, Any]:
+    """
+    用进程池并行校验多个FLAC文件，解码（CPU）的并行数为workers，
+    同时读盘的文件数不超过io_slots；结果写入JSON报告并返回
+    """
+    files = collect_flac_files(sources)
+    print(f"正在校验 {len(files)} 个FLAC文件（{workers}个进程，同时读盘{io_slots}个）...")
+
+    started = time.perf_counter()
+    results = []
+    counts: Dict[str, int] = {}
+    with multiprocessing.Manager() as manager:
+        slots = manager.BoundedSemaphore(io_slots)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_verify_worker,
+                                 initargs=(slots, plan_concurrency(workers)[1])) as executor:
+            futures = {executor.submit(verify_flac, path): path for path in files}
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'path': str(futures[future]), 'status': VERIFY_INVALID, 'errors': [str(e)]}
+                results.append(result)
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+                if result['status'] != VERIFY_OK:
+                    print(f"[{done}/{len(files)}] {result['status']}: {result['path']}")
+
+    results.sort(key=lambda item: item['path'])
+    report = {
+        'generated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'files': len(files),
+        'seconds': round(time.perf_counter() - started, 1),
+        'summary': counts,
+        'results': results,
+    }
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"校验报告: {report_path}")
+    print(f"校验完成: {counts}")
+    return report
+
+
 def print_help():
     """打印帮助信息"""
     print("""
@@ -835,6 +1284,9 @@ FLAC文件元数据工具库（查看和写入）
 用法2: 写入元数据
     python flac_metadata_util.py <FLAC文件> --metadata <元数据文件> [输出文件]
 
+用法3: 校验音频完整性（解码后与STREAMINFO中的MD5比对）
+    python flac_metadata_util.py --verify <目录或FLAC文件>... [-j 进程数|auto] [--io 同时读盘数] [--report 报告文件]
+
 示例:
     # 查看FLAC文件元数据
     python flac_metadata_util.py audio.flac
@@ -845,6 +1297,12 @@ FLAC文件元数据工具库（查看和写入）
     # 写入到新文件
     python flac_metadata_util.py audio.flac --metadata metadata.txt output.flac
 
+    # 用8个进程校验整个曲库（同时最多2个文件读盘），结果写入report.json
+    python flac_metadata_util.py --verify /music -j 8 --io 2 --report report.json
+
+    # 性能分析（输出 prof.pstats 和 prof.tracemalloc.json）
+    python flac_metadata_util.py audio.flac --metadata metadata.txt --profile prof
+
 元数据文件格式:
     标题(TITLE)：歌曲名称
     艺术家(ARTIST)：歌手名
@@ -863,30 +1321,45 @@ FLAC文件元数据工具库（查看和写入）
     - 显示所有元数据标签（标题、艺术家、专辑、歌词等）
     - 写入元数据（支持中文和英文标签）
     - 支持本地和网络图片作为封面
+    - 校验音频完整性：MD5不一致、文件截断、帧错误、未写入MD5，输出JSON报告
     """)
 
 
 def main():
+    try:
+        argv, profile_prefix = pop_profile_option(sys.argv)
+    except ValueError as e:
+        print(f"错误：{e}")
+        sys.exit(1)
+
+    with profile_run(profile_prefix):
+        run_command(argv)
+
+
+def run_command(argv):
+    """执行命令行操作"""
     if not check_ffmpeg():
         print("错误: 未找到FFmpeg/FFprobe")
         print("下载地址: https://ffmpeg.org/download.html")
         sys.exit(1)
 
-    if len(sys.argv) < 2 or sys.argv[1] in ['-h', '--help', 'help']:
+    if len(argv) < 2 or argv[1] in ['-h', '--help', 'help']:
         print_help()
         sys.exit(0)
 
+    if '--verify' in argv:
+        run_verify(argv[1:])
     # 检查是否是写入元数据的命令
-    if '--metadata' in sys.argv:
+    elif '--metadata' in argv:
         # 写入元数据模式
         try:
-            flac_index = sys.argv.index('--metadata') - 1
-            metadata_index = sys.argv.index('--metadata') + 1
-            output_index = metadata_index + 1 if len(sys.argv) > metadata_index + 1 else None
+            flac_index = argv.index('--metadata') - 1
+            metadata_index = argv.index('--metadata') + 1
+            output_index = metadata_index + 1 if len(argv) > metadata_index + 1 else None
 
-            flac_file = sys.argv[flac_index]
-            metadata_file = sys.argv[metadata_index]
-            output_file = sys.argv[output_index] if output_index else None
+            flac_file = argv[flac_index]
+            metadata_file = argv[metadata_index]
+            output_file = argv[output_index] if output_index else None
 
             # 检查文件是否存在
             if not Path(flac_file).exists():
@@ -909,13 +1382,56 @@ def main():
             sys.exit(1)
     else:
         # 查看元数据模式（默认）
-        if len(sys.argv) != 2:
+        if len(argv) != 2:
             print_help()
             sys.exit(1)
 
-        file_path = sys.argv[1]
+        file_path = argv[1]
         display_metadata(file_path)
 
 
+def run_verify(args: List[str]) -> None:
+    """--verify 命令：有文件校验失败时以返回码1退出"""
+    sources = []
+    workers = DEFAULT_VERIFY_WORKERS
+    io_slots = DEFAULT_VERIFY_IO_SLOTS
+    report_path = DEFAULT_VERIFY_REPORT
+
+    i = 0
+    while i < len(args):
+        if args[i] in ('-j', '--io') and i + 1 < len(args):
+            try:
+                value = parse_jobs(args[i + 1]) if args[i] == '-j' else int(args[i + 1])
+                if value < 1:
+                    raise ValueError
+            except ValueError:
+                print(f"错误: {args[i]} 必须是正整数" + ("或auto" if args[i] == '-j' else ""))
+                sys.exit(1)
+            if args[i] == '-j':
+                workers = value
+            else:
+                io_slots = value
+            i += 2
+        elif args[i] == '--report' and i + 1 < len(args):
+            report_path = args[i + 1]
+            i += 2
+        elif args[i] == '--verify':
+            i += 1
+        elif args[i].startswith('-'):
+            print(f"警告: 未知选项 {args[i]}")
+            i += 1
+        else:
+            sources.append(args[i])
+            i += 1
+
+    if not sources:
+        print("错误: 请指定要校验的目录或FLAC文件")
+        sys.exit(1)
+
+    report = verify_library(sources, workers, io_slots, report_path)
+    if any(status not in (VERIFY_OK, VERIFY_NO_MD5) for status in report['summary']):
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
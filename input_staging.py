@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+慢速存储（SMB/NFS共享）上输入文件的预读暂存
+批量转换时FFmpeg直接读取网络共享，I/O停顿会计入编码时间。开启暂存后，第N个任务编码的同时，
+后台线程按队列顺序用大块顺序读取把接下来的任务的输入文件复制到本地暂存目录，任务开始时FFmpeg读取本地副本。
+暂存目录有磁盘预算，比预算还大的文件直接从原位置读取；任务结束后立即删除副本，退出时删除整个暂存目录
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from media_trace import span
+
+# Constants
+STAGE_READ_SIZE = 16 * 1024 * 1024                 # 每次顺序读取的大小
+DEFAULT_STAGE_BUDGET = 8 * 1024 * 1024 * 1024      # 暂存目录的默认磁盘预算
+STAGE_MIN_FREE_BYTES = 1024 * 1024 * 1024          # 复制后本地磁盘至少保留的空闲空间
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+STAGE_COPYING = 'copying'
+STAGE_READY = 'ready'
+STAGE_FAILED = 'failed'
+
+
+def parse_size(value: str) -> int:
+    """解析磁盘大小：字节数或带K/M/G/T单位（如 20G、512M、1.5G），无效时抛出ValueError"""
+    match = SIZE_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"无法解析大小 '{value}'")
+    size = int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+    if size <= 0:
+        raise ValueError(f"大小必须大于0: '{value}'")
+    return size
+
+
+@dataclass
+class _StagedInput:
+    job_id: int
+    source: Path
+    target: Path
+    size: int
+    state: str = STAGE_COPYING
+    taken: bool = False
+
+
+class _StageAborted(Exception):
+    pass
+
+
+class InputStager:
+    """
+    按任务id管理输入文件的本地副本，供JobRunner使用：
+    schedule(接下来的任务) 在预算内加入预读；is_copying(id) 为True时任务应稍后再开始；
+    take(任务) 返回输入指向本地副本的任务；release(id) 在任务结束后删除副本
+    复制在一个后台线程中依次进行，网络共享上同时只有一个顺序读取
+    """
+
+    def __init__(self, budget: int = DEFAULT_STAGE_BUDGET, stage_root: Optional[Union[str, Path]] = None,
+                 lookahead: int = 1):
+        self.budget = budget
+        self.lookahead = max(1, lookahead)
+        if stage_root is not None:
+            Path(stage_root).mkdir(parents=True, exist_ok=True)
+        self.root = Path(tempfile.mkdtemp(prefix='video_to_audio_stage_', dir=stage_root))
+        self.stats = {'staged': 0, 'bytes': 0, 'seconds': 0.0, 'direct': 0, 'failed': 0}
+        self._entries: Dict[int, _StagedInput] = {}
+        self._oversized = set()
+        self._pending = deque()
+        self._closed = False
+        self._changed = threading.Condition()
+        self._worker = threading.Thread(target=self._copy_loop, name='input-stager', daemon=True)
+        self._worker.start()
+
+    def _reserved(self) -> int:
+        return sum(entry.size for entry in self._entries.values() if entry.state != STAGE_FAILED)
+
+    def _has_room(self, size: int) -> bool:
+        if self._reserved() + size > self.budget:
+            return False
+        try:
+            return shutil.disk_usage(self.root).free - size >= STAGE_MIN_FREE_BYTES
+        except OSError:
+            return False
+
+    def schedule(self, jobs: List[Dict[str, Any]]) -> None:
+        """
+        把即将开始的任务（按队列顺序）加入预读，最多lookahead个尚未开始的副本
+        下一个文件放不下时停止，不跳到后面的小文件，等运行中任务的副本释放后再加入
+        """
+        with self._changed:
+            if self._closed:
+                return
+            waiting = sum(1 for entry in self._entries.values() if not entry.taken)
+            for job in jobs:
+                job_id = job['id']
+                if job_id in self._entries or job_id in self._oversized:
+                    continue
+                if waiting >= self.lookahead:
+                    break
+                source = Path(job['input'])
+                try:
+                    size = source.stat().st_size
+                except OSError:
+                    self._oversized.add(job_id)
+                    continue
+                if size > self.budget:
+                    # 比整个预算还大，直接从原位置读取
+                    self._oversized.add(job_id)
+                    continue
+                if not self._has_room(size):
+                    break
+                target = self.root / str(job_id) / source.name
+                self._entries[job_id] = _StagedInput(job_id, source, target, size)
+                self._pending.append(job_id)
+                waiting += 1
+            self._changed.notify_all()
+
+    def is_copying(self, job_id: int) -> bool:
+        with self._changed:
+            entry = self._entries.get(job_id)
+            return entry is not None and entry.state == STAGE_COPYING
+
+    def take(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """任务开始：副本已就绪时返回输入替换为本地副本的任务，否则返回原任务（从原位置读取）"""
+        with self._changed:
+            self._oversized.discard(job['id'])
+            entry = self._entries.get(job['id'])
+            if entry is None or entry.state != STAGE_READY:
+                self.stats['direct'] += 1
+                if entry is not None:
+                    # 还在复制或复制失败：放弃副本
+                    self._discard(entry)
+                return job
+            entry.taken = True
+            return {**job, 'input': str(entry.target)}
+
+    def release(self, job_id: int) -> None:
+        """任务结束（完成、失败或取消）后删除副本"""
+        with self._changed:
+            entry = self._entries.get(job_id)
+            if entry is not None:
+                self._discard(entry)
+
+    def _discard(self, entry: _StagedInput) -> None:
+        self._entries.pop(entry.job_id, None)
+        if entry.state != STAGE_COPYING:
+            # 复制中的副本由复制线程在下一块读取前发现并删除
+            shutil.rmtree(entry.target.parent, ignore_errors=True)
+        self._changed.notify_all()
+
+    def close(self) -> None:
+        """停止预读并删除整个暂存目录"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self._worker.join()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def describe(self) -> str:
+        stats = self.stats
+        speed = stats['bytes'] / stats['seconds'] / 1024 / 1024 if stats['seconds'] > 0 else 0.0
+        return (f"预读暂存: {stats['staged']}个文件，{stats['bytes'] / 1024 / 1024:.0f}MB，"
+                f"平均{speed:.1f}MB/s；直接读取{stats['direct']}个，复制失败{stats['failed']}个")
+
+    def _copy_loop(self) -> None:
+        while True:
+            with self._changed:
+                while not self._closed and not self._pending:
+                    self._changed.wait()
+                if self._closed:
+                    return
+                entry = self._entries.get(self._pending.popleft())
+            if entry is None:
+                continue
+
+            started = time.perf_counter()
+            try:
+                self._copy(entry)
+                state = STAGE_READY
+            except _StageAborted:
+                state = None
+            except OSError as e:
+                print(f"警告: 预读失败，将直接读取 {entry.source}: {e}")
+                state = STAGE_FAILED
+
+            with self._changed:
+                if state is None or self._entries.get(entry.job_id) is not entry:
+                    # 复制期间任务已开始或已释放
+                    shutil.rmtree(entry.target.parent, ignore_errors=True)
+                elif state == STAGE_FAILED:
+                    shutil.rmtree(entry.target.parent, ignore_errors=True)
+                    entry.state = STAGE_FAILED
+                    self.stats['failed'] += 1
+                else:
+                    entry.state = STAGE_READY
+                    self.stats['staged'] += 1
+                    self.stats['bytes'] += entry.size
+                    self.stats['seconds'] += time.perf_counter() - started
+                self._changed.notify_all()
+
+    def _copy(self, entry: _StagedInput) -> None:
+        """大块顺序读取复制到暂存目录，保留修改时间（编码缓存的键包含输入文件的修改时间）"""
+        entry.target.parent.mkdir(parents=True, exist_ok=True)
+        buffer = bytearray(STAGE_READ_SIZE)
+        view = memoryview(buffer)
+        copied = 0
+        with span('stage_input', bytes_in=entry.size), \
+                open(entry.source, 'rb') as source, open(entry.target, 'wb') as target:
+            if hasattr(os, 'posix_fadvise'):
+                # 提示内核（和NFS客户端）按顺序读取，加大预读窗口
+                os.posix_fadvise(source.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while True:
+                if self._closed or self._entries.get(entry.job_id) is not entry:
+                    raise _StageAborted()
+                count = source.readinto(buffer)
+                if not count:
+                    break
+                target.write(view[:count])
+                copied += count
+        if copied != entry.size:
+            raise OSError(f"复制了{copied}字节，源文件为{entry.size}字节（复制期间被修改？）")
+        stat = entry.source.stat()
+        os.utime(entry.target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
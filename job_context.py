@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务上下文
+让process_media可以在同一进程的多个线程中同时运行：每个任务有独立的临时工作目录（封面、中间文件）、
+独立的日志和结果对象，任务结束时删除工作目录。
+与process_runner的资源统计一样用contextvars保存当前任务，每个线程互不影响；
+print通过sys.stdout代理写入当前任务的日志，按整行转发，不同任务的输出不会在行内交错
+（任务内部另开的线程不在任务上下文中，输出直接写到原来的标准输出）
+"""
+
+import io
+import sys
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TextIO
+
+# Constants
+JOB_LOG_MAX_LINES = 5000
+WORKSPACE_PREFIX = 'video_to_audio_job_'
+
+_current_context = contextvars.ContextVar('job_context', default=None)
+_router_lock = threading.Lock()
+
+
+@dataclass
+class JobResult:
+    """一个任务的结果（由process_media在运行过程中填写）"""
+    success: bool = False
+    input_path: Optional[str] = None
+    output_path: Optional[str] = None
+    extra_outputs: List[str] = field(default_factory=list)
+    returncode: Optional[int] = None
+    cache_hit: Optional[str] = None
+    loudness: Optional[Dict[str, float]] = None
+    compression_level: Optional[int] = None
+    tune_report: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    log: List[str] = field(default_factory=list)
+
+
+class JobLog:
+    """
+    一个任务的日志：按行保存最近JOB_LOG_MAX_LINES行，并把每个完整的行一次性写到sink
+    sink为None时写到安装代理之前的标准输出
+    """
+
+    def __init__(self, sink: Optional[TextIO] = None):
+        self.sink = sink
+        self.lines = deque(maxlen=JOB_LOG_MAX_LINES)
+        self._pending = ''
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            self._pending += text
+            *lines, self._pending = self._pending.split('\n')
+            for line in lines:
+                self._emit(line)
+        return len(text)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._pending:
+                self._emit(self._pending)
+                self._pending = ''
+            sink = self._sink()
+            if sink is not None:
+                sink.flush()
+
+    def _sink(self) -> Optional[TextIO]:
+        if self.sink is not None:
+            return self.sink
+        return sys.stdout._fallback if isinstance(sys.stdout, _JobStdout) else sys.stdout
+
+    def _emit(self, line: str) -> None:
+        self.lines.append(line)
+        sink = self._sink()
+        if sink is not None:
+            sink.write(line + '\n')
+
+
+class _JobStdout(io.TextIOBase):
+    """sys.stdout代理：当前线程处于任务上下文中时写入任务日志，否则写到原来的标准输出"""
+
+    def __init__(self, fallback: TextIO):
+        self._fallback = fallback
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        context = _current_context.get()
+        if context is not None:
+            return context.log.write(text)
+        return self._fallback.write(text)
+
+    def flush(self):
+        context = _current_context.get()
+        if context is not None:
+            context.log.flush()
+        else:
+            self._fallback.flush()
+
+    def fileno(self):
+        return self._fallback.fileno()
+
+    @property
+    def encoding(self):
+        return getattr(self._fallback, 'encoding', 'utf-8')
+
+
+def _install_stdout_router() -> None:
+    with _router_lock:
+        if not isinstance(sys.stdout, _JobStdout):
+            sys.stdout = _JobStdout(sys.stdout)
+
+
+class JobContext:
+    """
+    任务上下文（用with进入）
+    workspace在第一次使用时创建，退出时连同其中的临时文件一起删除
+    """
+
+    def __init__(self, name: str = '', sink: Optional[TextIO] = None):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.log = JobLog(sink)
+        self.result = JobResult()
+        self._workspace: Optional[Path] = None
+        self._token = None
+        self._started = 0.0
+
+    @property
+    def workspace(self) -> Path:
+        if self._workspace is None:
+            self._workspace = Path(tempfile.mkdtemp(prefix=f"{WORKSPACE_PREFIX}{self.id}_"))
+        return self._workspace
+
+    def __enter__(self) -> 'JobContext':
+        _install_stdout_router()
+        self._started = time.monotonic()
+        self._token = _current_context.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.log.flush()
+        _current_context.reset(self._token)
+        self.result.elapsed = time.monotonic() - self._started
+        self.result.log = list(self.log.lines)
+        if self._workspace is not None:
+            shutil.rmtree(self._workspace, ignore_errors=True)
+            self._workspace = None
+
+
+@contextmanager
+def job_context(name: str = '', sink: Optional[TextIO] = None):
+    """进入任务上下文；已经处于某个任务中时复用外层任务（与process_runner.job_resources相同）"""
+    context = _current_context.get()
+    if context is not None:
+        yield context
+        return
+    with JobContext(name, sink) as context:
+        yield context
+
+
+def current_job_context() -> Optional[JobContext]:
+    return _current_context.get()
+
+
+def update_result(**fields: Any) -> None:
+    """填写当前任务的结果（不在任务中时忽略）"""
+    context = _current_context.get()
+    if context is not None:
+        for key, value in fields.items():
+            setattr(context.result, key, value)
+
+
+def scratch_dir() -> Path:
+    """当前任务的临时工作目录，不在任务中时为系统临时目录"""
+    context = _current_context.get()
+    return context.workspace if context is not None else Path(tempfile.gettempdir())
+
+
+def scratch_path(suffix: str = '', prefix: str = 'tmp_') -> Path:
+    """临时工作目录中一个不会与其他任务冲突的文件名（不创建文件）"""
+    return scratch_dir() / f"{prefix}{uuid.uuid4().hex[:12]}{suffix}"
+
+
+def sibling_temp_path(path: Path, tag: str = 'temp') -> Path:
+    """
+    与path同目录的临时文件名（<名称>_<tag>_<随机>.<后缀>），写完后可以用os.replace原子替换
+    每次调用都不同，同一个输出被多个线程同时处理时也不会冲突
+    """
+    return path.with_name(f"{path.stem}_{tag}_{uuid.uuid4().hex[:12]}{path.suffix}")
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化转换任务队列
+任务保存在SQLite数据库中（queued/running/done/failed），程序重启后队列不丢失；
+JobRunner用有上限的进程池执行process_media，供监视文件夹、HTTP任务服务等长时间运行的模式使用
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from media_trace import add_listener, remove_listener
+from process_runner import ProcessCancelled, cancel_scope
+from cpu_budget import plan_concurrency, limit_ffmpeg_threads
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+DEFAULT_WORKERS = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source_key TEXT UNIQUE,
+    input TEXT NOT NULL,
+    output TEXT,
+    lrc TEXT,
+    metadata TEXT,
+    options TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    output_hash TEXT,
+    created REAL,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: Union[str, Path]) -> str:
+    """计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def same_file(first: Optional[Union[str, Path]], second: Optional[Union[str, Path]]) -> bool:
+    """两个路径是否指向同一个文件（解析符号链接；都存在时还比较设备和inode，识别硬链接）"""
+    if not first or not second:
+        return False
+    first, second = Path(first), Path(second)
+    try:
+        if first.exists() and second.exists():
+            return os.path.samefile(first, second)
+    except OSError:
+        pass
+    return first.resolve() == second.resolve()
+
+
+def output_state(output_path: Optional[Union[str, Path]]) -> Optional[Tuple[int, int]]:
+    """输出文件的(大小, 修改时间)，不存在时返回None；用于判断转换是否写入了输出文件"""
+    if not output_path:
+        return None
+    try:
+        stat = Path(output_path).stat()
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def cleanup_partial_output(output_path: Optional[Union[str, Path]],
+                           input_path: Optional[Union[str, Path]] = None,
+                           previous_state: Optional[Tuple[int, int]] = None) -> List[Path]:
+    """
+    删除中断的任务留下的输出文件和process_media/元数据工具产生的临时文件
+    （<输出名>_temp_*），返回删除的文件
+    输出文件与input_path是同一个文件时不删除；提供previous_state（转换前的output_state）时，
+    输出文件未被本次转换改动（仍是转换前就存在的文件）也不删除
+    """
+    if not output_path:
+        return []
+    output_path = Path(output_path)
+    removed = []
+    candidates = []
+    state = output_state(output_path)
+    if state is not None and state != previous_state and not same_file(output_path, input_path):
+        candidates.append(output_path)
+    if output_path.parent.is_dir():
+        candidates += list(output_path.parent.glob(f"{output_path.stem}_temp_*{output_path.suffix}"))
+    for path in candidates:
+        try:
+            path.unlink()
+            removed.append(path)
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+class JobStore:
+    """SQLite任务表，可被多个线程共享"""
+
+    def __init__(self, db_path: Union[str, Path]):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+            # 旧版本的数据库没有output_hash列
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if 'output_hash' not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN output_hash TEXT")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def add(self, input_path: Union[str, Path], output_path: Optional[Union[str, Path]] = None,
+            lrc_path: Optional[Union[str, Path]] = None, metadata_file: Optional[Union[str, Path]] = None,
+            options: Optional[Dict[str, Any]] = None, source_key: Optional[str] = None) -> Optional[int]:
+        """
+        加入队列
+        source_key相同的任务只会加入一次（用于避免重复转换同一个文件），重复时返回None
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (source_key, input, output, lrc, metadata, options, state, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source_key, str(input_path), str(output_path) if output_path else None,
+                 str(lrc_path) if lrc_path else None, str(metadata_file) if metadata_file else None,
+                 json.dumps(options or {}), JOB_QUEUED, now, now))
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """取出最早的排队任务并标记为running"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE state = ? ORDER BY id LIMIT 1", (JOB_QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                (JOB_RUNNING, time.time(), row['id']))
+        job = self._to_dict(row)
+        job['state'] = JOB_RUNNING
+        return job
+
+    def peek_queued(self, limit: int) -> List[Dict[str, Any]]:
+        """接下来会被claim_next取出的limit个任务（不改变状态）"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id LIMIT ?",
+                                      (JOB_QUEUED, limit)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def mark_done(self, job_id: int, output_hash: Optional[str] = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, error = NULL, output_hash = ?, updated = ? WHERE id = ?",
+                               (JOB_DONE, output_hash, time.time(), job_id))
+
+    def mark_failed(self, job_id: int, error: str = '') -> None:
+        self._set_state(job_id, JOB_FAILED, error)
+
+    def mark_cancelled(self, job_id: int) -> None:
+        self._set_state(job_id, JOB_CANCELLED, None)
+
+    def cancel_queued(self, job_id: int) -> bool:
+        """取消还在排队的任务，任务已开始或不存在时返回False"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE id = ? AND state = ?",
+                                        (JOB_CANCELLED, time.time(), job_id, JOB_QUEUED))
+            return cursor.rowcount > 0
+
+    def _set_state(self, job_id: int, state: str, error: Optional[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?",
+                               (state, error, time.time(), job_id))
+
+    def requeue(self, job_id: int) -> None:
+        """把任务重新放回队列（如重试失败的任务）"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, error = NULL, output_hash = NULL, updated = ? WHERE id = ?",
+                               (JOB_QUEUED, time.time(), job_id))
+
+    def find(self, source_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE source_key = ?", (source_key,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def requeue_running(self) -> List[Dict[str, Any]]:
+        """把上次异常退出时仍处于running的任务放回队列，返回这些任务"""
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE state = ?", (JOB_RUNNING,)).fetchall()
+            self._conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE state = ?",
+                               (JOB_QUEUED, time.time(), JOB_RUNNING))
+        return [self._to_dict(row) for row in rows]
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, state: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            if state:
+                rows = self._conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job['options'] = json.loads(job['options'] or '{}')
+        return job
+
+
+class _ProgressReporter:
+    """
+    工作进程中的media_trace监听器：把当前阶段写入主进程共享的progress字典，
+    并通过cancel_flags判断任务是否被取消
+    """
+
+    def __init__(self, job_id: int, progress, cancel_flags):
+        self.job_id = job_id
+        self.progress = progress
+        self.cancel_flags = cancel_flags
+        self.stages_done = 0
+        self.stage = None
+
+    def _publish(self) -> None:
+        self.progress[self.job_id] = {'stage': self.stage, 'stages_done': self.stages_done,
+                                      'updated': time.time()}
+
+    def span_started(self, current) -> None:
+        self.stage = current.name
+        self._publish()
+
+    def span_finished(self, current) -> None:
+        self.stages_done += 1
+        self._publish()
+
+    def is_cancelled(self) -> bool:
+        return self.job_id in self.cancel_flags
+
+
+def _convert(job: Dict[str, Any]) -> Optional[str]:
+    """执行转换，成功时返回输出文件的SHA-256；失败或被取消时删除不完整的输出"""
+    # 在子进程中导入，避免主进程加载PIL等依赖
+    from video_to_audio import process_media
+
+    if same_file(job['input'], job['output']):
+        print(f"错误: 输出文件与输入文件是同一个文件: {job['output']}")
+        return None
+    # 只清理本次转换写入的输出，转换前就存在且未被改动的文件保留
+    previous_state = output_state(job['output'])
+    try:
+        success = process_media(job['input'], job['output'], lrc_path=job['lrc'],
+                                metadata_file=job['metadata'], **job['options'])
+    except BaseException:
+        cleanup_partial_output(job['output'], job['input'], previous_state)
+        raise
+    if not success:
+        cleanup_partial_output(job['output'], job['input'], previous_state)
+        return None
+    if job['output'] and Path(job['output']).exists():
+        return hash_file(job['output'])
+    return ''
+
+
+def run_job(job: Dict[str, Any], progress=None, cancel_flags=None) -> Optional[str]:
+    """
+    在工作进程中执行一个任务，成功时返回输出文件的SHA-256，失败时返回None
+    提供progress/cancel_flags（Manager字典）时上报阶段进度并响应取消（抛出ProcessCancelled）
+    """
+    if progress is None:
+        return _convert(job)
+
+    reporter = _ProgressReporter(job['id'], progress, cancel_flags)
+    add_listener(reporter)
+    try:
+        with cancel_scope(reporter.is_cancelled):
+            return _convert(job)
+    finally:
+        remove_listener(reporter)
+
+
+class JobRunner:
+    """
+    用固定大小的进程池消费JobStore中的任务
+    工作进程常驻，跨任务复用已加载的模块和缓存
+    CPU预算（见cpu_budget）在各工作进程间平均分配，限制每个FFmpeg的线程数，避免超额订阅
+    track_progress为True时通过Manager字典收集各任务的阶段进度，并支持取消进行中的任务
+    提供stager（见input_staging.InputStager）时，在当前任务运行期间预读接下来的任务的输入文件
+    on_finish在每个任务结束（完成、失败或取消）并更新状态后调用，参数为任务
+    """
+
+    def __init__(self, store: JobStore, workers: int = DEFAULT_WORKERS, track_progress: bool = False,
+                 ffmpeg_threads: Optional[int] = None, stager=None,
+                 on_finish: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.store = store
+        self.stager = stager
+        self.on_finish = on_finish
+        self._waiting_for_stage = False
+        self.workers, planned_threads = plan_concurrency(workers)
+        self.ffmpeg_threads = ffmpeg_threads or planned_threads
+        self._executor = self._new_executor()
+        self._running: Dict[Any, Dict[str, Any]] = {}
+        self._manager = None
+        self._progress = None
+        self._cancel_flags = None
+        if track_progress:
+            self._manager = multiprocessing.Manager()
+            self._progress = self._manager.dict()
+            self._cancel_flags = self._manager.dict()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=limit_ffmpeg_threads,
+                                   initargs=(self.ffmpeg_threads,))
+
+    @property
+    def busy(self) -> int:
+        return len(self._running)
+
+    def running_ids(self) -> List[int]:
+        return [job['id'] for job in list(self._running.values())]
+
+    def progress(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """进行中任务的当前阶段，未开启进度跟踪或还没有上报时返回None"""
+        if self._progress is None:
+            return None
+        return self._progress.get(job_id)
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        取消任务：排队中的直接标记为cancelled；
+        进行中的通知工作进程终止FFmpeg（需要track_progress），完成后由pump标记
+        """
+        if self.store.cancel_queued(job_id):
+            return True
+        if self._cancel_flags is not None and job_id in self.running_ids():
+            self._cancel_flags[job_id] = True
+            return True
+        return False
+
+    def pump(self) -> int:
+        """回收已完成的任务并补充新任务，不阻塞；返回本次完成的任务数"""
+        finished = 0
+        for future in [f for f in self._running if f.done()]:
+            job = self._running.pop(future)
+            finished += 1
+            if self.stager is not None:
+                self.stager.release(job['id'])
+            if self._progress is not None:
+                self._progress.pop(job['id'], None)
+                self._cancel_flags.pop(job['id'], None)
+            try:
+                output_hash = future.result()
+                success = output_hash is not None
+                error = '' if success else 'process_media返回失败'
+            except ProcessCancelled:
+                success, error = None, ''
+            except Exception as e:
+                success, error = False, f"{type(e).__name__}: {e}"
+
+            if success is None:
+                self.store.mark_cancelled(job['id'])
+                print(f"[取消] {job['input']}")
+            elif success:
+                self.store.mark_done(job['id'], output_hash or None)
+                print(f"[完成] {job['input']}")
+            else:
+                self.store.mark_failed(job['id'], error)
+                print(f"[失败] {job['input']}: {error}")
+            if self.on_finish is not None:
+                self.on_finish(job)
+
+        self._waiting_for_stage = False
+        while len(self._running) < self.workers:
+            if self.stager is not None:
+                upcoming = self.store.peek_queued(1)
+                if upcoming and self.stager.is_copying(upcoming[0]['id']):
+                    # 输入文件正在预读，复制完成后再开始（同时直接读取会与预读争抢网络带宽）
+                    self._waiting_for_stage = True
+                    break
+            job = self.store.claim_next()
+            if job is None:
+                break
+            print(f"[开始] {job['input']}")
+            submitted = self.stager.take(job) if self.stager is not None else job
+            try:
+                future = self._executor.submit(run_job, submitted, self._progress, self._cancel_flags)
+            except BrokenProcessPool:
+                # 工作进程异常退出（如被OOM终止）后进程池不可用，重建后重试
+                self._executor = self._new_executor()
+                future = self._executor.submit(run_job, submitted, self._progress, self._cancel_flags)
+            self._running[future] = job
+
+        if self.stager is not None:
+            self.stager.schedule(self.store.peek_queued(self.stager.lookahead))
+        return finished
+
+    def drain(self, poll_interval: float = 0.5) -> None:
+        """一直运行到队列为空且没有正在执行的任务"""
+        while True:
+            self.pump()
+            if not self._running and not self._waiting_for_stage:
+                break
+            time.sleep(poll_interval)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+        if self.stager is not None:
+            self.stager.close()
+        if self._manager is not None:
+            self._manager.shutdown()
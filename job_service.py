@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP转换任务服务
+在本机启动一个HTTP接口，其他程序可以提交转换任务、查询状态和进度、取消任务、查看队列。
+任务保存在持久化队列（job_queue.JobStore）中，由常驻的工作进程池执行process_media，
+工作进程跨任务复用已加载的模块和缓存
+
+接口（请求和响应均为JSON）:
+    POST   /jobs            提交任务
+    GET    /jobs            列出任务（可加 ?state=queued|running|done|failed|cancelled）
+    GET    /jobs/<id>       任务状态和进度
+    DELETE /jobs/<id>       取消任务（也可以 POST /jobs/<id>/cancel）
+    GET    /health          服务状态和队列统计
+"""
+
+import re
+import sys
+import json
+import math
+import uuid
+import shutil
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from job_queue import (
+    JobStore,
+    JobRunner,
+    DEFAULT_WORKERS,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_CANCELLED,
+    cleanup_partial_output,
+    same_file
+)
+from video_to_audio import parse_time, default_output_path
+from compression_tuner import AUTO_FLAC_COMPRESSION
+from audio_streams import STREAM_POLICIES, parse_stream_policy
+from cpu_budget import parse_jobs
+
+# Constants
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_FILE = 'job_service.db'
+DEFAULT_UPLOAD_DIR = 'job_uploads'
+PUMP_INTERVAL = 0.5
+MAX_REQUEST_BYTES = 4 * 1024 * 1024
+JOB_STATES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+UPLOAD_TOKEN_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class RequestError(Exception):
+    """请求参数错误，返回400"""
+
+
+class JobService:
+    """队列 + 工作进程池 + 后台调度线程"""
+
+    def __init__(self, store: JobStore, workers: int = DEFAULT_WORKERS,
+                 upload_dir: str = DEFAULT_UPLOAD_DIR):
+        self.store = store
+        self.runner = JobRunner(store, workers, track_progress=True, on_finish=self._discard_uploads)
+        self.upload_dir = Path(upload_dir)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._runner_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._pump_loop, name='job-pump', daemon=True)
+
+    def start(self) -> None:
+        requeued = self.store.requeue_running()
+        for job in requeued:
+            cleanup_partial_output(job['output'], job['input'])
+        if requeued:
+            print(f"恢复上次未完成的任务: {len(requeued)}个")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+        self.runner.shutdown()
+
+    def _pump_loop(self) -> None:
+        while not self._stopping.is_set():
+            with self._runner_lock:
+                self.runner.pump()
+            self._wakeup.wait(PUMP_INTERVAL)
+            self._wakeup.clear()
+
+    def _save_upload(self, token: str, name: str, text: str) -> Path:
+        """把请求中直接上传的歌词/元数据内容保存为文件"""
+        directory = self.upload_dir.resolve() / token
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / name
+        path.write_text(text, encoding='utf-8')
+        return path
+
+    def _discard_uploads(self, job: Dict[str, Any]) -> None:
+        """任务结束后删除它上传的歌词/元数据（保存在以任务source_key命名的目录中）"""
+        token = job.get('source_key')
+        if token and UPLOAD_TOKEN_PATTERN.match(token):
+            shutil.rmtree(self.upload_dir.resolve() / token, ignore_errors=True)
+
+    def submit(self, request: Dict[str, Any]) -> int:
+        """
+        提交任务
+        字段: input（必填）、output、lrc / lrc_text、metadata / metadata_text、
+              start_time、duration、flac_compression、min_encode_speed
+        lrc_text/metadata_text为上传的文件内容，lrc/metadata为服务所在机器上的路径
+        """
+        input_path = request.get('input')
+        if not input_path or not isinstance(input_path, str):
+            raise RequestError("缺少input")
+        if not Path(input_path).exists():
+            raise RequestError(f"文件 '{input_path}' 不存在")
+
+        options: Dict[str, Any] = {}
+        for key in ('start_time', 'duration'):
+            if request.get(key) is not None:
+                seconds = parse_time(str(request[key]))
+                if seconds is None:
+                    raise RequestError(f"无法解析时间 {key}={request[key]!r}")
+                options[key] = seconds
+
+        compression = request.get('flac_compression')
+        if compression is not None:
+            # bool是int的子类，true/false不能当作级别
+            if compression != AUTO_FLAC_COMPRESSION and (
+                    not isinstance(compression, int) or isinstance(compression, bool) or not 0 <= compression <= 8):
+                raise RequestError("flac_compression必须是0-8或auto")
+            options['flac_compression'] = compression
+
+        if request.get('min_encode_speed') is not None:
+            try:
+                speed = float(request['min_encode_speed'])
+            except (TypeError, ValueError):
+                raise RequestError("min_encode_speed必须是数字")
+            if isinstance(request['min_encode_speed'], bool) or not (math.isfinite(speed) and speed > 0):
+                raise RequestError("min_encode_speed必须是大于0的数字")
+            options['min_encode_speed'] = speed
+
+        if request.get('audio_stream') is not None:
+            try:
+                options['audio_stream'] = parse_stream_policy(str(request['audio_stream']))
+            except ValueError:
+                raise RequestError(f"audio_stream必须是音频流序号或 {'/'.join(STREAM_POLICIES)}")
+        if request.get('audio_language'):
+            options['audio_language'] = str(request['audio_language'])
+
+        # 先检查全部参数，通过后再保存上传的内容
+        lrc_path = None if request.get('lrc_text') else request.get('lrc')
+        metadata_file = None if request.get('metadata_text') else request.get('metadata')
+        for label, path in (('lrc', lrc_path), ('metadata', metadata_file)):
+            if path and not Path(path).exists():
+                raise RequestError(f"{label}文件 '{path}' 不存在")
+
+        output_path = request.get('output')
+        if not output_path:
+            output_path = Path(input_path).with_suffix('.flac')
+            if same_file(input_path, output_path):
+                # 输入已经是FLAC：与命令行相同，默认输出为 <名称>_trimmed[_with_metadata].flac
+                has_tags = bool(request.get('lrc_text') or request.get('metadata_text') or lrc_path or metadata_file)
+                output_path = default_output_path(Path(input_path), None, has_tags)
+        if same_file(input_path, output_path):
+            raise RequestError(f"输出文件 '{output_path}' 与输入文件是同一个文件")
+
+        token = uuid.uuid4().hex
+        try:
+            if request.get('lrc_text'):
+                lrc_path = self._save_upload(token, 'lyrics.lrc', request['lrc_text'])
+            if request.get('metadata_text'):
+                metadata_file = self._save_upload(token, 'metadata.txt', request['metadata_text'])
+            job_id = self.store.add(input_path, output_path, lrc_path, metadata_file,
+                                    options=options, source_key=token)
+        except BaseException:
+            self._discard_uploads({'source_key': token})
+            raise
+        self._wakeup.set()
+        return job_id
+
+    def describe(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        job = dict(job)
+        if job['state'] == JOB_RUNNING:
+            job['progress'] = self.runner.progress(job['id'])
+        return job
+
+    def cancel(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """取消任务，返回任务当前状态；任务不存在时返回None"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        with self._runner_lock:
+            accepted = self.runner.cancel(job_id)
+        job = self.describe(self.store.get(job_id))
+        if job['state'] == JOB_CANCELLED:
+            # 排队中直接取消的任务不会经过JobRunner，在这里删除上传的内容
+            self._discard_uploads(job)
+        job['cancel_requested'] = accepted
+        return job
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            'workers': self.runner.workers,
+            'running': self.runner.running_ids(),
+            'counts': self.store.counts(),
+        }
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """把HTTP请求转给JobService"""
+
+    service: JobService = None
+    server_version = 'VideoToAudioJobService/1.0'
+
+    def log_request(self, code='-', size='-'):
+        # 只记录出错的请求，避免轮询刷屏
+        if isinstance(code, int) and code >= 400:
+            super().log_request(code, size)
+
+    def _send_json(self, status: int, body: Any) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str) -> None:
+        self._send_json(status, {'error': message})
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            raise RequestError("请求内容过大")
+        try:
+            body = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise RequestError(f"请求不是有效的JSON: {e}")
+        if not isinstance(body, dict):
+            raise RequestError("请求必须是JSON对象")
+        return body
+
+    def _route(self) -> Tuple[list, Dict[str, list]]:
+        url = urlparse(self.path)
+        return [part for part in url.path.split('/') if part], parse_qs(url.query)
+
+    def _job_id(self, part: str) -> Optional[int]:
+        try:
+            return int(part)
+        except ValueError:
+            return None
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['health']:
+            self._send_json(HTTPStatus.OK, self.service.health())
+        elif parts == ['jobs']:
+            state = query.get('state', [None])[0]
+            if state is not None and state not in JOB_STATES:
+                self._send_error(HTTPStatus.BAD_REQUEST, f"未知状态 {state}")
+                return
+            jobs = [self.service.describe(job) for job in self.service.store.list(state)]
+            self._send_json(HTTPStatus.OK, {'jobs': jobs})
+        elif len(parts) == 2 and parts[0] == 'jobs' and self._job_id(parts[1]) is not None:
+            job = self.service.store.get(self._job_id(parts[1]))
+            if job is None:
+                self._send_error(HTTPStatus.NOT_FOUND, "任务不存在")
+            else:
+                self._send_json(HTTPStatus.OK, self.service.describe(job))
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "未知接口")
+
+    def do_POST(self):
+        parts, _ = self._route()
+        if parts == ['jobs']:
+            try:
+                job_id = self.service.submit(self._read_json())
+            except RequestError as e:
+                self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+                return
+            self._send_json(HTTPStatus.CREATED, self.service.describe(self.service.store.get(job_id)))
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            self._cancel(parts[1])
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "未知接口")
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) == 2 and parts[0] == 'jobs':
+            self._cancel(parts[1])
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "未知接口")
+
+    def _cancel(self, part: str) -> None:
+        job_id = self._job_id(part)
+        job = self.service.cancel(job_id) if job_id is not None else None
+        if job is None:
+            self._send_error(HTTPStatus.NOT_FOUND, "任务不存在")
+        elif not job['cancel_requested']:
+            self._send_json(HTTPStatus.CONFLICT, job)
+        else:
+            self._send_json(HTTPStatus.ACCEPTED, job)
+
+
+def create_server(service: JobService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """创建HTTP服务（port为0时由系统分配端口，可从server.server_address取得）"""
+    handler = type('BoundJobRequestHandler', (JobRequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def print_help():
+    """打印帮助信息"""
+    print("""
+HTTP转换任务服务
+
+用法:
+    python job_service.py [选项]
+
+选项:
+    --host <地址>        监听地址（默认127.0.0.1，仅本机可访问）
+    --port <端口>        监听端口（默认8765）
+    -j <数量|auto>       同时转换的任务数（默认2；auto为按可用CPU数），
+                         每个FFmpeg的线程数按可用CPU数平均分配
+    --queue <文件>       持久化队列数据库（默认 job_service.db）
+    --uploads <目录>     上传的歌词/元数据保存目录（默认 job_uploads）
+    -h, --help           显示帮助信息
+
+示例:
+    # 提交任务（lrc_text/metadata_text为上传的文件内容）
+    curl -X POST http://127.0.0.1:8765/jobs \\
+         -d '{"input": "/data/live.mp4", "start_time": "00:30", "lrc_text": "[00:01.00]歌词"}'
+
+    # 查询状态和进度
+    curl http://127.0.0.1:8765/jobs/1
+
+    # 取消任务
+    curl -X DELETE http://127.0.0.1:8765/jobs/1
+    """)
+
+
+def main():
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args:
+        print_help()
+        sys.exit(0)
+
+    host = DEFAULT_HOST
+    port = DEFAULT_PORT
+    workers = DEFAULT_WORKERS
+    queue_file = DEFAULT_QUEUE_FILE
+    upload_dir = DEFAULT_UPLOAD_DIR
+
+    i = 0
+    while i < len(args):
+        if args[i] == '--host' and i + 1 < len(args):
+            host = args[i + 1]
+            i += 2
+        elif args[i] in ('--port', '-j') and i + 1 < len(args):
+            try:
+                value = int(args[i + 1]) if args[i] == '--port' else parse_jobs(args[i + 1])
+                if value < (0 if args[i] == '--port' else 1):
+                    raise ValueError
+            except ValueError:
+                print(f"错误: {args[i]} 必须是正整数")
+                sys.exit(1)
+            if args[i] == '--port':
+                port = value
+            else:
+                workers = value
+            i += 2
+        elif args[i] == '--queue' and i + 1 < len(args):
+            queue_file = args[i + 1]
+            i += 2
+        elif args[i] == '--uploads' and i + 1 < len(args):
+            upload_dir = args[i + 1]
+            i += 2
+        else:
+            print(f"警告: 未知选项 {args[i]}")
+            i += 1
+
+    if not shutil.which('ffmpeg'):
+        print("错误: 未找到FFmpeg")
+        sys.exit(1)
+
+    store = JobStore(queue_file)
+    service = JobService(store, workers, upload_dir)
+    server = create_server(service, host, port)
+    service.start()
+    print(f"任务服务已启动: http://{server.server_address[0]}:{server.server_address[1]}（{workers}个工作进程）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止，等待进行中的任务完成...")
+    finally:
+        server.server_close()
+        service.stop()
+        print(f"队列状态: {store.counts()}")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,9 @@ import os
 from pathlib import Path
 from typing import List, Tuple
 
+from media_trace import span, traced
+from run_profiler import profile_run, pop_profile_option
+
 # Pre-compile regex pattern for better performance
 TIMESTAMP_PATTERN = re.compile(r'\[(\d{2}):(\d{2})(?:\.(\d{2}))?\]')
 
@@ -46,19 +49,21 @@ def format_time_tag(seconds: float) -> str:
     return f"[{minutes:02d}:{secs:02d}.{centiseconds:02d}]"
 
 
+@traced('adjust_lrc_file')
 def adjust_lrc_file(file_path: str, time_offset: float) -> List[str]:
     """调整LRC文件的时间"""
     encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1']
     lines = None
 
     # 尝试不同编码读取
-    for encoding in encodings:
-        try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                lines = f.readlines()
-            break
-        except UnicodeDecodeError:
-            continue
+    with span('read_lrc'):
+        for encoding in encodings:
+            try:
+                with open(file_path, 'r', encoding=encoding) as f:
+                    lines = f.readlines()
+                break
+            except UnicodeDecodeError:
+                continue
 
     if lines is None:
         raise ValueError(f"Unable to read file {file_path} with any supported encoding")
@@ -104,16 +109,27 @@ def adjust_lrc_file(file_path: str, time_offset: float) -> List[str]:
 
 
 def main():
+    try:
+        args, profile_prefix = pop_profile_option(sys.argv[1:])
+    except ValueError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+
     # 检查参数
-    if len(sys.argv) != 3:
-        print("用法: python lrc_time_adjuster.py <LRC文件路径> <时间偏移(秒)>")
+    if len(args) != 2:
+        print("用法: python lrc_time_adjuster.py <LRC文件路径> <时间偏移(秒)> [--profile <输出前缀>]")
         print("示例: python lrc_time_adjuster.py song.lrc -7  # 歌词往前移动7秒")
         print("示例: python lrc_time_adjuster.py song.lrc 5   # 歌词往后移动5秒")
         sys.exit(1)
 
-    file_path = sys.argv[1]
+    with profile_run(profile_prefix):
+        run_adjust(args[0], args[1])
+
+
+def run_adjust(file_path: str, offset_arg: str):
+    """调整歌词并写入新文件"""
     try:
-        time_offset = float(sys.argv[2])
+        time_offset = float(offset_arg)
     except ValueError:
         print("错误: 时间偏移必须是数字")
         sys.exit(1)
@@ -139,7 +155,7 @@ def main():
 
     # 写入调整后的文件
     try:
-        with open(output_path, 'w', encoding='utf-8', newline='\n') as f:
+        with span('write_lrc'), open(output_path, 'w', encoding='utf-8', newline='\n') as f:
             f.writelines(line + '\n' for line in adjusted_lines)
 
         print(f"成功调整歌词时间: {time_offset}秒")
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+媒体探测缓存
+一次转换中会多次探测同一个输入（选择音频流、读取时长规划压缩测试片段等），重新写标签时又会再探测一遍输出。
+这里每个文件只运行一次ffprobe（流、格式、章节），结果解析为带类型的MediaInfo；
+在进程内存中和磁盘上缓存，键为 路径 + 大小 + 修改时间，文件被修改后自动重新探测；
+asyncio代码用probe_media_async探测（ffprobe不占用线程），结果存入同一个缓存
+"""
+
+import os
+import sys
+import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from process_runner import run_process, run_process_async
+from media_trace import traced
+from conversion_cache import default_cache_dir
+
+# Constants
+PROBE_CACHE_VERSION = 1
+MEMORY_CACHE_ENTRIES = 256
+PROBE_CACHE_MAX_BYTES = 128 * 1024 * 1024     # 约几万个文件的探测结果
+PROBE_CACHE_MAX_AGE = 30 * 24 * 60 * 60       # 30天未使用的删除（重新写标签后旧的键不会再用到）
+PROBE_TEMP_MAX_AGE = 60 * 60                  # 超过1小时的临时文件是异常退出的写入留下的
+PROBE_PRUNE_INTERVAL = 5 * 60                 # 同一进程中最多每5分钟整理一次缓存目录
+
+
+@dataclass
+class MediaStream:
+    """一条流（ffprobe -show_streams的一项）"""
+    index: int
+    codec_type: str
+    codec: str = ''
+    profile: str = ''
+    channels: int = 0
+    channel_layout: str = ''
+    sample_rate: int = 0
+    bits: int = 0
+    width: int = 0
+    height: int = 0
+    pix_fmt: str = ''
+    duration: Optional[float] = None
+    tags: Dict[str, str] = field(default_factory=dict)
+    disposition: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def language(self) -> str:
+        return self.tags.get('language', '')
+
+    @property
+    def title(self) -> str:
+        return self.tags.get('title', '')
+
+
+@dataclass
+class MediaChapter:
+    start: float
+    end: float
+    title: str = ''
+
+
+@dataclass
+class MediaInfo:
+    """ffprobe -show_format -show_streams -show_chapters 的解析结果"""
+    path: str
+    format_name: str = ''
+    duration: Optional[float] = None
+    size: Optional[int] = None
+    bit_rate: Optional[int] = None
+    tags: Dict[str, str] = field(default_factory=dict)
+    streams: List[MediaStream] = field(default_factory=list)
+    chapters: List[MediaChapter] = field(default_factory=list)
+
+    @property
+    def audio_streams(self) -> List[MediaStream]:
+        return [s for s in self.streams if s.codec_type == 'audio']
+
+    @property
+    def video_streams(self) -> List[MediaStream]:
+        return [s for s in self.streams if s.codec_type == 'video']
+
+
+def _number(value: Any, kind=float):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_probe_output(path: str, data: Dict[str, Any]) -> MediaInfo:
+    """把ffprobe的JSON输出转换为MediaInfo（标签名保持原样）"""
+    fmt = data.get('format') or {}
+    streams = []
+    for raw in data.get('streams') or []:
+        streams.append(MediaStream(
+            index=raw.get('index', len(streams)),
+            codec_type=raw.get('codec_type', ''),
+            codec=raw.get('codec_name', ''),
+            profile=raw.get('profile') or '',
+            channels=_number(raw.get('channels'), int) or 0,
+            channel_layout=raw.get('channel_layout', ''),
+            sample_rate=_number(raw.get('sample_rate'), int) or 0,
+            bits=_number(raw.get('bits_per_raw_sample'), int) or _number(raw.get('bits_per_sample'), int) or 0,
+            width=_number(raw.get('width'), int) or 0,
+            height=_number(raw.get('height'), int) or 0,
+            pix_fmt=raw.get('pix_fmt', ''),
+            duration=_number(raw.get('duration')),
+            tags=dict(raw.get('tags') or {}),
+            disposition=dict(raw.get('disposition') or {}),
+        ))
+    chapters = [MediaChapter(start=_number(raw.get('start_time')) or 0.0,
+                             end=_number(raw.get('end_time')) or 0.0,
+                             title=(raw.get('tags') or {}).get('title', ''))
+                for raw in data.get('chapters') or []]
+    return MediaInfo(
+        path=path,
+        format_name=fmt.get('format_name', ''),
+        duration=_number(fmt.get('duration')),
+        size=_number(fmt.get('size'), int),
+        bit_rate=_number(fmt.get('bit_rate'), int),
+        tags=dict(fmt.get('tags') or {}),
+        streams=streams,
+        chapters=chapters,
+    )
+
+
+class ProbeCache:
+    """
+    探测结果缓存：进程内存中的LRU + 磁盘上每个文件一个JSON（保存ffprobe原始输出）
+    多个线程/进程同时探测同一个尚未缓存的文件时可能各运行一次ffprobe（结果相同），磁盘文件用临时文件 + 原子替换写入
+    磁盘文件的修改时间为最近使用时间，写入后按保留时间和总大小淘汰（见prune）
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None, use_disk: bool = True):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir() / 'probe'
+        self.use_disk = use_disk
+        self._memory: 'OrderedDict[Tuple, Optional[MediaInfo]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'probes': 0}
+        self._last_prune = 0.0
+
+    @staticmethod
+    def _key(path: Path) -> Optional[Tuple[str, int, int]]:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+
+    def _disk_path(self, key: Tuple[str, int, int]) -> Path:
+        digest = hashlib.sha256(f"{key[0]}|{key[1]}|{key[2]}|v{PROBE_CACHE_VERSION}".encode('utf-8'))
+        return self.cache_dir / f"{digest.hexdigest()[:32]}.json"
+
+    def _remember(self, key: Tuple, info: Optional[MediaInfo]) -> None:
+        with self._lock:
+            self._memory[key] = info
+            self._memory.move_to_end(key)
+            while len(self._memory) > MEMORY_CACHE_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def _read_disk(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        if not self.use_disk:
+            return None
+        disk_path = self._disk_path(key)
+        try:
+            with open(disk_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # 更新使用时间，供按保留时间和最近使用淘汰
+            os.utime(disk_path)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def _write_disk(self, key: Tuple, data: Dict[str, Any]) -> None:
+        if not self.use_disk:
+            return
+        target = self._disk_path(key)
+        temp_path = target.with_name(f"{target.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_path, target)
+        except OSError:
+            temp_path.unlink(missing_ok=True)
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < PROBE_PRUNE_INTERVAL:
+                return
+            self._last_prune = now
+        self.prune(keep=target)
+
+    def prune(self, max_bytes: int = PROBE_CACHE_MAX_BYTES, max_age: float = PROBE_CACHE_MAX_AGE,
+              keep: Optional[Path] = None) -> int:
+        """
+        删除超过保留时间未使用的探测结果，总大小仍超过上限时按最近使用时间淘汰，
+        并删除异常退出的写入留下的临时文件；返回删除数
+        """
+        now = time.time()
+        removed = 0
+        entries = []
+        for path in self.cache_dir.glob('*'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.suffix == '.tmp':
+                if now - stat.st_mtime > PROBE_TEMP_MAX_AGE:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+            elif path.suffix == '.json':
+                entries.append((stat.st_mtime, path, stat.st_size))
+
+        total = sum(size for _used, _path, size in entries)
+        for used, path, size in sorted(entries):
+            if path == keep:
+                continue
+            if now - used <= max_age and total <= max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            removed += 1
+            total -= size
+        return removed
+
+    def _cached(self, path: Path, key: Tuple) -> Tuple[bool, Optional[MediaInfo]]:
+        """依次查找内存和磁盘缓存，返回 (是否命中, 探测结果)"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return True, self._memory[key]
+
+        data = self._read_disk(key)
+        if data is None:
+            return False, None
+        with self._lock:
+            self.stats['disk_hits'] += 1
+        info = parse_probe_output(str(path), data)
+        self._remember(key, info)
+        return True, info
+
+    def _probed(self, path: Path, key: Tuple, data: Optional[Dict[str, Any]]) -> Optional[MediaInfo]:
+        """保存一次ffprobe的结果"""
+        with self._lock:
+            self.stats['probes'] += 1
+        if data is None:
+            # 失败结果只记在内存中（例如没有安装ffprobe），不写入磁盘
+            self._remember(key, None)
+            return None
+        self._write_disk(key, data)
+        info = parse_probe_output(str(path), data)
+        self._remember(key, info)
+        return info
+
+    def probe(self, media_path: Union[str, Path]) -> Optional[MediaInfo]:
+        """返回文件的探测结果，探测失败（文件不存在、没有ffprobe、无法识别）时返回None"""
+        path = Path(media_path)
+        key = self._key(path)
+        if key is None:
+            return None
+        found, info = self._cached(path, key)
+        if found:
+            return info
+        return self._probed(path, key, _run_ffprobe(path))
+
+    async def probe_async(self, media_path: Union[str, Path]) -> Optional[MediaInfo]:
+        """probe的asyncio版本：未缓存时用run_process_async运行ffprobe"""
+        path = Path(media_path)
+        key = self._key(path)
+        if key is None:
+            return None
+        found, info = self._cached(path, key)
+        if found:
+            return info
+        return self._probed(path, key, await _run_ffprobe_async(path))
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
+
+
+def _ffprobe_command(path: Path) -> List[str]:
+    return [
+        'ffprobe', '-v', 'quiet',
+        '-print_format', 'json',
+        '-show_format', '-show_streams', '-show_chapters',
+        str(path)
+    ]
+
+
+@traced('ffprobe')
+def _run_ffprobe(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        result = run_process(_ffprobe_command(path), 'ffprobe',
+                             capture_output=True,
+                             text=True,
+                             encoding='utf-8')
+        if result.returncode != 0:
+            return None
+        return json.loads(result.stdout)
+    except (ValueError, OSError):
+        return None
+
+
+@traced('ffprobe')
+async def _run_ffprobe_async(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        result = await run_process_async(_ffprobe_command(path), 'ffprobe', capture_output=True)
+        if result.returncode != 0:
+            return None
+        return json.loads(result.stdout.decode('utf-8'))
+    except (ValueError, OSError):
+        return None
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def probe_cache() -> ProbeCache:
+    """进程内共用的探测缓存"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ProbeCache()
+        return _default_cache
+
+
+def probe_media(media_path: Union[str, Path]) -> Optional[MediaInfo]:
+    """探测媒体文件（经过缓存），失败时返回None"""
+    return probe_cache().probe(media_path)
+
+
+async def probe_media_async(media_path: Union[str, Path]) -> Optional[MediaInfo]:
+    """probe_media的asyncio版本，与probe_media共用缓存"""
+    return await probe_cache().probe_async(media_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print("用法: python media_probe.py <媒体文件>...")
+        sys.exit(0)
+    exit_code = 0
+    for arg in sys.argv[1:]:
+        info = probe_media(arg)
+        if info is None:
+            print(f"{arg}: 无法探测（需要ffprobe）")
+            exit_code = 1
+            continue
+        duration = f"{info.duration:.3f}秒" if info.duration is not None else "未知"
+        print(f"{arg}: {info.format_name}，时长 {duration}，{len(info.streams)}条流，{len(info.chapters)}个章节")
+        for stream in info.streams:
+            detail = f"{stream.channels}声道 {stream.sample_rate}Hz" if stream.codec_type == 'audio' else \
+                f"{stream.width}x{stream.height}" if stream.codec_type == 'video' else ''
+            print(f"  #{stream.index} {stream.codec_type} {stream.codec} {detail} {stream.language}".rstrip())
+    sys.exit(exit_code)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+处理阶段计时追踪
+用命名的计时区间（span）记录各阶段的开始时间、耗时、输入/输出字节数和子进程PID，
+可写入JSON Lines追踪文件，便于跨批次汇总分析
+"""
+
+import os
+import json
+import time
+import inspect
+import functools
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+# 当前线程/协程所在的span
+_current_span = contextvars.ContextVar('media_trace_span', default=None)
+_span_ids = itertools.count(1)
+
+# span开始/结束时通知的监听器（如追踪文件写入器）
+_listeners: List[Any] = []
+_listeners_lock = threading.Lock()
+
+
+class Span:
+    """一个命名的计时区间"""
+
+    def __init__(self, name: str, parent: Optional['Span'] = None, **fields):
+        self.name = name
+        self.span_id = f"{os.getpid()}-{next(_span_ids)}"
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.start = time.time()
+        self.duration = None
+        self.fields: Dict[str, Any] = dict(fields)
+        self._perf_start = time.perf_counter()
+
+    def set(self, **fields) -> None:
+        """附加字段（如bytes_in、bytes_out、pid）"""
+        self.fields.update(fields)
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._perf_start
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+            'start': round(self.start, 6),
+            'duration': round(self.duration, 6) if self.duration is not None else None,
+        }
+        record.update(self.fields)
+        return record
+
+
+def add_listener(listener) -> None:
+    """注册监听器，需实现span_started(span)和span_finished(span)"""
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener) -> None:
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def _notify(event: str, current: Span) -> None:
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            getattr(listener, event)(current)
+        except Exception:
+            # 追踪失败不能影响转换本身
+            pass
+
+
+@contextmanager
+def span(name: str, **fields):
+    """
+    记录一个处理阶段
+
+    用法:
+        with span('ffmpeg_encode', bytes_in=size) as s:
+            ...
+            s.set(bytes_out=output_size)
+    """
+    parent = _current_span.get()
+    current = Span(name, parent, **fields)
+    token = _current_span.set(current)
+    _notify('span_started', current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+        _notify('span_finished', current)
+
+
+def traced(name: str):
+    """装饰器：把整个函数调用记为一个span（协程函数记录到协程结束为止）"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def annotate(**fields) -> None:
+    """给当前span附加字段，不在span中时忽略"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**fields)
+
+
+def file_size(path: Optional[Union[str, Path]]) -> Optional[int]:
+    """文件大小，文件不存在时返回None"""
+    try:
+        return os.path.getsize(path) if path else None
+    except OSError:
+        return None
+
+
+def sleep(seconds: float) -> None:
+    """等待文件释放，单独记为一个阶段"""
+    with span('sleep', seconds=seconds):
+        time.sleep(seconds)
+
+
+class JsonLinesTraceWriter:
+    """把结束的span逐行写入JSON Lines文件（追加模式，多次运行可汇总）"""
+
+    def __init__(self, trace_path: Union[str, Path]):
+        self.trace_path = Path(trace_path)
+        self._lock = threading.Lock()
+        self._file = open(self.trace_path, 'a', encoding='utf-8')
+
+    def span_started(self, current: Span) -> None:
+        pass
+
+    def span_finished(self, current: Span) -> None:
+        line = json.dumps(current.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + '\n')
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def enable_trace(trace_path: Union[str, Path]) -> JsonLinesTraceWriter:
+    """开启追踪文件输出"""
+    writer = JsonLinesTraceWriter(trace_path)
+    add_listener(writer)
+    return writer
+
+
+def disable_trace(writer: JsonLinesTraceWriter) -> None:
+    remove_listener(writer)
+    writer.close()
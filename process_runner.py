@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+子进程运行与资源统计
+所有FFmpeg/FFprobe调用都通过run_process执行，统计每个子进程的
+用户态/内核态CPU时间、峰值内存和I/O字节数（取决于操作系统能提供的数据），
+按阶段名标记后归入当前任务，用于根据实测数据规划并发数；
+asyncio代码使用run_process_async（见async_media）
+"""
+
+import os
+import sys
+import time
+import asyncio
+import functools
+import threading
+import subprocess
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from media_trace import annotate
+
+# Windows下不弹出控制台窗口
+DEFAULT_CREATIONFLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+
+# ru_maxrss的单位：Linux为KB，macOS为字节
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+# 有取消检查时，等待子进程期间每隔这么久检查一次
+CANCEL_POLL_SECONDS = 0.5
+# 轮询等待子进程退出时的最长间隔（与Popen.wait(timeout)相同）
+MAX_WAIT_POLL_SECONDS = 0.05
+# 子进程已被其他地方回收、取不到退出状态时的返回码（非0，调用方按失败处理）
+UNKNOWN_RETURNCODE = -1
+
+_current_job = contextvars.ContextVar('process_runner_job', default=None)
+_cancel_check = contextvars.ContextVar('process_runner_cancel_check', default=None)
+_print_report = contextvars.ContextVar('process_runner_print_report', default=False)
+
+
+class ProcessCancelled(BaseException):
+    """
+    任务被取消时由run_process抛出
+    继承BaseException，避免被处理流程中的 except Exception 吞掉
+    """
+
+
+def _read_proc_io(pid: int) -> Dict[str, int]:
+    """读取/proc/<pid>/io（仅Linux；进程结束但未回收时仍可读取）"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/io", 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                values[key.strip()] = int(value)
+    except (OSError, ValueError):
+        pass
+    return values
+
+
+def _exit_code(status: int) -> int:
+    """wait状态 -> 返回码（被信号终止时为负的信号值，与Popen.returncode相同）"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _start_io(process: subprocess.Popen, input) -> Tuple[Dict[str, Any], List[threading.Thread]]:
+    """
+    在线程中写入标准输入、读取标准输出/错误直到管道关闭
+    不使用communicate（它会自己回收子进程），回收由_wait_accounted负责
+    """
+    output: Dict[str, Any] = {'stdout': None, 'stderr': None}
+    threads = []
+
+    def read(name, stream):
+        with stream:
+            output[name] = stream.read()
+
+    def write():
+        try:
+            if input:
+                process.stdin.write(input)
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    if process.stdin is not None:
+        threads.append(threading.Thread(target=write, daemon=True))
+    for name in ('stdout', 'stderr'):
+        stream = getattr(process, name)
+        if stream is not None:
+            threads.append(threading.Thread(target=read, args=(name, stream), daemon=True))
+    for thread in threads:
+        thread.start()
+    return output, threads
+
+
+def _reap(process: subprocess.Popen, flags: int) -> Tuple[bool, Optional[Any]]:
+    """用os.wait4回收子进程并设置process.returncode，返回(是否已回收, rusage)"""
+    try:
+        pid, status, rusage = os.wait4(process.pid, flags)
+    except ChildProcessError:
+        # 已被回收（如SIGCHLD被忽略），取不到返回码和资源统计；不能当作成功退出
+        process.returncode = UNKNOWN_RETURNCODE
+        return True, None
+    if pid == 0:
+        return False, None
+    process.returncode = _exit_code(status)
+    return True, rusage
+
+
+def _wait_until(exited: Callable[[], bool], process: subprocess.Popen, timeout: Optional[float],
+                readers: List[threading.Thread], is_cancelled: Optional[Callable[[], bool]]) -> None:
+    """轮询直到exited()为True；期间定期检查是否已取消，超时抛出TimeoutExpired"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    next_check = time.monotonic()
+    delay = 0.0005
+    while not exited():
+        now = time.monotonic()
+        if is_cancelled is not None and now >= next_check:
+            if is_cancelled():
+                raise ProcessCancelled(f"已取消: {os.path.basename(str(process.args[0]))}")
+            next_check = now + CANCEL_POLL_SECONDS
+        if deadline is not None and now >= deadline:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        delay = min(delay * 2, MAX_WAIT_POLL_SECONDS)
+        # 读取线程在子进程关闭输出时结束，等待它可以更早发现退出
+        alive = [thread for thread in readers if thread.is_alive()]
+        if alive:
+            alive[0].join(delay)
+        else:
+            time.sleep(delay)
+
+
+def _wait_accounted(process: subprocess.Popen, timeout: Optional[float] = None,
+                    readers: Optional[List[threading.Thread]] = None,
+                    cancellable: bool = True) -> Tuple[Optional[Any], Dict[str, int]]:
+    """
+    等待子进程退出并自己用os.wait4回收（设置process.returncode），返回(rusage, /proc I/O统计)
+    先用waitid(WNOWAIT)等待退出但不回收，此时还能读到子进程的I/O统计
+    处于cancel_scope中时定期检查是否已取消（抛出ProcessCancelled）；没有wait4的平台（Windows）上没有资源统计
+    """
+    if process.returncode is not None:
+        return None, {}
+    readers = readers or []
+    is_cancelled = _cancel_check.get() if cancellable else None
+
+    if not hasattr(os, 'wait4'):
+        _wait_until(lambda: process.poll() is not None, process, timeout, readers, is_cancelled)
+        return None, {}
+
+    if not hasattr(os, 'waitid'):
+        # 没有不回收的等待（也没有/proc）：轮询时直接回收
+        reaped = [None]
+
+        def reap_if_exited() -> bool:
+            done, reaped[0] = _reap(process, os.WNOHANG)
+            return done
+        _wait_until(reap_if_exited, process, timeout, readers, is_cancelled)
+        return reaped[0], {}
+
+    def exited(flags: int = os.WNOHANG) -> bool:
+        try:
+            return os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT | flags) is not None
+        except ChildProcessError:
+            return True
+
+    if timeout is None and is_cancelled is None:
+        # 不需要中途检查：阻塞等待
+        exited(0)
+    else:
+        _wait_until(exited, process, timeout, readers, is_cancelled)
+    proc_io = _read_proc_io(process.pid)
+    return _reap(process, 0)[1], proc_io
+
+
+class JobResources:
+    """一个任务中所有子进程的资源统计"""
+
+    def __init__(self, name: str = ''):
+        self.name = name
+        self.children: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record(self, usage: Dict[str, Any]) -> None:
+        with self._lock:
+            self.children.append(usage)
+
+    def by_stage(self) -> Dict[str, Dict[str, Any]]:
+        """按阶段汇总"""
+        stages: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            children = list(self.children)
+        for usage in children:
+            item = stages.setdefault(usage['stage'], {
+                'count': 0, 'wall_seconds': 0.0, 'user_cpu': 0.0, 'sys_cpu': 0.0,
+                'max_rss_bytes': 0, 'read_bytes': 0, 'write_bytes': 0,
+            })
+            item['count'] += 1
+            item['wall_seconds'] += usage['wall_seconds']
+            for key in ('user_cpu', 'sys_cpu', 'read_bytes', 'write_bytes'):
+                item[key] += usage.get(key) or 0
+            item['max_rss_bytes'] = max(item['max_rss_bytes'], usage.get('max_rss_bytes') or 0)
+        return stages
+
+    def totals(self) -> Dict[str, Any]:
+        total = {'count': 0, 'wall_seconds': 0.0, 'user_cpu': 0.0, 'sys_cpu': 0.0,
+                 'max_rss_bytes': 0, 'read_bytes': 0, 'write_bytes': 0}
+        for item in self.by_stage().values():
+            for key in ('count', 'wall_seconds', 'user_cpu', 'sys_cpu', 'read_bytes', 'write_bytes'):
+                total[key] += item[key]
+            total['max_rss_bytes'] = max(total['max_rss_bytes'], item['max_rss_bytes'])
+        return total
+
+    def format_report(self) -> str:
+        """格式化为表格"""
+        lines = [f"{'阶段':<20}{'次数':>6}{'耗时(s)':>10}{'用户CPU(s)':>12}{'系统CPU(s)':>12}"
+                 f"{'峰值内存(MB)':>14}{'读(MB)':>10}{'写(MB)':>10}"]
+        rows = list(self.by_stage().items()) + [('合计', self.totals())]
+        for stage, item in rows:
+            lines.append(f"{stage:<20}{item['count']:>6}{item['wall_seconds']:>10.2f}"
+                         f"{item['user_cpu']:>12.2f}{item['sys_cpu']:>12.2f}"
+                         f"{item['max_rss_bytes'] / 1048576:>14.1f}"
+                         f"{item['read_bytes'] / 1048576:>10.1f}{item['write_bytes'] / 1048576:>10.1f}")
+        return '\n'.join(lines)
+
+
+@contextmanager
+def job_resources(name: str = ''):
+    """
+    统计范围内所有子进程的资源占用
+    已经处于某个任务中时复用外层任务，嵌套调用不会拆分统计
+    """
+    job = _current_job.get()
+    if job is not None:
+        yield job
+        return
+
+    job = JobResources(name)
+    token = _current_job.set(job)
+    try:
+        yield job
+    finally:
+        _current_job.reset(token)
+
+
+def current_job() -> Optional[JobResources]:
+    return _current_job.get()
+
+
+@contextmanager
+def resource_report():
+    """范围内report_resources装饰的最外层任务结束后打印子进程资源统计表（默认只记录到追踪span）"""
+    token = _print_report.set(True)
+    try:
+        yield
+    finally:
+        _print_report.reset(token)
+
+
+def report_resources(func):
+    """装饰器：统计函数内所有子进程的资源占用，作为最外层任务时把汇总记录到追踪span，处于resource_report中时打印"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        is_outermost = _current_job.get() is None
+        with job_resources(func.__name__) as job:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if is_outermost and job.children:
+                    annotate(child_resources=job.totals())
+                    if _print_report.get():
+                        print("\n[子进程资源统计]")
+                        print(job.format_report())
+    return wrapper
+
+
+@contextmanager
+def cancel_scope(is_cancelled: Callable[[], bool]):
+    """
+    范围内的run_process会定期调用is_cancelled()，返回True时终止子进程并抛出ProcessCancelled
+    """
+    token = _cancel_check.set(is_cancelled)
+    try:
+        yield
+    finally:
+        _cancel_check.reset(token)
+
+
+def run_process(cmd, stage: str, input=None, capture_output=False, timeout=None,
+                **kwargs) -> subprocess.CompletedProcess:
+    """
+    运行子进程，用法与subprocess.run相同
+
+    Args:
+        cmd: 命令
+        stage: 阶段名（如ffmpeg_encode、ffprobe），用于归类资源统计
+
+    子进程的PID、返回码和资源统计同时记录到当前追踪span；
+    处于cancel_scope中且任务被取消时终止子进程并抛出ProcessCancelled
+    """
+    is_cancelled = _cancel_check.get()
+    if is_cancelled is not None and is_cancelled():
+        raise ProcessCancelled(f"已取消: {os.path.basename(str(cmd[0]))}")
+
+    kwargs.setdefault('creationflags', DEFAULT_CREATIONFLAGS)
+    if capture_output:
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+
+    start = time.perf_counter()
+    with subprocess.Popen(cmd, **kwargs) as process:
+        annotate(child_pid=process.pid)
+        output, readers = _start_io(process, input)
+        try:
+            rusage, proc_io = _wait_accounted(process, timeout, readers)
+        except BaseException:
+            process.kill()
+            _wait_accounted(process, cancellable=False)
+            raise
+        finally:
+            for thread in readers:
+                thread.join()
+        returncode = process.returncode
+        stdout, stderr = output['stdout'], output['stderr']
+    wall_seconds = time.perf_counter() - start
+
+    usage = {
+        'stage': stage,
+        'program': os.path.basename(str(cmd[0])),
+        'pid': process.pid,
+        'returncode': returncode,
+        'wall_seconds': round(wall_seconds, 6),
+        'user_cpu': None,
+        'sys_cpu': None,
+        'max_rss_bytes': None,
+        'read_bytes': None,
+        'write_bytes': None,
+    }
+    if rusage is not None:
+        usage['user_cpu'] = round(rusage.ru_utime, 6)
+        usage['sys_cpu'] = round(rusage.ru_stime, 6)
+        # 峰值内存包含exec之前从父进程继承的部分，小进程的数值会偏大
+        usage['max_rss_bytes'] = rusage.ru_maxrss * MAXRSS_UNIT
+    if proc_io:
+        # rchar/wchar包含管道读写；read_bytes/write_bytes仅为实际存储I/O
+        usage['read_bytes'] = proc_io.get('rchar')
+        usage['write_bytes'] = proc_io.get('wchar')
+        usage['storage_read_bytes'] = proc_io.get('read_bytes')
+        usage['storage_write_bytes'] = proc_io.get('write_bytes')
+
+    job = _current_job.get()
+    if job is not None:
+        job.record(usage)
+    annotate(returncode=returncode, child_user_cpu=usage['user_cpu'], child_sys_cpu=usage['sys_cpu'],
+             child_max_rss_bytes=usage['max_rss_bytes'], child_read_bytes=usage['read_bytes'],
+             child_write_bytes=usage['write_bytes'])
+
+    return subprocess.CompletedProcess(process.args, returncode, stdout, stderr)
+
+
+async def run_process_async(cmd, stage: str, input: Optional[bytes] = None, capture_output=False,
+                            line_handler: Optional[Callable[[str], None]] = None,
+                            **kwargs) -> subprocess.CompletedProcess:
+    """
+    run_process的asyncio版本：用asyncio.create_subprocess_exec运行子进程，等待期间不占用线程
+
+    Args:
+        cmd: 命令
+        stage: 阶段名，用于归类资源统计
+        input: 写入标准输入的数据（字节）
+        capture_output: 保存标准输出和标准错误（字节）
+        line_handler: 逐行读取标准输出并回调（如FFmpeg的-progress输出），此时不保存标准输出
+
+    所在的asyncio任务被取消时终止并回收子进程，再抛出CancelledError；
+    事件循环不提供子进程的rusage，资源统计中只有耗时和返回码
+    """
+    kwargs.setdefault('creationflags', DEFAULT_CREATIONFLAGS)
+    if capture_output or line_handler is not None:
+        kwargs['stdout'] = asyncio.subprocess.PIPE
+    if capture_output:
+        kwargs['stderr'] = asyncio.subprocess.PIPE
+    if input is not None:
+        kwargs['stdin'] = asyncio.subprocess.PIPE
+
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+    annotate(child_pid=process.pid)
+    try:
+        if line_handler is None:
+            stdout, stderr = await process.communicate(input)
+        else:
+            async def feed():
+                if input is not None:
+                    process.stdin.write(input)
+                    await process.stdin.drain()
+                    process.stdin.close()
+
+            async def read_lines():
+                async for line in process.stdout:
+                    line_handler(line.decode('utf-8', errors='replace').rstrip('\r\n'))
+
+            async def read_stderr():
+                return await process.stderr.read() if process.stderr is not None else None
+
+            _, _, stderr = await asyncio.gather(feed(), read_lines(), read_stderr())
+            stdout = None
+            await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        await process.wait()
+        raise
+    wall_seconds = time.perf_counter() - start
+
+    usage = {
+        'stage': stage,
+        'program': os.path.basename(str(cmd[0])),
+        'pid': process.pid,
+        'returncode': process.returncode,
+        'wall_seconds': round(wall_seconds, 6),
+        'user_cpu': None,
+        'sys_cpu': None,
+        'max_rss_bytes': None,
+        'read_bytes': None,
+        'write_bytes': None,
+    }
+    job = _current_job.get()
+    if job is not None:
+        job.record(usage)
+    annotate(returncode=process.returncode)
+
+    return subprocess.CompletedProcess(list(cmd), process.returncode, stdout, stderr)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响度测量与ReplayGain/R128标签
+转换时在同一个FFmpeg滤镜图中分出一路接ebur128，编码的同时测量综合响度和真峰值，
+不需要转换后再完整解码一遍；专辑模式并行分析目录中的各曲目，全部完成后统一写入专辑增益
+"""
+
+import os
+import sys
+import math
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from process_runner import run_process
+from media_trace import span, traced
+from job_context import scratch_dir, sibling_temp_path
+from cpu_budget import cpu_budget, ffmpeg_thread_args, limit_ffmpeg_threads, parse_jobs, plan_concurrency
+
+# Constants
+REPLAYGAIN_REFERENCE_LUFS = -18.0     # ReplayGain 2.0参考响度
+R128_REFERENCE_LUFS = -23.0           # EBU R128 / Opus R128_*_GAIN参考响度
+AUDIO_EXTENSIONS = {'.flac', '.opus', '.ogg', '.mp3', '.m4a'}
+DEFAULT_ALBUM_WORKERS = min(4, cpu_budget())
+
+# ebur128每100ms输出一帧测量值（metadata=1时）
+EBUR128_FRAME_SECONDS = 0.1
+
+
+def _escape_filter_value(value: str) -> str:
+    """滤镜选项值需要经过选项和滤镜图两层转义"""
+    return value.replace('\\', '/').replace(':', '\\\\:')
+
+
+class LoudnessMeter:
+    """
+    在编码滤镜图中附加的响度测量分支（接在asplit的一路后面，再接anullsink）
+    ebur128把每帧的测量值作为元数据，ametadata打印到管道（Windows下为临时文件），
+    后台线程读取并保留综合响度、响度范围和最大真峰值
+    """
+
+    def __init__(self):
+        self.pass_fds = ()
+        self._read_fd = None
+        self._write_fd = None
+        self._temp_path = None
+        self._thread = None
+        self._values: Dict[str, float] = {}
+        self._max_true_peak = 0.0
+        self._frames = 0
+
+        if sys.platform == 'win32':
+            handle, self._temp_path = tempfile.mkstemp(suffix='.ebur128.txt', dir=scratch_dir())
+            os.close(handle)
+            target = self._temp_path
+        else:
+            self._read_fd, self._write_fd = os.pipe()
+            self.pass_fds = (self._write_fd,)
+            target = f"pipe:{self._write_fd}"
+
+        self.filter_chain = ("aformat=channel_layouts=stereo,ebur128=peak=true:metadata=1,"
+                             f"ametadata=mode=print:file={_escape_filter_value(target)}")
+
+    def _consume(self, lines) -> None:
+        for line in lines:
+            line = line.strip()
+            if line.startswith('frame:'):
+                self._frames += 1
+                continue
+            key, _, value = line.partition('=')
+            if not key.startswith('lavfi.r128.'):
+                continue
+            try:
+                number = float(value)
+            except ValueError:
+                continue
+            name = key[len('lavfi.r128.'):]
+            if name == 'true_peak':
+                self._max_true_peak = max(self._max_true_peak, number)
+            else:
+                self._values[name] = number
+
+    def start(self) -> None:
+        """
+        启动FFmpeg之前调用：开始在后台读取管道，避免管道写满阻塞FFmpeg
+        本进程保留写端直到finish，读取线程不会提前读到结束
+        """
+        if self._read_fd is None:
+            return
+
+        def reader():
+            with open(self._read_fd, 'r', encoding='utf-8', errors='replace') as pipe:
+                self._consume(pipe)
+
+        self._thread = threading.Thread(target=reader, name='ebur128-reader', daemon=True)
+        self._thread.start()
+
+    def finish(self) -> Optional[Dict[str, float]]:
+        """FFmpeg结束后调用：关闭写端，等待读取完成，返回测量结果；没有测量到数据时返回None"""
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+            self._write_fd = None
+        if self._thread is not None:
+            self._thread.join()
+        if self._temp_path:
+            try:
+                with open(self._temp_path, 'r', encoding='utf-8', errors='replace') as f:
+                    self._consume(f)
+            finally:
+                Path(self._temp_path).unlink(missing_ok=True)
+
+        if 'I' not in self._values or not self._frames:
+            return None
+        return {
+            'integrated': self._values['I'],
+            'lra': self._values.get('LRA', 0.0),
+            'true_peak': self._max_true_peak,
+            'duration': self._frames * EBUR128_FRAME_SECONDS,
+        }
+
+
+def _db(value: float) -> float:
+    return 20 * math.log10(value) if value > 0 else -math.inf
+
+
+def loudness_tags(track: Dict[str, float], album: Optional[Dict[str, float]] = None,
+                  container: str = '.flac') -> Dict[str, str]:
+    """
+    根据测量结果生成标签
+    Opus使用R128_TRACK_GAIN/R128_ALBUM_GAIN（Q7.8定点，相对-23 LUFS），其他格式使用REPLAYGAIN_*
+    """
+    if container.lower() in ('.opus', '.ogg'):
+        tags = {'R128_TRACK_GAIN': str(round((R128_REFERENCE_LUFS - track['integrated']) * 256))}
+        if album:
+            tags['R128_ALBUM_GAIN'] = str(round((R128_REFERENCE_LUFS - album['integrated']) * 256))
+        return tags
+
+    tags = {
+        'REPLAYGAIN_TRACK_GAIN': f"{REPLAYGAIN_REFERENCE_LUFS - track['integrated']:.2f} dB",
+        'REPLAYGAIN_TRACK_PEAK': f"{track['true_peak']:.6f}",
+        'REPLAYGAIN_REFERENCE_LOUDNESS': f"{REPLAYGAIN_REFERENCE_LUFS:.1f} LUFS",
+    }
+    if album:
+        tags['REPLAYGAIN_ALBUM_GAIN'] = f"{REPLAYGAIN_REFERENCE_LUFS - album['integrated']:.2f} dB"
+        tags['REPLAYGAIN_ALBUM_PEAK'] = f"{album['true_peak']:.6f}"
+    return tags
+
+
+def album_loudness(tracks: List[Dict[str, float]]) -> Optional[Dict[str, float]]:
+    """
+    专辑响度：按时长加权的能量平均（近似把所有曲目连起来测量），峰值取最大值
+    """
+    tracks = [t for t in tracks if t and math.isfinite(t['integrated'])]
+    total = sum(t['duration'] for t in tracks)
+    if not tracks or total <= 0:
+        return None
+    energy = sum(t['duration'] * 10 ** (t['integrated'] / 10) for t in tracks) / total
+    return {
+        'integrated': 10 * math.log10(energy),
+        'true_peak': max(t['true_peak'] for t in tracks),
+        'duration': total,
+    }
+
+
+def format_loudness(track: Dict[str, float]) -> str:
+    return (f"综合响度 {track['integrated']:.1f} LUFS，真峰值 {_db(track['true_peak']):.1f} dBTP"
+            + (f"，响度范围 {track['lra']:.1f} LU" if 'lra' in track else ""))
+
+
+@traced('analyze_loudness')
+def analyze_loudness(audio_path: Union[str, Path]) -> Optional[Dict[str, float]]:
+    """单独分析一个文件（专辑模式中用于已有文件）"""
+    meter = LoudnessMeter()
+    cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', *ffmpeg_thread_args(), '-i', str(audio_path),
+           '-map', '0:a:0', '-af', meter.filter_chain, '-f', 'null', '-']
+    meter.start()
+    try:
+        with span('ffmpeg_ebur128'):
+            result = run_process(cmd, 'ffmpeg_ebur128', capture_output=True, pass_fds=meter.pass_fds)
+    except OSError as e:
+        print(f"分析失败: {audio_path}: {e}")
+        return None
+    finally:
+        track = meter.finish()
+    if result.returncode != 0:
+        return None
+    return track
+
+
+def write_loudness_tags(audio_path: Union[str, Path], tags: Dict[str, str]) -> bool:
+    """
+    写入响度标签（不重新编码）
+    MP3直接改写ID3的TXXX帧，保留SYLT同步歌词；其他格式用流复制重写
+    """
+    # 在函数中导入，避免分析模式加载PIL等依赖
+    from flac_metadata_utils import write_metadata_to_flac, rewrite_id3_frames, build_txxx_frames
+    audio_path = Path(audio_path)
+    suffix = audio_path.suffix.lower()
+    if suffix == '.mp3':
+        return rewrite_id3_frames(audio_path, build_txxx_frames(tags))
+    if suffix in ('.opus', '.ogg'):
+        return _write_ogg_stream_tags(audio_path, tags)
+    return write_metadata_to_flac(audio_path, tags)
+
+
+def _write_ogg_stream_tags(audio_path: Path, tags: Dict[str, str]) -> bool:
+    """Ogg的标签属于音频流（-metadata写的是全局标签，会被流上已有的同名标签覆盖）"""
+    temp_path = sibling_temp_path(audio_path)
+    cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', '-i', str(audio_path), '-map', '0', '-c', 'copy']
+    for tag, value in tags.items():
+        cmd.extend(['-metadata:s:a:0', f"{tag}={value}"])
+    cmd.extend(['-y', str(temp_path)])
+    with span('ffmpeg_remux'):
+        result = run_process(cmd, 'metadata_remux', capture_output=True)
+    if result.returncode != 0:
+        temp_path.unlink(missing_ok=True)
+        print(f"写入响度标签失败: {audio_path}")
+        return False
+    os.replace(temp_path, audio_path)
+    return True
+
+
+def process_album(directory: Union[str, Path], workers: int = DEFAULT_ALBUM_WORKERS) -> bool:
+    """
+    专辑模式：并行测量目录中所有曲目的响度，全部完成后写入曲目增益和专辑增益
+    """
+    directory = Path(directory)
+    tracks = sorted(p for p in directory.iterdir() if p.suffix.lower() in AUDIO_EXTENSIONS)
+    if not tracks:
+        print(f"错误: 目录 '{directory}' 中没有音频文件")
+        return False
+
+    # 分析线程共用本进程的FFmpeg线程数设置
+    limit_ffmpeg_threads(plan_concurrency(workers)[1])
+    print(f"正在分析 {len(tracks)} 个曲目（{workers}个并行）...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        measurements = dict(zip(tracks, executor.map(analyze_loudness, tracks)))
+
+    for path, track in measurements.items():
+        print(f"  {path.name}: {format_loudness(track) if track else '分析失败'}")
+
+    album = album_loudness(list(measurements.values()))
+    if album is None:
+        print("错误: 没有可用的测量结果")
+        return False
+    print(f"专辑: 综合响度 {album['integrated']:.1f} LUFS，真峰值 {_db(album['true_peak']):.1f} dBTP")
+
+    success = True
+    for path, track in measurements.items():
+        if track is None:
+            success = False
+            continue
+        if not write_loudness_tags(path, loudness_tags(track, album, path.suffix)):
+            success = False
+    return success
+
+
+def print_help():
+    """打印帮助信息"""
+    print("""
+响度分析与ReplayGain标签
+
+用法:
+    python replaygain.py <专辑目录> [-j 并行数|auto]
+
+说明:
+    并行测量目录中所有音频文件（.flac/.opus/.ogg/.mp3/.m4a）的综合响度和真峰值，
+    全部完成后写入 REPLAYGAIN_TRACK_*/REPLAYGAIN_ALBUM_* 标签（Opus为R128_TRACK_GAIN/R128_ALBUM_GAIN）
+    转换单个文件时可用 video_to_audio.py --replaygain 在编码的同时测量
+    """)
+
+
+def main():
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args or len(args) == 0:
+        print_help()
+        sys.exit(0)
+
+    directory = Path(args[0])
+    workers = DEFAULT_ALBUM_WORKERS
+    if len(args) >= 3 and args[1] == '-j':
+        try:
+            workers = parse_jobs(args[2])
+        except ValueError:
+            print("错误: 并行数必须是正整数或auto")
+            sys.exit(1)
+
+    if not directory.is_dir():
+        print(f"错误: 目录 '{directory}' 不存在")
+        sys.exit(1)
+
+    if not process_album(directory, workers):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内置性能分析模式
+用cProfile记录整次运行的Python调用耗时（输出pstats文件），
+并在每个处理阶段（media_trace的span）前后做tracemalloc快照，输出各阶段内存分配最多的位置
+"""
+
+import io
+import json
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from media_trace import add_listener, remove_listener
+from process_runner import resource_report
+
+# Constants
+DEFAULT_TOP_N = 15
+TRACEMALLOC_FRAMES = 5
+PROFILE_OPTION = '--profile'
+
+
+class RunProfiler:
+    """
+    性能分析器
+    输出:
+        <前缀>.pstats          cProfile统计，可用 python -m pstats 查看
+        <前缀>.tracemalloc.json 各阶段内存分配最多的top-N位置
+    """
+
+    def __init__(self, output_prefix: Union[str, Path], top_n: int = DEFAULT_TOP_N):
+        self.output_prefix = Path(output_prefix)
+        self.top_n = top_n
+        self.stages: List[Dict] = []
+        self._profile = cProfile.Profile()
+        self._snapshots: Dict[str, tracemalloc.Snapshot] = {}
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+
+    @property
+    def pstats_path(self) -> Path:
+        return self.output_prefix.with_name(self.output_prefix.name + '.pstats')
+
+    @property
+    def tracemalloc_path(self) -> Path:
+        return self.output_prefix.with_name(self.output_prefix.name + '.tracemalloc.json')
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        add_listener(self)
+        self._profile.enable()
+
+    def stop(self) -> None:
+        self._profile.disable()
+        remove_listener(self)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        self.save()
+
+    # media_trace监听接口：每个阶段前后各做一次快照
+    def span_started(self, current) -> None:
+        snapshot = self._take_snapshot()
+        with self._lock:
+            self._snapshots[current.span_id] = snapshot
+
+    def span_finished(self, current) -> None:
+        with self._lock:
+            before = self._snapshots.pop(current.span_id, None)
+        if before is None:
+            return
+        after = self._take_snapshot()
+        stats = after.compare_to(before, 'lineno')
+        top = []
+        for stat in stats[:self.top_n]:
+            frame = stat.traceback[0]
+            top.append({
+                'site': f"{frame.filename}:{frame.lineno}",
+                'size_diff': stat.size_diff,
+                'count_diff': stat.count_diff,
+                'size': stat.size,
+            })
+        with self._lock:
+            self.stages.append({
+                'stage': current.name,
+                'span_id': current.span_id,
+                'parent_id': current.parent_id,
+                'duration': current.duration,
+                'allocated_bytes': sum(max(stat.size_diff, 0) for stat in stats),
+                'top_allocations': top,
+            })
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        # 过滤掉tracemalloc和本模块自身的分配
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+
+    def save(self) -> None:
+        self._profile.dump_stats(str(self.pstats_path))
+        with open(self.tracemalloc_path, 'w', encoding='utf-8') as f:
+            json.dump({'top_n': self.top_n, 'stages': self.stages}, f, ensure_ascii=False, indent=2)
+
+    def format_summary(self, limit: int = 10) -> str:
+        """耗时最多的函数和分配最多的阶段"""
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(limit)
+
+        lines = [stream.getvalue().rstrip(), "", "各阶段内存分配:"]
+        for stage in sorted(self.stages, key=lambda s: s['allocated_bytes'], reverse=True)[:limit]:
+            lines.append(f"  {stage['stage']:<28}{stage['allocated_bytes'] / 1024:>10.1f} KB"
+                         f"  {(stage['duration'] or 0):>8.3f}s")
+            for item in stage['top_allocations'][:3]:
+                lines.append(f"      {item['size_diff'] / 1024:>+9.1f} KB  {item['site']}")
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profile_run(output_prefix: Optional[Union[str, Path]], top_n: int = DEFAULT_TOP_N):
+    """
+    output_prefix为None时不做任何事，方便直接包住main的主体
+    范围内的转换结束后同时打印子进程资源统计（见process_runner.resource_report）
+    """
+    if output_prefix is None:
+        yield None
+        return
+
+    profiler = RunProfiler(output_prefix, top_n)
+    profiler.start()
+    try:
+        with resource_report():
+            yield profiler
+    finally:
+        profiler.stop()
+        print("\n[性能分析]")
+        print(profiler.format_summary())
+        print(f"\npstats文件: {profiler.pstats_path}")
+        print(f"内存分配报告: {profiler.tracemalloc_path}")
+
+
+def pop_profile_option(argv: List[str]) -> Tuple[List[str], Optional[str]]:
+    """
+    从参数列表中取出 --profile <输出前缀>
+    返回 (剩余参数, 输出前缀)；没有该选项时前缀为None
+    """
+    if PROFILE_OPTION not in argv:
+        return argv, None
+
+    index = argv.index(PROFILE_OPTION)
+    if index + 1 >= len(argv):
+        raise ValueError("--profile 需要指定输出文件前缀")
+    return argv[:index] + argv[index + 2:], argv[index + 1]
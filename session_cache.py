@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+裁剪调试的解码会话缓存
+反复调整-ss/-t转换同一个长视频时，每次都要从头解复用、解码视频容器中的音轨（输出端的-ss需要解码到开始位置）。
+开启会话缓存后，第一次转换把选中的音频流完整解码为原始PCM（与编码输出相同的44.1kHz/立体声/16位，
+不损失任何信息）保存在缓存目录中；之后同一个源文件的裁剪直接在PCM上按字节定位（输入端-ss，精确且不需要解码），
+只编码裁剪范围内的音频。超过保留时间未使用的、或总大小超过上限时最久未使用的缓存会被删除
+"""
+
+import os
+import sys
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from process_runner import run_process
+from media_trace import traced, annotate, file_size
+from conversion_cache import default_cache_dir, fingerprint
+from compression_tuner import PCM_SAMPLE_RATE, PCM_CHANNELS, PCM_BYTES_PER_SECOND
+from cpu_budget import ffmpeg_thread_args
+
+# Constants
+SESSION_CACHE_MAX_BYTES = 10 * 1024 * 1024 * 1024   # 约15小时的PCM
+SESSION_CACHE_MAX_AGE = 12 * 60 * 60                 # 12小时未使用的删除
+SESSION_CACHE_VERSION = 1
+PCM_FORMAT_ARGS = ['-f', 's16le', '-ar', str(PCM_SAMPLE_RATE), '-ac', str(PCM_CHANNELS)]
+PCM_AUDIO_MAP = '0:a:0'
+
+# 同一进程内按键互斥，同一个源文件只解码一次
+_decode_locks: Dict[str, threading.Lock] = {}
+_decode_locks_guard = threading.Lock()
+
+
+def session_cache_dir() -> Path:
+    """编码缓存目录下的session子目录（编码缓存按大小淘汰时不会删除）"""
+    return default_cache_dir() / 'session'
+
+
+def pcm_selection(start_time: Optional[float] = None,
+                  duration: Optional[float] = None) -> Tuple[List[str], str]:
+    """
+    读取缓存PCM的(输入参数, 音频映射)，与audio_streams.resolve_audio_stream的结果格式相同
+    裁剪放在输入端：原始PCM按字节定位，精确到样本，不需要从头读取
+    """
+    input_args = list(PCM_FORMAT_ARGS)
+    if start_time is not None:
+        input_args.extend(['-ss', str(start_time)])
+    if duration is not None:
+        input_args.extend(['-t', str(duration)])
+    return input_args, PCM_AUDIO_MAP
+
+
+class DecodedAudioCache:
+    """
+    缓存目录结构:
+        <键>.pcm    解码后的原始PCM（s16le，44.1kHz，立体声），修改时间为最近使用时间
+    键为源文件指纹 + 选中的音频流
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None,
+                 max_bytes: int = SESSION_CACHE_MAX_BYTES, max_age: float = SESSION_CACHE_MAX_AGE):
+        self.cache_dir = Path(cache_dir) if cache_dir else session_cache_dir()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key_for(self, input_path: Union[str, Path], audio_selection: Tuple[List[str], str]) -> str:
+        payload = json.dumps({'version': SESSION_CACHE_VERSION, 'input': fingerprint(input_path),
+                              'selection': [list(audio_selection[0]), audio_selection[1]]}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.pcm"
+
+    def decoded_audio(self, input_path: Union[str, Path],
+                      audio_selection: Tuple[List[str], str]) -> Optional[Path]:
+        """返回源文件解码后的PCM，没有缓存时先完整解码一次；解码失败时返回None"""
+        key = self.key_for(input_path, audio_selection)
+        entry = self._entry(key)
+        with _decode_locks_guard:
+            lock = _decode_locks.setdefault(key, threading.Lock())
+        with lock:
+            if entry.exists():
+                # 更新使用时间，供按保留时间和最近使用淘汰
+                os.utime(entry)
+                annotate(session_cache='hit')
+                print(f"使用会话缓存的解码音频（{file_size(entry) / PCM_BYTES_PER_SECOND:.0f}秒）")
+            elif not self._decode(Path(input_path), audio_selection, entry):
+                return None
+        self.prune(keep=key)
+        return entry
+
+    @traced('session_decode')
+    def _decode(self, input_path: Path, audio_selection: Tuple[List[str], str], entry: Path) -> bool:
+        """完整解码选中的音频流，先写到临时文件，成功后再改名（其他进程不会读到不完整的缓存）"""
+        print("正在解码音频到会话缓存（之后调整裁剪范围时不再解码源文件）...")
+        input_args, audio_map = audio_selection
+        temp_entry = entry.with_name(f"{entry.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', *ffmpeg_thread_args(), *input_args,
+               '-i', str(input_path), '-map', audio_map, '-acodec', 'pcm_s16le', *PCM_FORMAT_ARGS,
+               '-y', str(temp_entry)]
+        annotate(session_cache='miss', bytes_in=file_size(input_path))
+        try:
+            result = run_process(cmd, 'ffmpeg_session_decode')
+            if result.returncode != 0 or not temp_entry.exists():
+                print(f"警告: 解码到会话缓存失败（返回码 {result.returncode}），直接从源文件转换")
+                return False
+            os.replace(temp_entry, entry)
+        finally:
+            temp_entry.unlink(missing_ok=True)
+        annotate(bytes_out=file_size(entry))
+        return True
+
+    def prune(self, keep: Optional[str] = None) -> int:
+        """删除超过保留时间未使用的缓存，总大小仍超过上限时按最近使用时间淘汰；返回删除数"""
+        now = time.time()
+        entries = []
+        for path in self.cache_dir.glob('*.pcm'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+
+        removed = 0
+        total = sum(size for _used, _path, size in entries)
+        for used, path, size in sorted(entries):
+            if path.stem == keep:
+                continue
+            if now - used <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                # Windows下正在被其他转换读取
+                continue
+            removed += 1
+            total -= size
+        return removed
+
+    def clear(self) -> int:
+        """删除全部缓存，返回删除数"""
+        removed = 0
+        for path in self.cache_dir.glob('*.pcm'):
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def entries(self) -> List[Tuple[Path, int, float]]:
+        """[(文件, 大小, 最近使用时间), ...]，最近使用的在前"""
+        result = []
+        for path in self.cache_dir.glob('*.pcm'):
+            stat = path.stat()
+            result.append((path, stat.st_size, stat.st_mtime))
+        return sorted(result, key=lambda item: item[2], reverse=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print("用法: python session_cache.py [--clear]")
+        print("列出会话缓存中解码好的音频（--clear 删除全部）；转换时用 video_to_audio.py --session-cache 开启")
+        sys.exit(0)
+    cache = DecodedAudioCache()
+    if len(sys.argv) > 1 and sys.argv[1] == '--clear':
+        print(f"已删除 {cache.clear()} 个会话缓存")
+        sys.exit(0)
+    total = 0
+    for path, size, used in cache.entries():
+        total += size
+        print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}  "
+              f"{size / PCM_BYTES_PER_SECOND / 60:6.1f}分钟  {size / 1024 / 1024:8.1f}MB  {path.name}")
+    print(f"会话缓存: {cache.cache_dir}，共{total / 1024 / 1024:.1f}MB"
+          f"（上限{SESSION_CACHE_MAX_BYTES / 1024 / 1024 / 1024:.0f}GB，{SESSION_CACHE_MAX_AGE // 3600}小时未使用的删除）")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字幕流转LRC歌词
+很多MV是内嵌歌词字幕（SRT/ASS）的MKV。转换时把选中的字幕流作为同一个FFmpeg进程的第二个输出
+（统一转为SRT文本，ASS的样式和特效标记由FFmpeg去掉），与音频编码共用一次读取；
+编码完成后把字幕条目按裁剪开始时间（-ss）平移、按时长截断，生成带时间戳的LRC歌词，
+再按普通LRC文件的流程嵌入为LYRICS
+"""
+
+import re
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from process_runner import run_process
+from media_trace import span, traced, annotate, file_size
+from media_probe import probe_media
+from lrc_time_adjuster import format_time_tag
+
+# Constants
+# 图形字幕（PGS、DVD、DVB）没有文本，无法转换为歌词
+BITMAP_SUBTITLE_CODECS = {'hdmv_pgs_subtitle', 'dvd_subtitle', 'dvb_subtitle', 'xsub'}
+SRT_OUTPUT_ARGS = ['-c:s', 'srt', '-f', 'srt']
+SRT_TIMING = re.compile(r'(\d+):(\d{2}):(\d{2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{1,3})')
+# SRT中的HTML标记（<i>、<font>）和残留的ASS覆盖标记（{\an8}）
+SUBTITLE_MARKUP = re.compile(r'<[^>]+>|\{[^}]*\}')
+
+
+def _seconds(hours: str, minutes: str, seconds: str, millis: str) -> float:
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(millis.ljust(3, '0')) / 1000
+
+
+def parse_srt(content: str) -> List[Tuple[float, float, str]]:
+    """解析SRT文本，返回 [(开始秒, 结束秒, 文本), ...]；多行文本合并为一行，去掉格式标记"""
+    cues = []
+    for block in re.split(r'\n\s*\n', content.replace('\r\n', '\n').strip()):
+        lines = block.split('\n')
+        for position, line in enumerate(lines):
+            timing = SRT_TIMING.search(line)
+            if timing:
+                groups = timing.groups()
+                text = ' '.join(SUBTITLE_MARKUP.sub('', part).strip() for part in lines[position + 1:])
+                text = ' '.join(text.split())
+                if text:
+                    cues.append((_seconds(*groups[:4]), _seconds(*groups[4:]), text))
+                break
+    cues.sort(key=lambda cue: cue[0])
+    return cues
+
+
+def cues_to_lrc(cues: List[Tuple[float, float, str]], start_time: Optional[float] = None,
+                duration: Optional[float] = None) -> str:
+    """
+    把字幕条目转换为LRC歌词，时间相对于裁剪后的音频
+    在裁剪开始之前已结束的条目丢弃，跨过开始时间的条目从0开始，开始于裁剪范围之后的条目丢弃
+    """
+    offset = start_time or 0.0
+    lines = []
+    for start, end, text in cues:
+        start -= offset
+        end -= offset
+        if end <= 0 or (duration is not None and start >= duration):
+            continue
+        lines.append(f"{format_time_tag(max(start, 0.0))}{text}")
+    return '\n'.join(lines)
+
+
+def check_subtitle_stream(input_path: Union[str, Path], subtitle_index: int) -> Optional[str]:
+    """
+    检查第subtitle_index条字幕流能否转换为歌词，不能时返回错误信息
+    无法探测（没有ffprobe）时返回None，按序号直接尝试
+    """
+    info = probe_media(input_path)
+    if info is None:
+        return None
+    subtitles = [stream for stream in info.streams if stream.codec_type == 'subtitle']
+    if subtitle_index >= len(subtitles):
+        return f"没有第{subtitle_index}条字幕流（共{len(subtitles)}条）"
+    stream = subtitles[subtitle_index]
+    if stream.codec in BITMAP_SUBTITLE_CODECS:
+        return f"字幕流 {subtitle_index} 是图形字幕（{stream.codec}），无法转换为歌词"
+    return None
+
+
+def subtitle_output_args(subtitle_index: int, srt_path: Path) -> List[str]:
+    """追加到FFmpeg命令末尾的第二个输出：把字幕流转为SRT文本写到srt_path"""
+    return ['-map', f'0:s:{subtitle_index}', *SRT_OUTPUT_ARGS, '-y', str(srt_path)]
+
+
+def keep_subtitles(input_args: List[str]) -> List[str]:
+    """去掉解复用时丢弃字幕流的-sn（见audio_streams.DEMUX_IGNORE_ARGS）"""
+    return [arg for arg in input_args if arg != '-sn']
+
+
+@traced('subtitle_extract')
+def extract_subtitle(input_path: Union[str, Path], subtitle_index: int, srt_path: Path) -> bool:
+    """
+    单独提取字幕流（音频来自编码缓存、或附加输出需要在编码前得到歌词时使用）
+    只解复用字幕流，不解码音视频
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-vn', '-an', '-dn', '-i', str(input_path),
+           *subtitle_output_args(subtitle_index, srt_path)]
+    result = run_process(cmd, 'subtitle_extract')
+    annotate(bytes_out=file_size(srt_path))
+    return result.returncode == 0
+
+
+def subtitle_to_lrc(srt_path: Path, lrc_path: Path, start_time: Optional[float] = None,
+                    duration: Optional[float] = None) -> bool:
+    """把提取出的SRT转换为LRC文件，没有可用的字幕条目时返回False"""
+    try:
+        content = srt_path.read_text(encoding='utf-8', errors='replace')
+    except OSError:
+        return False
+    with span('subtitle_to_lrc', bytes_in=len(content)) as convert_span:
+        cues = parse_srt(content)
+        lyrics = cues_to_lrc(cues, start_time, duration)
+        convert_span.set(cues=len(cues), lines=lyrics.count('\n') + 1 if lyrics else 0)
+    if not lyrics:
+        return False
+    lrc_path.write_text(lyrics + '\n', encoding='utf-8')
+    print(f"从字幕提取歌词: {lyrics.count(chr(10)) + 1}行")
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print("用法: python subtitle_lyrics.py <字幕文件.srt> [开始时间秒] [时长秒]")
+        print("把SRT字幕转换为LRC歌词并输出到标准输出（从视频中提取请使用 video_to_audio.py --subtitle-lyrics）")
+        sys.exit(0)
+    srt_content = Path(sys.argv[1]).read_text(encoding='utf-8', errors='replace')
+    start = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    length = float(sys.argv[3]) if len(sys.argv) > 3 else None
+    print(cues_to_lrc(parse_srt(srt_content), start, length))
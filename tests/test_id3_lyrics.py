@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MP3歌词帧（USLT/SYLT/TXXX）写入测试
+用FFmpeg生成带ID3v2.4标签的MP3预览，写入歌词后用独立的帧解析和FFmpeg读回
+"""
+
+import sys
+import struct
+import shutil
+import tempfile
+import subprocess
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from flac_metadata_utils import write_mp3_lyrics
+
+# 足够长，帧大小的同步安全整数用到三个字节（超过2^14）
+LONG_LINE = '很长的一句歌词' * 800
+TIMED_LYRICS = f"[00:01.50]第一句\n[00:03.00]second line\n[01:02.25]{LONG_LINE}"
+PURE_LYRICS = f"第一句\nsecond line\n{LONG_LINE}"
+
+
+def _syncsafe(data: bytes) -> int:
+    for byte in data:
+        assert byte < 0x80, "同步安全整数的每个字节最高位必须为0"
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def parse_id3(data: bytes):
+    """最小的ID3v2.4解析：返回(版本, 标签总长, [(帧ID, 内容), ...])"""
+    assert data[:3] == b'ID3'
+    major, flags = data[3], data[5]
+    tag_end = 10 + _syncsafe(data[6:10])
+    frames = []
+    offset = 10
+    while offset + 10 <= tag_end and data[offset:offset + 4] != b'\0\0\0\0':
+        frame_id = data[offset:offset + 4]
+        size = _syncsafe(data[offset + 4:offset + 8])
+        frames.append((frame_id.decode('ascii'), data[offset + 10:offset + 10 + size]))
+        offset += 10 + size
+    return major, flags, tag_end, frames
+
+
+def parse_sylt(payload: bytes):
+    """SYLT内容 -> (编码, 语言, 时间戳格式, 内容类型, [(毫秒, 文本), ...])"""
+    encoding, language, stamp_format, content_type = payload[0], payload[1:4], payload[4], payload[5]
+    descriptor_end = payload.index(b'\0', 6)
+    entries = []
+    offset = descriptor_end + 1
+    while offset < len(payload):
+        text_end = payload.index(b'\0', offset)
+        millis, = struct.unpack('>I', payload[text_end + 1:text_end + 5])
+        entries.append((millis, payload[offset:text_end].decode('utf-8')))
+        offset = text_end + 5
+    return encoding, language, stamp_format, content_type, entries
+
+
+@unittest.skipUnless(shutil.which('ffmpeg'), "需要FFmpeg")
+class TestMp3LyricsFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp(prefix='id3_test_'))
+        self.mp3 = self.work_dir / 'preview.mp3'
+        subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=2',
+                        '-c:a', 'libmp3lame', '-b:a', '64k', '-id3v2_version', '4',
+                        '-metadata', 'title=测试标题', '-y', str(self.mp3)], check=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _tags(self):
+        result = subprocess.run(['ffmpeg', '-v', 'error', '-i', str(self.mp3), '-f', 'ffmetadata', '-'],
+                                capture_output=True, check=True)
+        return result.stdout.decode('utf-8')
+
+    def test_round_trip(self):
+        before = self.mp3.read_bytes()
+        _major, _flags, audio_offset, _frames = parse_id3(before)
+
+        self.assertTrue(write_mp3_lyrics(self.mp3, TIMED_LYRICS, PURE_LYRICS,
+                                         {'REPLAYGAIN_TRACK_GAIN': '-6.50 dB'}))
+        data = self.mp3.read_bytes()
+        major, flags, tag_end, frames = parse_id3(data)
+        self.assertEqual((major, flags), (4, 0))
+        # 音频数据原样保留在标签之后
+        self.assertEqual(data[tag_end:], before[audio_offset:])
+
+        by_id = {}
+        for frame_id, payload in frames:
+            by_id.setdefault(frame_id, []).append(payload)
+        self.assertIn('TIT2', by_id)
+
+        uslt, = by_id['USLT']
+        self.assertEqual(uslt[0], 3)                 # UTF-8
+        self.assertEqual(uslt[1:4], b'zho')
+        self.assertEqual(uslt[4:5], b'\0')           # 空描述
+        self.assertEqual(uslt[5:].decode('utf-8'), PURE_LYRICS)
+
+        sylt, = by_id['SYLT']
+        encoding, language, stamp_format, content_type, entries = parse_sylt(sylt)
+        self.assertEqual((encoding, language, stamp_format, content_type), (3, b'zho', 2, 1))
+        self.assertEqual(entries, [(1500, '第一句'), (3000, 'second line'), (62250, LONG_LINE)])
+
+        txxx, = by_id['TXXX']
+        self.assertEqual(txxx, b'\x03REPLAYGAIN_TRACK_GAIN\0-6.50 dB')
+
+        # FFmpeg能读回标签并解码音频
+        tags = self._tags()
+        self.assertIn('title=测试标题', tags)
+        self.assertIn('REPLAYGAIN_TRACK_GAIN=-6.50 dB', tags)
+        self.assertIn('second line', tags)
+        decoded = subprocess.run(['ffmpeg', '-v', 'error', '-i', str(self.mp3), '-f', 'null', '-'],
+                                 capture_output=True)
+        self.assertEqual(decoded.returncode, 0)
+        self.assertEqual(decoded.stderr, b'')
+
+    def test_rewrite_replaces_frames(self):
+        """再次写入时替换同一键的旧帧，不重复添加；其他TXXX保留"""
+        write_mp3_lyrics(self.mp3, TIMED_LYRICS, PURE_LYRICS, {'REPLAYGAIN_TRACK_GAIN': '-6.50 dB'})
+        write_mp3_lyrics(self.mp3, '[00:00.10]新歌词', '新歌词', {'REPLAYGAIN_TRACK_PEAK': '0.900000'})
+        _major, _flags, _tag_end, frames = parse_id3(self.mp3.read_bytes())
+        ids = [frame_id for frame_id, _payload in frames]
+        self.assertEqual(ids.count('USLT'), 1)
+        self.assertEqual(ids.count('SYLT'), 1)
+        self.assertEqual(ids.count('TXXX'), 2)
+        sylt = next(payload for frame_id, payload in frames if frame_id == 'SYLT')
+        self.assertEqual(parse_sylt(sylt)[4], [(100, '新歌词')])
+
+
+if __name__ == '__main__':
+    unittest.main()
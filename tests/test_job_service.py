@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP任务服务测试
+在临时端口上启动服务，通过HTTP提交任务并轮询到完成
+"""
+
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import unittest
+import urllib.error
+import urllib.request
+from pathlib import Path
+from threading import Thread
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from job_queue import JobStore, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+from job_service import JobService, create_server
+
+# Constants
+POLL_TIMEOUT = 60
+
+
+def _request(base_url: str, method: str, path: str, body=None):
+    """发送请求，返回(状态码, JSON响应)"""
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read().decode('utf-8'))
+
+
+@unittest.skipUnless(shutil.which('ffmpeg'), "需要FFmpeg")
+class TestJobService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = Path(tempfile.mkdtemp(prefix='job_service_test_'))
+        cls.media = cls.work_dir / 'tone.mkv'
+        subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=3',
+                        '-c:a', 'pcm_s16le', '-y', str(cls.media)], check=True)
+        cls.upload_dir = cls.work_dir / 'uploads'
+        cls.store = JobStore(cls.work_dir / 'jobs.db')
+        cls.service = JobService(cls.store, workers=1, upload_dir=str(cls.upload_dir))
+        cls.server = create_server(cls.service, '127.0.0.1', 0)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        cls.service.start()
+        cls.server_thread = Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.service.stop()
+        cls.store.close()
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    def _wait(self, job_id: int):
+        deadline = time.time() + POLL_TIMEOUT
+        while time.time() < deadline:
+            status, job = _request(self.base_url, 'GET', f'/jobs/{job_id}')
+            self.assertEqual(status, 200)
+            if job['state'] in (JOB_DONE, JOB_FAILED, JOB_CANCELLED):
+                return job
+            time.sleep(0.2)
+        self.fail(f"任务{job_id}在{POLL_TIMEOUT}秒内未完成")
+
+    def test_submit_and_poll(self):
+        """提交带上传歌词的任务，轮询到完成，输出存在且上传的内容已删除"""
+        output = self.work_dir / 'tone.flac'
+        status, job = _request(self.base_url, 'POST', '/jobs', {
+            'input': str(self.media), 'output': str(output),
+            'duration': '2', 'lrc_text': '[00:00.50]测试歌词'})
+        self.assertEqual(status, 201)
+
+        job = self._wait(job['id'])
+        self.assertEqual(job['state'], JOB_DONE, job.get('error'))
+        self.assertTrue(output.exists())
+        self.assertTrue(job['output_hash'])
+        self.assertFalse((self.upload_dir / job['source_key']).exists())
+
+        status, health = _request(self.base_url, 'GET', '/health')
+        self.assertEqual(status, 200)
+        self.assertEqual(health['workers'], 1)
+
+    def test_reject_output_same_as_input(self):
+        """输出与输入是同一个文件时返回400，不写入任何上传内容"""
+        status, body = _request(self.base_url, 'POST', '/jobs', {
+            'input': str(self.media), 'output': str(self.media), 'lrc_text': '[00:00.50]歌词'})
+        self.assertEqual(status, 400)
+        self.assertIn('error', body)
+        self.assertFalse(self.upload_dir.exists() and any(self.upload_dir.iterdir()))
+
+    def test_reject_invalid_options(self):
+        """压缩级别不接受true，最低编码速度必须是大于0的有限数"""
+        for options in ({'flac_compression': True}, {'flac_compression': 9},
+                        {'min_encode_speed': 0}, {'min_encode_speed': -5},
+                        {'min_encode_speed': 'nan'}, {'min_encode_speed': 'inf'}):
+            status, _ = _request(self.base_url, 'POST', '/jobs', {'input': str(self.media), **options})
+            self.assertEqual(status, 400, options)
+
+    def test_reject_missing_sidecar(self):
+        """元数据文件不存在时返回400，上传的歌词不会留在上传目录中"""
+        status, _ = _request(self.base_url, 'POST', '/jobs', {
+            'input': str(self.media), 'lrc_text': '[00:00.50]歌词',
+            'metadata': str(self.work_dir / 'missing.txt')})
+        self.assertEqual(status, 400)
+        self.assertFalse(self.upload_dir.exists() and any(self.upload_dir.iterdir()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字幕歌词转换测试
+SRT解析（格式标记、多行、CRLF）和按-ss/-t裁剪的规则
+"""
+
+import sys
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from subtitle_lyrics import parse_srt, cues_to_lrc, subtitle_to_lrc
+
+
+class TestParseSrt(unittest.TestCase):
+
+    def test_basic_blocks(self):
+        content = (
+            "1\n00:00:01,000 --> 00:00:02,500\nHello\n\n"
+            "2\n00:01:02,250 --> 00:01:04,000\nWorld\n"
+        )
+        self.assertEqual(parse_srt(content), [(1.0, 2.5, 'Hello'), (62.25, 64.0, 'World')])
+
+    def test_crlf_and_multiline(self):
+        """Windows换行；多行文本合并为一行，多余空白压缩"""
+        content = "1\r\n00:00:01,000 --> 00:00:02,000\r\nfirst  line\r\n  second line\r\n\r\n"
+        self.assertEqual(parse_srt(content), [(1.0, 2.0, 'first line second line')])
+
+    def test_strip_markup(self):
+        """去掉HTML标记（<i>、<font>）和ASS覆盖标记（{\\an8}）"""
+        content = (
+            "1\n00:00:01,000 --> 00:00:02,000\n<i>斜体</i>歌词\n\n"
+            "2\n00:00:03,000 --> 00:00:04,000\n{\\an8}顶部 <font color=\"#ff0000\">红色</font>\n\n"
+            "3\n00:00:05,000 --> 00:00:06,000\n{\\an8}<i></i>\n"
+        )
+        # 只有标记、没有文本的条目丢弃
+        self.assertEqual(parse_srt(content), [(1.0, 2.0, '斜体歌词'), (3.0, 4.0, '顶部 红色')])
+
+    def test_timing_variants(self):
+        """毫秒用点号分隔、不足三位（按小数补齐）、小时超过两位，条目按开始时间排序"""
+        content = (
+            "1\n100:00:00.5 --> 100:00:01.75\nlate\n\n"
+            "2\n00:00:03.040 --> 00:00:04.000\nearly\n"
+        )
+        self.assertEqual(parse_srt(content), [(3.04, 4.0, 'early'), (360000.5, 360001.75, 'late')])
+
+    def test_missing_index_line(self):
+        """没有序号行也能识别时间行"""
+        self.assertEqual(parse_srt("00:00:01,000 --> 00:00:02,000\ntext\n"), [(1.0, 2.0, 'text')])
+
+
+class TestCuesToLrc(unittest.TestCase):
+
+    def test_no_trim(self):
+        cues = [(1.5, 2.0, 'a'), (62.25, 63.0, 'b')]
+        self.assertEqual(cues_to_lrc(cues), "[00:01.50]a\n[01:02.25]b")
+
+    def test_start_time_shift(self):
+        """-ss 2：之前已结束（包括恰好在2秒结束）的丢弃，跨过开始时间的从0开始，其余平移"""
+        cues = [
+            (0.5, 1.0, 'gone'),
+            (1.0, 2.0, 'ends at start'),
+            (1.0, 3.0, 'straddles'),
+            (3.5, 4.0, 'World'),
+        ]
+        self.assertEqual(cues_to_lrc(cues, start_time=2.0), "[00:00.00]straddles\n[00:01.50]World")
+
+    def test_duration_cut(self):
+        """-ss 2 -t 5：开始于裁剪范围之后（包括恰好在结束处开始）的丢弃"""
+        cues = [(3.0, 4.0, 'inside'), (6.9, 8.0, 'just inside'), (7.0, 8.0, 'at end'), (9.0, 10.0, 'after')]
+        self.assertEqual(cues_to_lrc(cues, start_time=2.0, duration=5.0),
+                         "[00:01.00]inside\n[00:04.90]just inside")
+
+    def test_duration_without_start(self):
+        cues = [(1.0, 2.0, 'a'), (30.0, 31.0, 'b')]
+        self.assertEqual(cues_to_lrc(cues, duration=10.0), "[00:01.00]a")
+
+    def test_everything_trimmed(self):
+        self.assertEqual(cues_to_lrc([(0.0, 1.0, 'a')], start_time=5.0), '')
+
+    def test_srt_to_lrc(self):
+        """与用 -ss 2 手动检查MKV内嵌SRT得到的结果一致"""
+        content = (
+            "1\n00:00:00,500 --> 00:00:01,500\nHello\n\n"
+            "2\n00:00:03,500 --> 00:00:04,500\n<i>World</i>\n"
+        )
+        self.assertEqual(cues_to_lrc(parse_srt(content), start_time=2.0), "[00:01.50]World")
+
+
+class TestSubtitleToLrc(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp(prefix='subtitle_test_'))
+        self.srt = self.work_dir / 'track.srt'
+        self.lrc = self.work_dir / 'track.lrc'
+        self.srt.write_text("1\n00:00:00,500 --> 00:00:01,500\nHello\n\n"
+                            "2\n00:00:03,500 --> 00:00:04,500\nWorld\n", encoding='utf-8')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_write_lrc(self):
+        self.assertTrue(subtitle_to_lrc(self.srt, self.lrc, start_time=2.0))
+        self.assertEqual(self.lrc.read_text(encoding='utf-8'), "[00:01.50]World\n")
+
+    def test_nothing_left(self):
+        """裁剪后没有字幕条目时返回False，不写LRC"""
+        self.assertFalse(subtitle_to_lrc(self.srt, self.lrc, start_time=10.0))
+        self.assertFalse(self.lrc.exists())
+        self.assertFalse(subtitle_to_lrc(self.work_dir / 'missing.srt', self.lrc))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,33 +6,77 @@
 
 import sys
 import os
-import subprocess
 import re
 import tempfile
-import time
 import shutil
+import threading
+from contextlib import nullcontext, redirect_stdout
 from pathlib import Path
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, TextIO, Tuple, Union
 
 # 导入元数据处理模块
 from flac_metadata_utils import (
     embed_lyrics_to_flac,
-    write_metadata_to_flac,
     write_metadata_from_file,
-    parse_metadata_file
+    parse_metadata_file,
+    parse_lrc_file,
+    load_cover_bytes,
+    write_mp3_lyrics,
+    MAX_LYRICS_LENGTH
+)
+from compression_tuner import (
+    AUTO_FLAC_COMPRESSION,
+    DEFAULT_MIN_ENCODE_SPEED,
+    auto_tune_compression,
+    format_tune_report
+)
+from media_trace import (
+    span,
+    traced,
+    annotate,
+    file_size,
+    enable_trace,
+    disable_trace,
+    sleep as traced_sleep
+)
+from process_runner import run_process, report_resources
+from conversion_cache import ConversionCache
+from session_cache import DecodedAudioCache, pcm_selection
+from cpu_budget import ffmpeg_thread_args
+from audio_streams import DEFAULT_STREAM_POLICY, STREAM_POLICIES, resolve_audio_stream, parse_stream_policy
+from replaygain import LoudnessMeter, loudness_tags, format_loudness, write_loudness_tags
+from run_profiler import profile_run
+from job_context import JobContext, JobResult, job_context, update_result, scratch_dir, scratch_path, sibling_temp_path
+from subtitle_lyrics import (
+    check_subtitle_stream,
+    extract_subtitle,
+    keep_subtitles,
+    subtitle_output_args,
+    subtitle_to_lrc
 )
 
 # Constants
 DEFAULT_FLAC_COMPRESSION = 5
+# 输入/输出为"-"时表示标准输入/标准输出
+STREAM_PATH = '-'
+
+# 附加输出格式：后缀 -> (编码参数, 歌词形式)
+# 歌词形式: timed = LYRICS标签（带时间戳），unsynced = 纯歌词标签，id3 = USLT/SYLT帧
+EXTRA_OUTPUT_FORMATS = {
+    '.flac': (['-c:a', 'flac', '-ar', '44100', '-ac', '2', '-sample_fmt', 's16'], 'timed'),
+    '.opus': (['-c:a', 'libopus', '-b:a', '128k', '-ac', '2'], 'timed'),
+    '.ogg': (['-c:a', 'libopus', '-b:a', '128k', '-ac', '2'], 'timed'),
+    '.m4a': (['-c:a', 'aac', '-b:a', '192k', '-ac', '2', '-movflags', '+faststart'], 'unsynced'),
+    '.mp3': (['-c:a', 'libmp3lame', '-q:a', '2', '-ac', '2', '-id3v2_version', '4'], 'id3'),
+}
 
 
 def check_ffmpeg():
     """检查FFmpeg是否安装"""
     try:
-        result = subprocess.run(['ffmpeg', '-version'],
-                              capture_output=True,
-                              text=True,
-                              creationflags=subprocess.CREATE_NO_WINDOW)
+        result = run_process(['ffmpeg', '-version'], 'check_ffmpeg',
+                             capture_output=True,
+                             text=True)
         return result.returncode == 0
     except FileNotFoundError:
         return False
@@ -82,30 +126,258 @@ def format_time(seconds):
 
 
 
+def _resolve_compression(input_path: Path, start_time: Optional[float], duration: Optional[float],
+                         flac_compression: Union[int, str], min_encode_speed: float,
+                         audio_selection: Tuple[List[str], str]) -> int:
+    """flac_compression为'auto'时取样测速选择级别，否则原样返回；使用的级别（和测速结果）记入任务结果"""
+    if flac_compression == AUTO_FLAC_COMPRESSION:
+        print("\n正在自动选择压缩级别...")
+        with span('auto_tune') as tune_span:
+            tuned_level, tune_report = auto_tune_compression(input_path, start_time, duration,
+                                                             min_speed=min_encode_speed,
+                                                             audio_selection=audio_selection)
+            tune_span.set(chosen_level=tuned_level)
+        print(format_tune_report(tune_report))
+        if tuned_level is None:
+            tuned_level = DEFAULT_FLAC_COMPRESSION
+            print(f"取样失败，使用默认压缩级别 {tuned_level}")
+        else:
+            print(f"自动选择压缩级别: {tuned_level}")
+        update_result(tune_report=tune_report)
+        flac_compression = tuned_level
+    update_result(compression_level=flac_compression)
+    return flac_compression
+
+
+def _session_decoded(input_path: Path, audio_selection: Tuple[List[str], str]) -> Optional[Path]:
+    """会话缓存中解码好的PCM（没有时先完整解码），缓存不可用时返回None（直接从源文件转换）"""
+    try:
+        return DecodedAudioCache().decoded_audio(input_path, audio_selection)
+    except OSError as e:
+        print(f"警告: 无法使用会话缓存（{e}）")
+        return None
+
+
+def _encode_flac(input_path: Path, output_path: Path, start_time: Optional[float], duration: Optional[float],
+                 flac_compression: Union[int, str], min_encode_speed: float,
+                 audio_selection: Tuple[List[str], str], subtitle: Optional[Tuple[int, Path]] = None) -> int:
+    """
+    编码为FLAC（flac_compression为'auto'时先取样选择级别），返回FFmpeg返回码
+    subtitle为(字幕流序号, SRT文件)时在同一次编码中把字幕流提取为SRT
+    """
+    flac_compression = _resolve_compression(input_path, start_time, duration, flac_compression, min_encode_speed,
+                                            audio_selection)
+    cmd = flac_encode_command(input_path, output_path, start_time, duration, flac_compression, audio_selection,
+                              subtitle)
+    with span('ffmpeg_encode', bytes_in=file_size(input_path),
+              compression_level=flac_compression) as encode_span:
+        result = run_process(cmd, 'ffmpeg_encode')
+        encode_span.set(bytes_out=file_size(output_path))
+
+    return result.returncode
+
+
+def flac_encode_command(input_path: Path, output_path: Path, start_time: Optional[float],
+                        duration: Optional[float], flac_compression: int,
+                        audio_selection: Tuple[List[str], str],
+                        subtitle: Optional[Tuple[int, Path]] = None) -> List[str]:
+    """
+    把选中的音频流（裁剪后）编码为FLAC的FFmpeg命令
+    subtitle为(字幕流序号, SRT文件)时追加第二个输出，字幕不裁剪（由subtitle_to_lrc按裁剪范围平移）
+    """
+    input_args, audio_map = audio_selection
+    if subtitle is not None:
+        input_args = keep_subtitles(input_args)
+
+    # 构建FFmpeg命令（只解复用选中的音频流）
+    cmd = ['ffmpeg', *ffmpeg_thread_args(), *input_args, '-i', str(input_path)]
+
+    if start_time is not None:
+        cmd.extend(['-ss', str(start_time)])
+    if duration is not None:
+        cmd.extend(['-t', str(duration)])
+
+    # FLAC格式编码
+    cmd.extend([
+        '-map', audio_map, '-acodec', 'flac',
+        '-compression_level', str(flac_compression),
+        '-ar', '44100', '-ac', '2', '-sample_fmt', 's16',
+        '-avoid_negative_ts', '1', '-y', str(output_path)
+    ])
+    if subtitle is not None:
+        cmd.extend(subtitle_output_args(*subtitle))
+    return cmd
+
+
+def _extra_output_tags(lrc_path: Optional[Path], metadata_file: Optional[Path]) -> Tuple[Dict[str, str], str, str]:
+    """附加输出要写入的标签（不含封面），以及带时间戳的歌词和纯歌词"""
+    tags: Dict[str, str] = {}
+    timed_lyrics = pure_lyrics = ''
+    if lrc_path:
+        lrc_tags, timed_lyrics, pure_lyrics = parse_lrc_file(lrc_path)
+        tags.update({key: value for key, value in lrc_tags.items() if value and len(value) < 100})
+        timed_lyrics = timed_lyrics[:MAX_LYRICS_LENGTH]
+    if metadata_file:
+        metadata = parse_metadata_file(metadata_file)
+        metadata.pop('COVER_IMAGE', None)
+        tags.update(metadata)
+    return tags, timed_lyrics, pure_lyrics
+
+
+def _encode_fanout(input_path: Path, output_path: Path, extra_outputs: List[Path],
+                   start_time: Optional[float], duration: Optional[float],
+                   flac_compression: int, lrc_path: Optional[Path], metadata_file: Optional[Path],
+                   audio_selection: Tuple[List[str], str], measure_loudness: bool = False) -> int:
+    """
+    一次解码同时编码主FLAC和附加输出（asplit分流），返回FFmpeg返回码
+    主FLAC的歌词/元数据仍由后续步骤写入；附加输出按容器在编码时直接写入对应形式的歌词和标签
+    measure_loudness为True时再分出一路ebur128测量响度，编码完成后为每个输出写入ReplayGain/R128标签
+    """
+    tags, timed_lyrics, pure_lyrics = _extra_output_tags(lrc_path, metadata_file)
+
+    branches = len(extra_outputs) + 1
+    meter = LoudnessMeter() if measure_loudness else None
+    if meter is not None:
+        branches += 1
+    input_args, audio_map = audio_selection
+    chain = f'[{audio_map}]'
+    if start_time is not None or duration is not None:
+        trim = [f"start={start_time}"] if start_time is not None else []
+        if duration is not None:
+            trim.append(f"duration={duration}")
+        chain += f"atrim={':'.join(trim)},asetpts=PTS-STARTPTS,"
+    chain += f"asplit={branches}" + ''.join(f"[out{i}]" for i in range(branches))
+    if meter is not None:
+        # 最后一路只用于测量，不输出
+        chain += f";[out{branches - 1}]{meter.filter_chain},anullsink"
+
+    cmd = ['ffmpeg', *ffmpeg_thread_args(), *input_args, '-i', str(input_path), '-filter_complex', chain,
+           '-map', '[out0]', '-acodec', 'flac', '-compression_level', str(flac_compression),
+           '-ar', '44100', '-ac', '2', '-sample_fmt', 's16', '-y', str(output_path)]
+
+    for index, extra in enumerate(extra_outputs, start=1):
+        codec_args, lyric_form = EXTRA_OUTPUT_FORMATS[extra.suffix.lower()]
+        cmd.extend(['-map', f'[out{index}]', *codec_args])
+        if extra.suffix.lower() == '.flac':
+            cmd.extend(['-compression_level', str(flac_compression)])
+        for tag, value in tags.items():
+            cmd.extend(['-metadata', f"{tag}={value}"])
+        if lyric_form == 'timed' and timed_lyrics:
+            cmd.extend(['-metadata', f"LYRICS={timed_lyrics}"])
+        elif lyric_form == 'unsynced' and pure_lyrics:
+            cmd.extend(['-metadata', f"lyrics={pure_lyrics}"])
+        cmd.extend(['-y', str(extra)])
+
+    if meter is not None:
+        meter.start()
+
+    try:
+        with span('ffmpeg_encode', bytes_in=file_size(input_path), compression_level=flac_compression,
+                  outputs=branches) as encode_span:
+            result = run_process(cmd, 'ffmpeg_encode', pass_fds=meter.pass_fds if meter else ())
+            encode_span.set(bytes_out=sum(file_size(path) or 0 for path in [output_path, *extra_outputs]))
+    finally:
+        loudness = meter.finish() if meter is not None else None
+
+    if result.returncode != 0:
+        return result.returncode
+
+    if meter is not None:
+        if loudness is None:
+            print("警告: 未能测量响度，未写入ReplayGain标签")
+        else:
+            print(f"响度: {format_loudness(loudness)}")
+            update_result(loudness=loudness)
+            # MP3的响度标签与歌词一起写入ID3（流复制会丢掉SYLT）
+            for path in [output_path, *extra_outputs]:
+                if path.suffix.lower() != '.mp3':
+                    write_loudness_tags(path, loudness_tags(loudness, container=path.suffix))
+
+    for extra in extra_outputs:
+        if EXTRA_OUTPUT_FORMATS[extra.suffix.lower()][1] == 'id3':
+            extra_tags = loudness_tags(loudness, container='.mp3') if loudness else None
+            if timed_lyrics or pure_lyrics or extra_tags:
+                write_mp3_lyrics(extra, timed_lyrics, pure_lyrics, extra_tags)
+
+    for extra in extra_outputs:
+        if extra.exists():
+            print(f"附加输出: {extra} ({extra.stat().st_size / (1024 * 1024):.2f} MB)")
+    return result.returncode
+
+
+@traced('process_media')
+@report_resources
 def process_media(input_path: str, output_path: Optional[str] = None, start_time: Optional[float] = None,
                  duration: Optional[float] = None, lrc_path: Optional[str] = None,
-                 flac_compression: int = DEFAULT_FLAC_COMPRESSION, metadata_file: Optional[str] = None) -> bool:
+                 flac_compression: Union[int, str] = DEFAULT_FLAC_COMPRESSION, metadata_file: Optional[str] = None,
+                 min_encode_speed: float = DEFAULT_MIN_ENCODE_SPEED, use_cache: bool = True,
+                 extra_outputs: Optional[List[str]] = None, replaygain: bool = False,
+                 audio_stream: Union[int, str] = DEFAULT_STREAM_POLICY,
+                 audio_language: Optional[str] = None, subtitle_stream: Optional[int] = None,
+                 session_cache: bool = False) -> bool:
     """
     处理媒体文件，转换为FLAC格式
     支持歌词嵌入（保留时间戳）
     支持元数据文件添加元数据（包括封面图片）
+    flac_compression为'auto'时先取样测速，自动选择满足min_encode_speed（倍实时）的最小体积级别
+    use_cache为True时复用相同输入和编码参数的编码结果（见conversion_cache）
+    extra_outputs为附加输出文件（.flac/.opus/.ogg/.m4a/.mp3），与主FLAC共用一次解码，
+    歌词按容器写入：FLAC/Opus为带时间戳的LYRICS，M4A为纯歌词，MP3为USLT/SYLT
+    replaygain为True时在编码的同一次解码中测量响度，写入ReplayGain（Opus为R128）标签
+    audio_stream为音频流序号或选择策略（lossless/channels/rate），audio_language为优先的音轨语言（见audio_streams）
+    subtitle_stream为字幕流序号（0为第一条）时，在编码的同时提取该字幕流，按-ss平移后转换为LRC歌词嵌入
+    （已指定lrc_path时忽略，见subtitle_lyrics）
+    session_cache为True时把选中的音频流完整解码到会话缓存，同一个源文件之后的裁剪直接从缓存中截取（见session_cache）
+    可重入：临时文件放在任务工作目录中或使用不重名的文件名，可以在多个线程中同时调用（见process_media_job）
     """
-    input_path = Path(input_path)
+    with job_context('process_media'):
+        success = _process_media(input_path, output_path, start_time, duration, lrc_path, flac_compression,
+                                 metadata_file, min_encode_speed, use_cache, extra_outputs, replaygain,
+                                 audio_stream, audio_language, subtitle_stream, session_cache)
+        update_result(success=success)
+        return success
 
-    # 生成输出文件名
+
+def process_media_job(input_path: str, output_path: Optional[str] = None, log_sink: Optional[TextIO] = None,
+                      **options) -> JobResult:
+    """
+    在独立的任务上下文中运行process_media，返回JobResult（是否成功、输出文件、缓存命中、响度、错误、日志）
+    本任务的输出按整行写到log_sink（默认为标准输出），不会与同时运行的其他任务在行内交错；
+    options与process_media的参数相同
+    """
+    with JobContext('process_media', log_sink) as job:
+        process_media(input_path, output_path, **options)
+    return job.result
+
+
+def default_output_path(input_path: Path, output_path: Optional[str], has_tags: bool) -> Path:
+    """生成输出文件名（未指定时为 <名称>_trimmed[_with_metadata].flac）"""
     if output_path is None:
         suffix = ".flac"
-        if lrc_path or metadata_file:
+        if has_tags:
             # 如果输入文件已经包含_with_metadata，添加_new_metadata
             if "_with_metadata" in input_path.stem:
                 suffix = f"_new_metadata{suffix}"
             else:
                 suffix = f"_with_metadata{suffix}"
-        output_path = input_path.parent / f"{input_path.stem}_trimmed{suffix}"
-    else:
-        output_path = Path(output_path)
-        if not output_path.suffix.lower().endswith('flac'):
-            output_path = output_path.with_suffix('.flac')
+        return input_path.parent / f"{input_path.stem}_trimmed{suffix}"
+    output_path = Path(output_path)
+    if not output_path.suffix.lower().endswith('flac'):
+        output_path = output_path.with_suffix('.flac')
+    return output_path
+
+
+def _process_media(input_path, output_path, start_time, duration, lrc_path, flac_compression, metadata_file,
+                   min_encode_speed, use_cache, extra_outputs, replaygain, audio_stream, audio_language,
+                   subtitle_stream=None, session_cache=False) -> bool:
+    input_path = Path(input_path)
+    if subtitle_stream is not None and lrc_path:
+        print("注意: 已指定LRC文件，不再从字幕流提取歌词")
+        subtitle_stream = None
+
+    # 生成输出文件名
+    output_path = default_output_path(input_path, output_path,
+                                      bool(lrc_path or metadata_file or subtitle_stream is not None))
 
     # 检查文件
     if not input_path.exists():
@@ -124,6 +396,22 @@ def process_media(input_path: str, output_path: Optional[str] = None, start_time
             print(f"错误: 元数据文件 '{metadata_file}' 不存在")
             return False
 
+    extra_outputs = [Path(path) for path in (extra_outputs or [])]
+    for extra in extra_outputs:
+        if extra.suffix.lower() not in EXTRA_OUTPUT_FORMATS:
+            print(f"错误: 不支持的附加输出格式 '{extra.suffix}'（支持: {', '.join(EXTRA_OUTPUT_FORMATS)}）")
+            return False
+
+    if subtitle_stream is not None:
+        problem = check_subtitle_stream(input_path, subtitle_stream)
+        if problem:
+            print(f"错误: {problem}")
+            return False
+
+    annotate(input=str(input_path), output=str(output_path), bytes_in=file_size(input_path))
+    update_result(input_path=str(input_path), output_path=str(output_path),
+                  extra_outputs=[str(path) for path in extra_outputs])
+
     # 显示信息
     print(f"\n输入文件: {input_path}")
     print(f"输出文件: {output_path}")
@@ -136,6 +424,8 @@ def process_media(input_path: str, output_path: Optional[str] = None, start_time
         print(f"歌词文件: {lrc_path}")
     if metadata_file:
         print(f"元数据文件: {metadata_file}")
+    if subtitle_stream is not None:
+        print(f"字幕歌词: 字幕流 {subtitle_stream}")
 
     print("\n正在处理...")
 
@@ -144,11 +434,15 @@ def process_media(input_path: str, output_path: Optional[str] = None, start_time
         just_add_metadata = (input_path.suffix.lower() == '.flac' and
                            start_time is None and
                            duration is None and
+                           not extra_outputs and
+                           not replaygain and
+                           subtitle_stream is None and
                            (lrc_path is not None or metadata_file is not None))
 
         if just_add_metadata:
             # 直接复制FLAC文件
-            shutil.copy2(input_path, output_path)
+            with span('copy_flac', bytes_in=file_size(input_path)):
+                shutil.copy2(input_path, output_path)
             print(f"复制FLAC文件完成")
 
             # 嵌入歌词
@@ -169,16 +463,17 @@ def process_media(input_path: str, output_path: Optional[str] = None, start_time
                     print("\n正在添加元数据...")
 
                 # 创建临时文件名来避免原地编辑
-                temp_metadata_output = output_path.with_name(f"{output_path.stem}_temp_metadata{output_path.suffix}")
+                temp_metadata_output = sibling_temp_path(output_path, 'temp_metadata')
 
                 success = write_metadata_from_file(output_path, metadata_file, temp_metadata_output)
 
                 if success:
                     # 成功后替换原文件
-                    time.sleep(0.2)  # 等待文件释放
-                    if output_path.exists():
-                        output_path.unlink()
-                    shutil.move(str(temp_metadata_output), str(output_path))
+                    traced_sleep(0.2)  # 等待文件释放
+                    with span('final_move', bytes_out=file_size(temp_metadata_output)):
+                        if output_path.exists():
+                            output_path.unlink()
+                        shutil.move(str(temp_metadata_output), str(output_path))
                     print("元数据添加成功!")
                 else:
                     print("元数据添加失败，但音频文件已生成")
@@ -186,28 +481,83 @@ def process_media(input_path: str, output_path: Optional[str] = None, start_time
                     if temp_metadata_output.exists():
                         temp_metadata_output.unlink()
 
+            annotate(bytes_out=file_size(output_path))
             return True
 
         # 需要进行音频处理的情况
-        # 构建FFmpeg命令
-        cmd = ['ffmpeg', '-i', str(input_path)]
-
-        if start_time is not None:
-            cmd.extend(['-ss', str(start_time)])
-        if duration is not None:
-            cmd.extend(['-t', str(duration)])
-
-        # FLAC格式编码
-        cmd.extend([
-            '-vn', '-acodec', 'flac',
-            '-compression_level', str(flac_compression),
-            '-ar', '44100', '-ac', '2', '-sample_fmt', 's16',
-            '-avoid_negative_ts', '1', '-y', str(output_path)
-        ])
+        audio_selection = resolve_audio_stream(input_path, audio_stream, audio_language)
 
-        result = subprocess.run(cmd, creationflags=subprocess.CREATE_NO_WINDOW)
-
-        if result.returncode == 0:
+        # 相同输入和编码参数的音频已编码过时直接复用（只修改了歌词/元数据的情况）
+        # 附加输出与主FLAC在同一次编码中生成，不使用缓存
+        cache = None
+        cache_key = None
+        if use_cache and not extra_outputs:
+            try:
+                cache = ConversionCache()
+            except OSError as e:
+                print(f"警告: 无法使用编码缓存（{e}）")
+        if cache is not None:
+            with span('cache_lookup'):
+                cache_key = cache.key_for(input_path, start_time=start_time, duration=duration,
+                                          flac_compression=flac_compression, replaygain=replaygain,
+                                          audio_map=audio_selection[1],
+                                          min_encode_speed=(min_encode_speed
+                                                            if flac_compression == AUTO_FLAC_COMPRESSION else None))
+
+        # 字幕流提取出的SRT（在任务工作目录中），编码成功后转换为LRC
+        subtitle_srt = scratch_path('.srt', 'subtitle_') if subtitle_stream is not None else None
+
+        with (cache.locked(cache_key) if cache_key else nullcontext()):
+            cached_method = cache.fetch(cache_key, output_path) if cache_key else None
+            if cached_method:
+                annotate(cache_hit=cached_method)
+                update_result(cache_hit=cached_method)
+                print(f"使用缓存的编码结果（{cached_method}），跳过音频编码")
+                returncode = 0
+                if subtitle_srt:
+                    # 没有编码过程可以附带，只解复用字幕流
+                    extract_subtitle(input_path, subtitle_stream, subtitle_srt)
+            else:
+                # 编码的输入：源文件，或会话缓存中解码好的PCM（已在输入端裁剪，编码时不再裁剪）
+                encode_input, encode_selection = input_path, audio_selection
+                encode_start, encode_duration = start_time, duration
+                decoded = _session_decoded(input_path, audio_selection) if session_cache else None
+                if decoded is not None:
+                    # 取样测速在源文件上进行（取样片段本身就是输入端定位）
+                    flac_compression = _resolve_compression(input_path, start_time, duration, flac_compression,
+                                                            min_encode_speed, audio_selection)
+                    encode_input, encode_selection = decoded, pcm_selection(start_time, duration)
+                    encode_start = encode_duration = None
+                    if subtitle_srt and not (extra_outputs or replaygain):
+                        # PCM中没有字幕流，单独解复用
+                        extract_subtitle(input_path, subtitle_stream, subtitle_srt)
+
+                if extra_outputs or replaygain:
+                    if subtitle_srt:
+                        # 附加输出在编码时写入歌词，需要先得到字幕
+                        extract_subtitle(input_path, subtitle_stream, subtitle_srt)
+                        lrc_path = _subtitle_lrc(subtitle_srt, start_time, duration)
+                        subtitle_srt = None
+                    level = _resolve_compression(input_path, start_time, duration, flac_compression,
+                                                 min_encode_speed, audio_selection)
+                    returncode = _encode_fanout(encode_input, output_path, extra_outputs, encode_start,
+                                                encode_duration, level, lrc_path, metadata_file, encode_selection,
+                                                measure_loudness=replaygain)
+                else:
+                    returncode = _encode_flac(encode_input, output_path, encode_start, encode_duration,
+                                              flac_compression, min_encode_speed, encode_selection,
+                                              (subtitle_stream, subtitle_srt)
+                                              if subtitle_srt and decoded is None else None)
+                # 缓存的FLAC包含响度标签（只取决于音频），但不含歌词和元数据
+                if returncode == 0 and cache_key:
+                    with span('cache_store', bytes_in=file_size(output_path)):
+                        cache.store(cache_key, output_path)
+
+        update_result(returncode=returncode)
+        if returncode == 0 and subtitle_srt and lrc_path is None:
+            lrc_path = _subtitle_lrc(subtitle_srt, start_time, duration)
+
+        if returncode == 0:
             print("处理成功!")
 
             output_size = output_path.stat().st_size / (1024 * 1024)
@@ -217,7 +567,7 @@ def process_media(input_path: str, output_path: Optional[str] = None, start_time
             if lrc_path:
                 print("\n正在嵌入歌词...")
                 # 等待FFmpeg完全释放文件
-                time.sleep(1.0)
+                traced_sleep(1.0)
 
                 # 直接使用生成的文件作为输出，避免额外的复制
                 success = embed_lyrics_to_flac(output_path, lrc_path, output_path)
@@ -235,20 +585,20 @@ def process_media(input_path: str, output_path: Optional[str] = None, start_time
                     print("\n正在添加元数据...")
 
                 # 等待前面的处理完成
-                time.sleep(0.5)
+                traced_sleep(0.5)
 
                 # 创建临时文件名来避免原地编辑
-                temp_metadata_output = output_path.with_name(f"{output_path.stem}_temp_metadata{output_path.suffix}")
+                temp_metadata_output = sibling_temp_path(output_path, 'temp_metadata')
 
                 success = write_metadata_from_file(output_path, metadata_file, temp_metadata_output)
 
                 if success:
                     # 成功后替换原文件
-                    import shutil
-                    time.sleep(0.2)  # 等待文件释放
-                    if output_path.exists():
-                        output_path.unlink()
-                    shutil.move(str(temp_metadata_output), str(output_path))
+                    traced_sleep(0.2)  # 等待文件释放
+                    with span('final_move', bytes_out=file_size(temp_metadata_output)):
+                        if output_path.exists():
+                            output_path.unlink()
+                        shutil.move(str(temp_metadata_output), str(output_path))
                     print("元数据添加成功!")
                 else:
                     print("元数据添加失败，但音频文件已生成")
@@ -256,16 +606,192 @@ def process_media(input_path: str, output_path: Optional[str] = None, start_time
                     if temp_metadata_output.exists():
                         temp_metadata_output.unlink()
 
+            annotate(bytes_out=file_size(output_path))
             return True
         else:
-            print(f"处理失败，返回码: {result.returncode}")
+            print(f"处理失败，返回码: {returncode}")
             return False
 
     except Exception as e:
         print(f"错误: {e}")
+        update_result(error=str(e))
         return False
 
 
+def _subtitle_lrc(srt_path: Path, start_time: Optional[float], duration: Optional[float]) -> Optional[Path]:
+    """把提取出的字幕转换为任务工作目录中的LRC文件，失败时返回None"""
+    lrc_path = scratch_path('.lrc', 'subtitle_')
+    if subtitle_to_lrc(srt_path, lrc_path, start_time, duration):
+        return lrc_path
+    print("警告: 字幕流中没有可用的歌词")
+    return None
+
+
+def _stream_tags(lrc_path: Optional[Path], metadata_file: Optional[Path]) -> Tuple[Dict[str, str], Optional[str]]:
+    """汇总要写入的标签（LRC中的标签、歌词、元数据文件），返回 (标签, 封面来源)"""
+    tags: Dict[str, str] = {}
+    if lrc_path:
+        with span('parse_lrc', bytes_in=file_size(lrc_path)):
+            lrc_tags, timed_lyrics, _pure_lyrics = parse_lrc_file(lrc_path)
+        tags.update({key: value for key, value in lrc_tags.items() if value and len(value) < 100})
+        if timed_lyrics:
+            if len(timed_lyrics) > MAX_LYRICS_LENGTH:
+                print(f"注意: 歌词过长({len(timed_lyrics)}字符)，已截断到{MAX_LYRICS_LENGTH}字符")
+                timed_lyrics = timed_lyrics[:MAX_LYRICS_LENGTH]
+            tags['LYRICS'] = timed_lyrics
+        else:
+            print("警告: 没有找到有效的歌词内容")
+
+    cover_input = None
+    if metadata_file:
+        with span('parse_metadata', bytes_in=file_size(metadata_file)):
+            metadata = parse_metadata_file(metadata_file)
+        cover_input = metadata.pop('COVER_IMAGE', None)
+        tags.update(metadata)
+    return tags, cover_input
+
+
+def _feed_pipe(write_fd: int, data: bytes) -> None:
+    """在后台线程中把数据写入管道，写完后关闭"""
+    try:
+        with open(write_fd, 'wb') as pipe:
+            pipe.write(data)
+    except (BrokenPipeError, OSError):
+        pass
+
+
+@traced('process_stream')
+@report_resources
+def _process_stream(input_path: str, output_path: str, start_time: Optional[float],
+                    duration: Optional[float], lrc_path: Optional[Path],
+                    flac_compression: Union[int, str], metadata_file: Optional[Path],
+                    min_encode_speed: float, audio_stream: Union[int, str],
+                    audio_language: Optional[str]) -> bool:
+    tags, cover_input = _stream_tags(lrc_path, metadata_file)
+    cover_data = load_cover_bytes(cover_input) if cover_input else None
+    if cover_input and not cover_data:
+        print("警告：未能读取封面图片")
+
+    # 标准输入无法预先探测，只能按序号选择音频流
+    input_args, audio_map = audio_selection = resolve_audio_stream(
+        None if input_path == STREAM_PATH else input_path, audio_stream, audio_language)
+
+    if flac_compression == AUTO_FLAC_COMPRESSION:
+        if input_path == STREAM_PATH:
+            print(f"注意: 标准输入无法取样测速，使用默认压缩级别 {DEFAULT_FLAC_COMPRESSION}")
+            flac_compression = DEFAULT_FLAC_COMPRESSION
+        else:
+            tuned_level, tune_report = auto_tune_compression(input_path, start_time, duration,
+                                                             min_speed=min_encode_speed,
+                                                             audio_selection=audio_selection)
+            print(format_tune_report(tune_report))
+            flac_compression = tuned_level if tuned_level is not None else DEFAULT_FLAC_COMPRESSION
+
+    if input_path == STREAM_PATH:
+        cmd = ['ffmpeg', '-hide_banner', *ffmpeg_thread_args(), *input_args, '-i', 'pipe:0']
+    else:
+        # 不从标准输入读取交互按键，避免吞掉管道中的数据
+        cmd = ['ffmpeg', '-hide_banner', '-nostdin', *ffmpeg_thread_args(), *input_args, '-i', str(input_path)]
+
+    # 封面通过额外的管道传给FFmpeg，不落盘（Windows不支持继承任意文件描述符，改用临时文件）
+    pass_fds = ()
+    read_fd = None
+    feeder = None
+    temp_cover = None
+    if cover_data:
+        if sys.platform == 'win32':
+            temp_cover = tempfile.NamedTemporaryFile(delete=False, suffix='.img', dir=scratch_dir())
+            temp_cover.write(cover_data)
+            temp_cover.close()
+            cmd.extend(['-i', temp_cover.name])
+        else:
+            read_fd, write_fd = os.pipe()
+            pass_fds = (read_fd,)
+            feeder = threading.Thread(target=_feed_pipe, args=(write_fd, cover_data), daemon=True)
+            cmd.extend(['-f', 'image2pipe', '-i', f'pipe:{read_fd}'])
+
+    cmd.extend(['-map', audio_map])
+    # 用atrim裁剪：管道输入无法定位，且-ss输出选项会把封面帧一起裁掉
+    if start_time is not None or duration is not None:
+        trim = [f"start={start_time}"] if start_time is not None else []
+        if duration is not None:
+            trim.append(f"duration={duration}")
+        cmd.extend(['-af', f"atrim={':'.join(trim)},asetpts=PTS-STARTPTS"])
+
+    cmd.extend([
+        '-acodec', 'flac',
+        '-compression_level', str(flac_compression),
+        '-ar', '44100', '-ac', '2', '-sample_fmt', 's16',
+    ])
+    if cover_data:
+        cmd.extend(['-map', '1:v', '-c:v', 'copy', '-disposition:v', 'attached_pic'])
+    for tag, value in tags.items():
+        cmd.extend(['-metadata', f"{tag}={value}"])
+
+    if output_path == STREAM_PATH:
+        cmd.extend(['-f', 'flac', 'pipe:1'])
+    else:
+        cmd.extend(['-f', 'flac', '-y', str(output_path)])
+
+    try:
+        if feeder:
+            feeder.start()
+        with span('ffmpeg_stream', compression_level=flac_compression, cover=bool(cover_data),
+                  tags=len(tags)) as stream_span:
+            # 标准输入/输出直接交给FFmpeg，数据不经过Python
+            sys.stdout.flush()
+            result = run_process(cmd, 'ffmpeg_stream', pass_fds=pass_fds)
+            if output_path != STREAM_PATH:
+                stream_span.set(bytes_out=file_size(output_path))
+    finally:
+        if read_fd is not None:
+            os.close(read_fd)
+        if feeder:
+            feeder.join()
+        if temp_cover:
+            Path(temp_cover.name).unlink(missing_ok=True)
+
+    if result.returncode != 0:
+        print(f"处理失败，返回码: {result.returncode}")
+        return False
+    print("处理成功!")
+    return True
+
+
+def process_stream(input_path: str = STREAM_PATH, output_path: str = STREAM_PATH,
+                   start_time: Optional[float] = None, duration: Optional[float] = None,
+                   lrc_path: Optional[str] = None,
+                   flac_compression: Union[int, str] = DEFAULT_FLAC_COMPRESSION,
+                   metadata_file: Optional[str] = None,
+                   min_encode_speed: float = DEFAULT_MIN_ENCODE_SPEED,
+                   audio_stream: Union[int, str] = DEFAULT_STREAM_POLICY,
+                   audio_language: Optional[str] = None) -> bool:
+    """
+    流式转换：输入/输出可以是"-"（标准输入/标准输出）
+    歌词、标签和封面在同一次FFmpeg编码中写入，不产生中间文件
+    输出到标准输出时，本程序的提示信息改为写到标准错误
+    注意：输出不可定位时FFmpeg无法回填STREAMINFO中的总采样数和MD5
+    """
+    # 提示信息按任务转发，不替换全局的sys.stdout，多个线程可以同时调用
+    with job_context('process_stream', sys.stderr if output_path == STREAM_PATH else None):
+        if input_path != STREAM_PATH and not Path(input_path).exists():
+            print(f"错误: 文件 '{input_path}' 不存在")
+            return False
+        for label, path in (('LRC文件', lrc_path), ('元数据文件', metadata_file)):
+            if path and not Path(path).exists():
+                print(f"错误: {label} '{path}' 不存在")
+                return False
+
+        try:
+            return _process_stream(input_path, output_path, start_time, duration,
+                                   Path(lrc_path) if lrc_path else None, flac_compression,
+                                   Path(metadata_file) if metadata_file else None, min_encode_speed,
+                                   audio_stream, audio_language)
+        except Exception as e:
+            print(f"错误: {e}")
+            return False
+
+
 def print_help():
     """打印帮助信息"""
     print("""
@@ -321,10 +847,26 @@ def print_help():
 基本选项:
     -ss <时间>           从指定时间开始裁剪
     -t <时长>            裁剪指定时长
-    -o <输出文件>        指定输出文件路径
+    -o <输出文件>        指定输出文件路径（"-"为标准输出）
     -l <LRC文件>         嵌入LRC歌词文件（保留时间戳）
     -metadata <文件>    从元数据文件添加元数据（标题、艺术家、封面等）
-    -c <级别>            FLAC压缩级别 (0-8，默认5)
+    -c <级别>            FLAC压缩级别 (0-8，默认5；auto为取样测速后自动选择)
+    --min-speed <倍数>   自动选择压缩级别时要求的最低编码速度（倍实时，默认40）
+    --trace <文件>       把各处理阶段的计时以JSON Lines格式追加写入文件
+    --profile <前缀>     性能分析：输出<前缀>.pstats和各阶段内存分配报告<前缀>.tracemalloc.json，
+                         并打印子进程资源统计
+    --also <文件>        同一次解码额外输出一个文件，可重复使用（.flac/.opus/.ogg/.m4a/.mp3），
+                         歌词按格式写入：FLAC/Opus带时间戳，M4A为纯歌词，MP3为USLT+SYLT
+    --no-cache           不使用编码缓存（默认复用相同输入和编码参数的编码结果，只重新写入歌词/元数据）
+    --replaygain         编码的同时测量响度，写入ReplayGain标签（Opus为R128_TRACK_GAIN）
+    --audio-stream <序号|策略>  多音轨时使用的音频流：序号（0为第一条音频流）或策略
+                         lossless（默认，无损优先，其次声道数、采样率）、channels（声道数优先）、rate（采样率优先）；
+                         解说音轨只在没有其他音轨时使用
+    --audio-lang <语言>  优先选择该语言的音轨（如jpn、eng、chi）
+    --subtitle-lyrics <序号>  把内嵌字幕流（SRT/ASS，0为第一条字幕流）转换为带时间戳的歌词嵌入，
+                         在音频编码的同时提取，时间按-ss平移；指定-l时忽略
+    --session-cache      会话缓存：第一次把音频完整解码到缓存，之后用不同的-ss/-t转换同一个文件时
+                         直接从缓存截取，不再解码源文件（python session_cache.py 查看/清空）
     -h, --help           显示帮助信息
 
 格式说明:
@@ -346,6 +888,10 @@ def print_help():
     专辑(ALBUM)：专辑名
     封面图片(COVER_IMAGE): /path/to/image.jpg
 
+流式模式:
+    输入文件为"-"时从标准输入读取，-o -时FLAC写到标准输出（提示信息写到标准错误），
+    歌词、标签和封面在同一次编码中写入，不产生临时文件
+
 示例:
     # 从MP4提取音频，删除前7秒，转为FLAC并嵌入歌词
     python video_to_audio.py input.mp4 -ss 7 -l 歌词.lrc
@@ -368,9 +914,28 @@ def print_help():
     # FLAC最高压缩级别
     python video_to_audio.py audio.wav -c 8
 
+    # 自动选择压缩级别（速度不低于60倍实时的前提下体积最小）
+    python video_to_audio.py video.mp4 -c auto --min-speed 60
+
     # 指定输出文件
     python video_to_audio.py audio.wav -o output.flac -l lyrics.lrc
 
+    # 同时输出手机用的Opus和MP3试听版（只解码一次）
+    python video_to_audio.py video.mp4 -l lyrics.lrc --also preview.opus --also preview.mp3
+
+    # 编码的同时写入ReplayGain标签（整张专辑请用 python replaygain.py <目录>）
+    python video_to_audio.py video.mp4 --replaygain --also preview.opus
+
+    # MKV内嵌歌词字幕，从第10秒开始转换，字幕时间自动平移
+    python video_to_audio.py mv.mkv -ss 10 --subtitle-lyrics 0
+
+    # 反复调整裁剪范围：只有第一次解码整个视频的音轨
+    python video_to_audio.py concert.mkv -ss 3725 -t 260 --session-cache
+    python video_to_audio.py concert.mkv -ss 3723.5 -t 262 --session-cache
+
+    # 流式：从上游程序读取，FLAC直接交给上传程序
+    producer | python video_to_audio.py - -o - -l lyrics.lrc -metadata metadata.txt | uploader
+
     # 所有功能组合
     python video_to_audio.py video.mp4 -ss 01:00 -t 03:00 -l lyrics.lrc -metadata metadata.txt -c 8
     """)
@@ -397,6 +962,16 @@ def main():
     lrc_path = None
     metadata_file = None
     flac_compression = DEFAULT_FLAC_COMPRESSION
+    min_encode_speed = DEFAULT_MIN_ENCODE_SPEED
+    trace_path = None
+    profile_prefix = None
+    use_cache = True
+    extra_outputs = []
+    replaygain = False
+    audio_stream = DEFAULT_STREAM_POLICY
+    audio_language = None
+    subtitle_stream = None
+    session_cache = False
 
     # 解析参数
     i = 1
@@ -422,22 +997,101 @@ def main():
         elif args[i] == '-metadata' and i + 1 < len(args):
             metadata_file = args[i + 1]
             i += 2
+        elif args[i] == '-c' and i + 1 < len(args) and args[i + 1] == AUTO_FLAC_COMPRESSION:
+            flac_compression = AUTO_FLAC_COMPRESSION
+            i += 2
         elif args[i] == '-c' and i + 1 < len(args):
             try:
                 flac_compression = int(args[i + 1])
                 if flac_compression < 0 or flac_compression > 8:
                     raise ValueError
             except ValueError:
-                print("错误: FLAC压缩级别必须是0-8")
+                print("错误: FLAC压缩级别必须是0-8或auto")
+                sys.exit(1)
+            i += 2
+        elif args[i] == '--min-speed' and i + 1 < len(args):
+            try:
+                min_encode_speed = float(args[i + 1])
+                if min_encode_speed <= 0:
+                    raise ValueError
+            except ValueError:
+                print("错误: 最低编码速度必须是正数")
+                sys.exit(1)
+            i += 2
+        elif args[i] == '--trace' and i + 1 < len(args):
+            trace_path = args[i + 1]
+            i += 2
+        elif args[i] == '--profile' and i + 1 < len(args):
+            profile_prefix = args[i + 1]
+            i += 2
+        elif args[i] == '--also' and i + 1 < len(args):
+            extra_outputs.append(args[i + 1])
+            i += 2
+        elif args[i] == '--no-cache':
+            use_cache = False
+            i += 1
+        elif args[i] == '--replaygain':
+            replaygain = True
+            i += 1
+        elif args[i] == '--session-cache':
+            session_cache = True
+            i += 1
+        elif args[i] == '--audio-stream' and i + 1 < len(args):
+            try:
+                audio_stream = parse_stream_policy(args[i + 1])
+            except ValueError:
+                print(f"错误: 音频流必须是序号或 {'/'.join(STREAM_POLICIES)}")
+                sys.exit(1)
+            i += 2
+        elif args[i] == '--audio-lang' and i + 1 < len(args):
+            audio_language = args[i + 1]
+            i += 2
+        elif args[i] == '--subtitle-lyrics' and i + 1 < len(args):
+            try:
+                subtitle_stream = int(args[i + 1])
+                if subtitle_stream < 0:
+                    raise ValueError
+            except ValueError:
+                print("错误: 字幕流序号必须是非负整数")
                 sys.exit(1)
             i += 2
         else:
             print(f"警告: 未知选项 {args[i]}")
             i += 1
 
+    trace_writer = enable_trace(trace_path) if trace_path else None
+    streaming = input_file == STREAM_PATH or output_path == STREAM_PATH
+    if input_file == STREAM_PATH and output_path is None:
+        output_path = STREAM_PATH
+    # 输出到标准输出时，所有提示信息改写到标准错误
+    sink = redirect_stdout(sys.stderr) if output_path == STREAM_PATH else nullcontext()
+
     # 处理文件
-    success = process_media(input_file, output_path, start_time, duration,
-                           lrc_path, flac_compression, metadata_file)
+    with sink:
+        try:
+            with profile_run(profile_prefix):
+                if streaming:
+                    if replaygain:
+                        print("警告: 流式模式不支持--replaygain，已忽略")
+                    if subtitle_stream is not None:
+                        print("警告: 流式模式不支持--subtitle-lyrics，已忽略")
+                    if session_cache:
+                        print("警告: 流式模式不支持--session-cache，已忽略")
+                    success = process_stream(input_file, output_path, start_time, duration,
+                                             lrc_path, flac_compression, metadata_file,
+                                             min_encode_speed=min_encode_speed, audio_stream=audio_stream,
+                                             audio_language=audio_language)
+                else:
+                    success = process_media(input_file, output_path, start_time, duration,
+                                           lrc_path, flac_compression, metadata_file,
+                                           min_encode_speed=min_encode_speed, use_cache=use_cache,
+                                           extra_outputs=extra_outputs, replaygain=replaygain,
+                                           audio_stream=audio_stream, audio_language=audio_language,
+                                           subtitle_stream=subtitle_stream, session_cache=session_cache)
+        finally:
+            if trace_writer:
+                disable_trace(trace_writer)
+                print(f"追踪文件: {trace_path}")
 
     if not success:
         sys.exit(1)
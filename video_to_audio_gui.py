@@ -10,19 +10,82 @@ from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
 import sys
 import os
+import io
+import re
+from collections import deque
 from pathlib import Path
 import subprocess
 import queue
 import time
 
 # 导入核心功能
-from video_to_audio import process_media, parse_time, DEFAULT_FLAC_COMPRESSION
+from video_to_audio import process_media_job, parse_time, DEFAULT_FLAC_COMPRESSION
+from compression_tuner import AUTO_FLAC_COMPRESSION
+from flac_metadata_utils import parse_lrc_file, parse_timed_lines
+from process_runner import ProcessCancelled
+from job_context import JobContext
+from waveform import load_peaks, peaks_for_width, SECONDS_PER_PEAK
+
+# Constants
+LOG_MAX_LINES = 5000          # 日志环形缓冲区保留的最大行数
+LOG_POLL_MS = 100             # 日志刷新间隔
+LOG_DRAIN_LIMIT = 20000       # 每次刷新最多从队列取出的条数
+# 级别从低到高；DETAIL为转换过程中process_media输出的详细信息
+LOG_LEVEL_RANKS = {'DETAIL': 0, 'INFO': 1, 'SUCCESS': 1, 'WARNING': 2, 'ERROR': 3}
+LOG_FILTERS = {'全部': 'DETAIL', '信息': 'INFO', '警告': 'WARNING', '错误': 'ERROR'}
+DEFAULT_LOG_FILTER = '信息'
+# 进度行（[3/100]、百分比、FFmpeg的size=/frame=）连续出现时只保留最新一行
+PROGRESS_PATTERN = re.compile(r'^\s*(\[\d+/\d+\]|frame=|size=)|\d+(\.\d+)?%\s*$')
+PROGRESS_KEY = 'progress'
+# 波形预览
+WAVEFORM_HEIGHT = 120
+WAVEFORM_ZOOM_STEP = 1.5
+WAVEFORM_MIN_PEAKS = 50       # 最大放大时窗口内的峰值对数（0.5秒）
+WAVEFORM_COLOR = '#3a7bd5'
+TRIM_COLOR = '#d0342c'
+LYRIC_COLOR = '#2e9d4a'
+
+
+class _LogStream(io.TextIOBase):
+    """把转换任务的输出按行转发到GUI日志（作为任务日志的sink）"""
+
+    def __init__(self, log):
+        self._log = log
+        self._pending = ''
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._pending += text
+        # 以\r结尾的进度输出也按行处理
+        *lines, self._pending = re.split(r'\r\n|\r|\n', self._pending)
+        for line in lines:
+            if line.strip():
+                self._log(line, self._level_for(line),
+                          PROGRESS_KEY if PROGRESS_PATTERN.search(line) else None)
+        return len(text)
+
+    def flush(self):
+        if self._pending.strip():
+            self._log(self._pending, self._level_for(self._pending))
+        self._pending = ''
+
+    @staticmethod
+    def _level_for(line):
+        stripped = line.strip()
+        if stripped.startswith('错误') or '失败' in stripped:
+            return 'ERROR'
+        if stripped.startswith('警告'):
+            return 'WARNING'
+        return 'DETAIL'
+
 
 class VideoToAudioGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("视频转FLAC音频工具")
-        self.root.geometry("800x600")
+        self.root.geometry("800x760")
         self.root.resizable(True, True)
 
         # 设置图标（如果有的话）
@@ -41,13 +104,30 @@ class VideoToAudioGUI:
         self.start_time = tk.StringVar(value="00:00")
         self.duration = tk.StringVar()
         self.compression_level = tk.IntVar(value=5)
+        self.auto_compression = tk.BooleanVar(value=False)
+        self.session_cache = tk.BooleanVar(value=False)
 
-        # 日志队列
+        # 日志队列（工作线程写入）和环形缓冲区（主线程渲染）
+        # 缓冲区中每条为 [时间, 消息, 级别, 进度键, 重复次数]
         self.log_queue = queue.Queue()
+        self.log_entries = deque(maxlen=LOG_MAX_LINES)
+        self.log_filter = tk.StringVar(value=DEFAULT_LOG_FILTER)
+        self._rendered_lines = 0
+
+        # 波形预览：峰值对、当前显示的峰值范围[起, 止)、歌词时间（相对裁剪起点的秒数）
+        # 每次加载递增序号，旧的加载线程据此停止并丢弃结果
+        self.peaks = None
+        self.waveform_view = (0, 0)
+        self.lyric_times = []
+        self._waveform_load_id = 0
 
         # 创建界面
         self.create_widgets()
 
+        for variable in (self.start_time, self.duration):
+            variable.trace_add('write', lambda *args: self.draw_waveform())
+        self.lrc_file.trace_add('write', lambda *args: self.load_lyric_marks())
+
         # 启动日志更新
         self.update_log()
 
@@ -100,6 +180,8 @@ class VideoToAudioGUI:
         ttk.Label(param_frame, text="持续时间:").grid(row=1, column=0, sticky=tk.W, pady=2)
         ttk.Entry(param_frame, textvariable=self.duration, width=20).grid(row=1, column=1, sticky=tk.W, pady=2)
         ttk.Label(param_frame, text="格式: 60 或 02:00").grid(row=1, column=2, sticky=tk.W, padx=(10, 0))
+        ttk.Checkbutton(param_frame, text="会话缓存（反复调整裁剪时只解码一次）",
+                        variable=self.session_cache).grid(row=1, column=3, sticky=tk.W, padx=(10, 0))
 
         # 压缩级别
         ttk.Label(param_frame, text="FLAC压缩级别:").grid(row=2, column=0, sticky=tk.W, pady=2)
@@ -111,10 +193,14 @@ class VideoToAudioGUI:
         self.compression_label = ttk.Label(compression_frame, text="5")
         self.compression_label.grid(row=0, column=1, padx=(5, 0))
         self.compression_level.trace('w', self.update_compression_label)
+        ttk.Checkbutton(compression_frame, text="自动选择（取样测速）",
+                        variable=self.auto_compression).grid(row=0, column=2, padx=(10, 0))
 
         # 执行按钮
+        self.create_waveform_widgets(main_frame)
+
         button_frame = ttk.Frame(main_frame)
-        button_frame.grid(row=2, column=0, columnspan=2, pady=(10, 0))
+        button_frame.grid(row=3, column=0, columnspan=2, pady=(10, 0))
 
         self.execute_button = ttk.Button(button_frame, text="执行转换", command=self.execute_conversion)
         self.execute_button.grid(row=0, column=0, padx=(0, 5))
@@ -124,20 +210,230 @@ class VideoToAudioGUI:
 
         # 日志显示区域
         log_frame = ttk.LabelFrame(main_frame, text="执行日志", padding="10")
-        log_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(10, 0))
+        log_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(10, 0))
         log_frame.columnconfigure(0, weight=1)
-        log_frame.rowconfigure(0, weight=1)
-        main_frame.rowconfigure(3, weight=1)
+        main_frame.rowconfigure(4, weight=1)
+
+        filter_frame = ttk.Frame(log_frame)
+        filter_frame.grid(row=0, column=0, sticky=tk.E, pady=(0, 5))
+        ttk.Label(filter_frame, text="显示级别:").grid(row=0, column=0, padx=(0, 5))
+        filter_box = ttk.Combobox(filter_frame, textvariable=self.log_filter, values=list(LOG_FILTERS),
+                                  state='readonly', width=6)
+        filter_box.grid(row=0, column=1)
+        filter_box.bind('<<ComboboxSelected>>', lambda event: self.render_log())
 
         self.log_text = scrolledtext.ScrolledText(log_frame, height=15, wrap=tk.WORD)
-        self.log_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.log_text.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        log_frame.rowconfigure(0, weight=0)
+        log_frame.rowconfigure(1, weight=1)
 
         # 配置标签颜色
+        self.log_text.tag_configure("DETAIL", foreground="gray")
         self.log_text.tag_configure("INFO", foreground="black")
         self.log_text.tag_configure("SUCCESS", foreground="green")
         self.log_text.tag_configure("ERROR", foreground="red")
         self.log_text.tag_configure("WARNING", foreground="orange")
 
+    def create_waveform_widgets(self, main_frame):
+        """波形预览区域：左键设置开始时间，右键设置结束时间，滚轮缩放"""
+        waveform_frame = ttk.LabelFrame(main_frame, text="波形预览", padding="10")
+        waveform_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        waveform_frame.columnconfigure(0, weight=1)
+
+        toolbar = ttk.Frame(waveform_frame)
+        toolbar.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
+        toolbar.columnconfigure(4, weight=1)
+        ttk.Button(toolbar, text="加载波形", command=self.load_waveform).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(toolbar, text="放大", command=lambda: self.zoom_waveform(1 / WAVEFORM_ZOOM_STEP)).grid(row=0, column=1, padx=(0, 5))
+        ttk.Button(toolbar, text="缩小", command=lambda: self.zoom_waveform(WAVEFORM_ZOOM_STEP)).grid(row=0, column=2, padx=(0, 5))
+        ttk.Button(toolbar, text="显示全部", command=self.show_full_waveform).grid(row=0, column=3, padx=(0, 5))
+        self.waveform_status = ttk.Label(toolbar, text="左键: 开始时间  右键: 结束时间  滚轮: 缩放", foreground="gray")
+        self.waveform_status.grid(row=0, column=4, sticky=tk.E)
+
+        self.waveform_canvas = tk.Canvas(waveform_frame, height=WAVEFORM_HEIGHT, background='white',
+                                         highlightthickness=0)
+        self.waveform_canvas.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        self.waveform_scroll = ttk.Scrollbar(waveform_frame, orient=tk.HORIZONTAL, command=self.scroll_waveform)
+        self.waveform_scroll.grid(row=2, column=0, sticky=(tk.W, tk.E))
+
+        canvas = self.waveform_canvas
+        canvas.bind('<Configure>', lambda event: self.draw_waveform())
+        canvas.bind('<Button-1>', self.on_waveform_left_click)
+        canvas.bind('<Button-3>', self.on_waveform_right_click)
+        canvas.bind('<MouseWheel>', self.on_waveform_wheel)
+        # X11的滚轮事件
+        canvas.bind('<Button-4>', lambda event: self.zoom_waveform(1 / WAVEFORM_ZOOM_STEP, event.x))
+        canvas.bind('<Button-5>', lambda event: self.zoom_waveform(WAVEFORM_ZOOM_STEP, event.x))
+
+    def load_waveform(self):
+        """在后台线程中解码波形（有缓存时直接读取），之前未完成的加载会被终止"""
+        media_path = self.media_file.get()
+        if not media_path or not os.path.exists(media_path):
+            self.waveform_status.config(text="请先选择存在的视频/音频文件")
+            return
+
+        self._waveform_load_id += 1
+        load_id = self._waveform_load_id
+        self.peaks = None
+        self.draw_waveform()
+        self.waveform_status.config(text="正在解码波形...")
+        thread = threading.Thread(target=self._load_waveform_thread, args=(media_path, load_id))
+        thread.daemon = True
+        thread.start()
+
+    def _load_waveform_thread(self, media_path, load_id):
+        def progress(seconds):
+            self.root.after(0, lambda: self._waveform_progress(load_id, seconds))
+
+        try:
+            peaks = load_peaks(media_path, progress=progress,
+                               cancelled=lambda: load_id != self._waveform_load_id)
+        except ProcessCancelled:
+            return
+        except Exception as e:
+            self.log(f"波形加载失败: {e}", "WARNING")
+            peaks = None
+        self.root.after(0, lambda: self._waveform_loaded(load_id, peaks))
+
+    def _waveform_progress(self, load_id, seconds):
+        if load_id == self._waveform_load_id and self.peaks is None:
+            self.waveform_status.config(text=f"正在解码波形... {seconds:.0f}秒")
+
+    def _waveform_loaded(self, load_id, peaks):
+        if load_id != self._waveform_load_id:
+            return
+        if peaks is None or len(peaks) == 0:
+            self.waveform_status.config(text="无法解码音频")
+            return
+        self.peaks = peaks
+        self.waveform_view = (0, len(peaks))
+        self.waveform_status.config(text=f"时长 {len(peaks) * SECONDS_PER_PEAK:.1f}秒  "
+                                         "左键: 开始时间  右键: 结束时间  滚轮: 缩放")
+        self.draw_waveform()
+
+    def load_lyric_marks(self):
+        """读取歌词时间戳，用于在波形上标记每行歌词的位置"""
+        lrc_path = self.lrc_file.get()
+        self.lyric_times = []
+        if lrc_path and os.path.isfile(lrc_path):
+            try:
+                # 不显示解析过程的输出（只影响当前线程，不会吞掉正在进行的转换的日志）
+                with JobContext('lyric_marks', io.StringIO()):
+                    _metadata, timed_lyrics, _pure = parse_lrc_file(lrc_path)
+                self.lyric_times = [ms / 1000 for ms, _text in parse_timed_lines(timed_lyrics)]
+            except (OSError, ValueError):
+                pass
+        self.draw_waveform()
+
+    def _trim_range(self):
+        """当前的裁剪范围（秒），无法解析的部分为None"""
+        start = parse_time(self.start_time.get()) if self.start_time.get().strip() else 0.0
+        duration = parse_time(self.duration.get()) if self.duration.get().strip() else None
+        end = start + duration if start is not None and duration is not None else None
+        return start, end
+
+    def _x_to_seconds(self, x):
+        first, last = self.waveform_view
+        width = max(self.waveform_canvas.winfo_width(), 1)
+        return (first + (last - first) * min(max(x, 0), width) / width) * SECONDS_PER_PEAK
+
+    def _seconds_to_x(self, seconds):
+        first, last = self.waveform_view
+        width = self.waveform_canvas.winfo_width()
+        return (seconds / SECONDS_PER_PEAK - first) * width / max(last - first, 1)
+
+    def on_waveform_left_click(self, event):
+        if self.peaks is None:
+            return
+        seconds = self._x_to_seconds(event.x)
+        _start, end = self._trim_range()
+        # 保持结束时间不变
+        self.start_time.set(f"{seconds:.3f}")
+        if end is not None:
+            self.duration.set(f"{end - seconds:.3f}" if end > seconds else "")
+
+    def on_waveform_right_click(self, event):
+        if self.peaks is None:
+            return
+        seconds = self._x_to_seconds(event.x)
+        start, _end = self._trim_range()
+        if start is None or seconds <= start:
+            self.waveform_status.config(text="结束时间必须晚于开始时间")
+            return
+        self.duration.set(f"{seconds - start:.3f}")
+
+    def on_waveform_wheel(self, event):
+        self.zoom_waveform(1 / WAVEFORM_ZOOM_STEP if event.delta > 0 else WAVEFORM_ZOOM_STEP, event.x)
+
+    def zoom_waveform(self, factor, x=None):
+        """按factor缩放显示范围，x为缩放中心（画布坐标，默认为中间）"""
+        if self.peaks is None:
+            return
+        first, last = self.waveform_view
+        width = max(self.waveform_canvas.winfo_width(), 1)
+        anchor = first + (last - first) * ((x if x is not None else width / 2) / width)
+        span_size = min(max((last - first) * factor, WAVEFORM_MIN_PEAKS), len(self.peaks))
+        first = anchor - (anchor - first) * span_size / max(last - first, 1)
+        self._set_waveform_view(first, span_size)
+
+    def show_full_waveform(self):
+        if self.peaks is not None:
+            self._set_waveform_view(0, len(self.peaks))
+
+    def scroll_waveform(self, action, amount, unit=None):
+        """水平滚动条回调"""
+        if self.peaks is None:
+            return
+        first, last = self.waveform_view
+        span_size = last - first
+        if action == 'moveto':
+            first = float(amount) * len(self.peaks)
+        else:
+            first += int(amount) * span_size * (0.9 if unit == 'pages' else 0.1)
+        self._set_waveform_view(first, span_size)
+
+    def _set_waveform_view(self, first, span_size):
+        span_size = int(round(span_size))
+        first = int(round(min(max(first, 0), len(self.peaks) - span_size)))
+        self.waveform_view = (first, first + span_size)
+        self.draw_waveform()
+
+    def draw_waveform(self):
+        """重绘波形、裁剪范围和歌词标记；缩放和滚动只重新按像素列归约峰值，不重新解码"""
+        canvas = self.waveform_canvas
+        canvas.delete('all')
+        width = canvas.winfo_width()
+        height = canvas.winfo_height()
+        if self.peaks is None or width <= 1:
+            self.waveform_scroll.set(0, 1)
+            return
+
+        first, last = self.waveform_view
+        self.waveform_scroll.set(first / len(self.peaks), last / len(self.peaks))
+        middle = height / 2
+        scale = (middle - 2) / 32768
+
+        # 每个像素列一条竖线（峰值对少于像素数时按比例铺开）
+        mins, maxs = peaks_for_width(self.peaks, first, last, width)
+        step = width / max(len(mins), 1)
+        for column, (low, high) in enumerate(zip(mins.tolist(), maxs.tolist())):
+            x = column * step
+            canvas.create_line(x, middle - high * scale, x, middle - low * scale + 1, fill=WAVEFORM_COLOR)
+
+        start, end = self._trim_range()
+        if start is not None:
+            for seconds in (start, end):
+                if seconds is not None:
+                    x = self._seconds_to_x(seconds)
+                    canvas.create_line(x, 0, x, height, fill=TRIM_COLOR, width=2)
+
+            # 歌词时间相对于裁剪后的音频，加上开始时间后对应原文件中的位置
+            for lyric_time in self.lyric_times:
+                x = self._seconds_to_x(start + lyric_time)
+                if 0 <= x <= width:
+                    canvas.create_line(x, 0, x, 12, fill=LYRIC_COLOR, width=2)
+                    canvas.create_line(x, 12, x, height, fill=LYRIC_COLOR, dash=(2, 4))
+
     def update_compression_label(self, *args):
         self.compression_label.config(text=str(self.compression_level.get()))
 
@@ -151,6 +447,7 @@ class VideoToAudioGUI:
         filename = filedialog.askopenfilename(filetypes=filetypes)
         if filename:
             self.media_file.set(filename)
+            self.load_waveform()
             # 自动设置输出文件名
             if not self.output_file.get():
                 media_path = Path(filename)
@@ -230,28 +527,27 @@ class VideoToAudioGUI:
             self.log(f"歌词文件: {lrc_path}", "INFO")
             self.log(f"元数据文件: {metadata_path}", "INFO")
             self.log(f"输出文件: {output_path}", "INFO")
-            self.log(f"FLAC压缩级别: {self.compression_level.get()}", "INFO")
+            flac_compression = AUTO_FLAC_COMPRESSION if self.auto_compression.get() else self.compression_level.get()
+            self.log(f"FLAC压缩级别: {flac_compression}", "INFO")
 
-            # 执行转换
-            success = process_media(
+            # 执行转换（转换过程的输出作为详细信息显示在日志中）
+            log_stream = _LogStream(self.log)
+            result = process_media_job(
                 media_path,
                 output_path,
-                start_time,
-                duration,
-                lrc_path,
-                self.compression_level.get(),
-                metadata_path
+                log_sink=log_stream,
+                start_time=start_time,
+                duration=duration,
+                lrc_path=lrc_path,
+                flac_compression=flac_compression,
+                metadata_file=metadata_path,
+                session_cache=self.session_cache.get()
             )
+            log_stream.flush()
 
-            if success:
+            if result.success:
                 self.log("转换成功!", "SUCCESS")
-                # 输出文件路径
-                if not output_path:
-                    media = Path(media_path)
-                    suffix = "_trimmed_with_metadata.flac"
-                    if lrc_path or metadata_path:
-                        suffix = "_trimmed_with_metadata.flac"
-                    output_path = str(media.parent / f"{media.stem}{suffix}")
+                output_path = result.output_path
 
                 self.log(f"输出文件: {output_path}", "SUCCESS")
 
@@ -270,26 +566,105 @@ class VideoToAudioGUI:
             # 重新启用按钮
             self.root.after(0, lambda: self.execute_button.config(state='normal'))
 
-    def log(self, message, level="INFO"):
-        """添加日志消息"""
+    def log(self, message, level="INFO", progress_key=None):
+        """
+        添加日志消息（可在任意线程调用）
+        progress_key相同的连续消息只保留最新一条（用于进度行）
+        """
         timestamp = time.strftime("%H:%M:%S")
-        self.log_queue.put((f"[{timestamp}] {message}", level))
+        for line in str(message).splitlines() or ['']:
+            self.log_queue.put((timestamp, line, level, progress_key))
+
+    def _visible(self, entry):
+        return LOG_LEVEL_RANKS.get(entry[2], 1) >= LOG_LEVEL_RANKS[LOG_FILTERS[self.log_filter.get()]]
+
+    @staticmethod
+    def _format_entry(entry):
+        timestamp, message, _level, _key, count = entry
+        return f"[{timestamp}] {message}" + (f" (×{count})" if count > 1 else "") + "\n"
+
+    def _insert_entries(self, entries):
+        """一次insert调用写入多行"""
+        if not entries:
+            return
+        args = []
+        for entry in entries:
+            args.extend((self._format_entry(entry), entry[2]))
+        self.log_text.insert(tk.END, *args)
+        self._rendered_lines += len(entries)
+
+    def _scroll_if_following(self, following):
+        # 用户向上翻看时不自动滚动
+        if following:
+            self.log_text.see(tk.END)
 
     def update_log(self):
-        """更新日志显示"""
+        """
+        每LOG_POLL_MS毫秒把队列中的消息批量写入日志控件
+        合并重复行和进度行，控件只保留最后LOG_MAX_LINES行
+        """
         try:
-            while True:
-                message, level = self.log_queue.get_nowait()
-                self.log_text.insert(tk.END, message + "\n", level)
-                self.log_text.see(tk.END)
-        except queue.Empty:
-            pass
+            batch = []
+            for _ in range(LOG_DRAIN_LIMIT):
+                try:
+                    batch.append(self.log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self._append_entries(batch)
         finally:
-            self.root.after(100, self.update_log)
+            self.root.after(LOG_POLL_MS, self.update_log)
+
+    def _append_entries(self, batch):
+        new_visible = []          # 本次追加到控件末尾的条目
+        redraw_entry = None       # 控件中已有的最后一行被合并修改，需要重绘
+        for timestamp, message, level, key in batch:
+            last = self.log_entries[-1] if self.log_entries else None
+            if last is not None and last[2] == level and (
+                    (key is not None and last[3] == key) or (key is None and last[3] is None and last[1] == message)):
+                if key is not None:
+                    last[0], last[1] = timestamp, message
+                else:
+                    last[4] += 1
+                if self._visible(last) and not (new_visible and new_visible[-1] is last):
+                    redraw_entry = last
+                continue
+
+            entry = [timestamp, message, level, key, 1]
+            self.log_entries.append(entry)
+            if self._visible(entry):
+                new_visible.append(entry)
+
+        if len(new_visible) >= LOG_MAX_LINES:
+            # 本次的新消息已超过控件容量，直接从缓冲区整体重绘
+            self.render_log()
+            return
+
+        following = self.log_text.yview()[1] >= 0.999
+        if redraw_entry is not None and self._rendered_lines:
+            self.log_text.delete('end-2c linestart', 'end-1c')
+            self._rendered_lines -= 1
+            self._insert_entries([redraw_entry])
+        self._insert_entries(new_visible)
+
+        excess = self._rendered_lines - LOG_MAX_LINES
+        if excess > 0:
+            self.log_text.delete('1.0', f'{excess + 1}.0')
+            self._rendered_lines -= excess
+        self._scroll_if_following(following)
+
+    def render_log(self):
+        """按当前显示级别从缓冲区重绘整个日志"""
+        self.log_text.delete('1.0', tk.END)
+        self._rendered_lines = 0
+        self._insert_entries([entry for entry in self.log_entries if self._visible(entry)])
+        self.log_text.see(tk.END)
 
     def clear_log(self):
         """清空日志"""
-        self.log_text.delete(1.0, tk.END)
+        self.log_entries.clear()
+        self.log_text.delete('1.0', tk.END)
+        self._rendered_lines = 0
 
     def open_output_folder(self):
         """打开输出文件夹"""
@@ -5,19 +5,19 @@
 
 import sys
 import os
-import subprocess
 import re
 from pathlib import Path
 from typing import List, Dict
 
+from process_runner import run_process
+
 def view_lyrics(flac_file: str) -> None:
     """查看FLAC文件的歌词"""
     flac_path = Path(flac_file)
 
     cmd = ['ffmpeg', '-i', str(flac_path), '-hide_banner']
-    result = subprocess.run(cmd, capture_output=True, text=True,
-                          encoding='utf-8', errors='ignore',
-                          creationflags=subprocess.CREATE_NO_WINDOW)
+    result = run_process(cmd, 'ffmpeg_read_tags', capture_output=True, text=True,
+                         encoding='utf-8', errors='ignore')
 
     output = result.stderr
 
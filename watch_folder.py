@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监视文件夹自动转换
+监视目录（含子目录）中新出现的视频文件，等文件大小不再变化后按文件名配对同名的
+.lrc歌词和.txt元数据文件，加入持久化队列，由有上限的进程池调用process_media转换。
+Linux下使用inotify，其他系统退化为轮询（只重新列出修改时间变化的目录，不会每次扫描整棵目录树）
+"""
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from job_queue import JobStore, JobRunner, DEFAULT_WORKERS, cleanup_partial_output
+from cpu_budget import parse_jobs, describe_budget
+
+# Constants
+MEDIA_EXTENSIONS = {'.mp4', '.mkv', '.mov', '.avi', '.webm', '.flv', '.wmv', '.ts', '.m4a', '.wav'}
+LRC_EXTENSION = '.lrc'
+METADATA_EXTENSION = '.txt'
+SIDECAR_EXTENSIONS = {LRC_EXTENSION, METADATA_EXTENSION}
+DEFAULT_SETTLE_SECONDS = 5.0
+DEFAULT_TICK_SECONDS = 1.0
+DEFAULT_QUEUE_FILE = 'watch_queue.db'
+
+# inotify常量（见 linux/inotify.h）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _is_candidate(path: Path) -> bool:
+    """只关心媒体文件和歌词/元数据文件，忽略隐藏文件和下载中的临时文件"""
+    if path.name.startswith('.') or path.suffix.lower() in ('.part', '.tmp', '.crdownload'):
+        return False
+    return path.suffix.lower() in MEDIA_EXTENSIONS or path.suffix.lower() in SIDECAR_EXTENSIONS
+
+
+class InotifyWatcher:
+    """基于inotify的目录监视（仅Linux）"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1失败")
+        self._dirs: Dict[int, Path] = {}
+
+    def add_tree(self, directory: Path) -> Set[Path]:
+        """监视目录及其子目录，返回其中已有的文件"""
+        files = set()
+        for dirpath, dirnames, filenames in os.walk(directory):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd >= 0:
+                self._dirs[wd] = Path(dirpath)
+            files.update(Path(dirpath) / name for name in filenames)
+        return files
+
+    def poll(self, timeout: float) -> Tuple[Set[Path], bool]:
+        """
+        等待事件
+        返回 (有变化的文件, 是否需要全量扫描)；事件队列溢出时需要全量扫描
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set(), False
+
+        changed: Set[Path] = set()
+        overflow = False
+        try:
+            buffer = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return changed, False
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # 新建或移入的子目录：开始监视并处理其中已有的文件
+                    changed.update(self.add_tree(path))
+            else:
+                changed.add(path)
+        return changed, overflow
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    轮询监视
+    每次只stat已知目录，修改时间变化的目录才重新列出内容
+    """
+
+    def __init__(self):
+        self._dir_mtimes: Dict[Path, float] = {}
+
+    def add_tree(self, directory: Path) -> Set[Path]:
+        files = set()
+        for dirpath, dirnames, filenames in os.walk(directory):
+            try:
+                self._dir_mtimes[Path(dirpath)] = os.stat(dirpath).st_mtime
+            except OSError:
+                continue
+            files.update(Path(dirpath) / name for name in filenames)
+        return files
+
+    def poll(self, timeout: float) -> Tuple[Set[Path], bool]:
+        time.sleep(timeout)
+        changed: Set[Path] = set()
+        for directory, last_mtime in list(self._dir_mtimes.items()):
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                # 目录已删除
+                del self._dir_mtimes[directory]
+                continue
+            if mtime == last_mtime:
+                continue
+            self._dir_mtimes[directory] = mtime
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if Path(entry.path) not in self._dir_mtimes:
+                            changed.update(self.add_tree(Path(entry.path)))
+                    else:
+                        changed.add(Path(entry.path))
+        return changed, False
+
+    def close(self) -> None:
+        pass
+
+
+def create_watcher(use_inotify: bool = True):
+    """Linux下优先使用inotify，失败时退化为轮询"""
+    if use_inotify and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as e:
+            print(f"警告: inotify不可用（{e}），改用轮询")
+    return PollingWatcher()
+
+
+class FolderWatcher:
+    """
+    发现文件 -> 等待文件稳定 -> 配对歌词/元数据 -> 加入队列 -> 进程池转换
+    """
+
+    def __init__(self, root: Path, store: JobStore, runner: JobRunner,
+                 output_dir: Optional[Path] = None, settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+                 use_inotify: bool = True):
+        self.root = Path(root)
+        self.store = store
+        self.runner = runner
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.settle_seconds = settle_seconds
+        self.use_inotify = use_inotify
+        # 等待稳定的文件: 路径 -> (大小, 修改时间, 最后一次变化的时间)
+        self.pending: Dict[Path, Tuple[int, float, float]] = {}
+
+    def consider(self, paths: Iterable[Path]) -> None:
+        now = time.monotonic()
+        for path in paths:
+            if _is_candidate(path) and path not in self.pending:
+                self.pending[path] = (-1, -1.0, now)
+
+    def check_pending(self) -> None:
+        """文件在settle_seconds内大小和修改时间都没变化才视为写入完成"""
+        now = time.monotonic()
+        stable_media = []
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                stat = path.stat()
+            except OSError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self.pending[path] = (stat.st_size, stat.st_mtime, now)
+            elif now - since >= self.settle_seconds:
+                if path.suffix.lower() in MEDIA_EXTENSIONS:
+                    stable_media.append(path)
+                else:
+                    del self.pending[path]
+
+        for media in stable_media:
+            # 同名的歌词/元数据文件还在写入时，等它们完成
+            if any(media.with_suffix(ext) in self.pending for ext in SIDECAR_EXTENSIONS):
+                continue
+            del self.pending[media]
+            self.enqueue(media)
+
+    def output_path_for(self, media: Path) -> Optional[Path]:
+        if self.output_dir is None:
+            return media.with_suffix('.flac')
+        relative = media.relative_to(self.root)
+        output = self.output_dir / relative.with_suffix('.flac')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        return output
+
+    def enqueue(self, media: Path) -> None:
+        lrc = media.with_suffix(LRC_EXTENSION)
+        metadata = media.with_suffix(METADATA_EXTENSION)
+        stat = media.stat()
+        # 同一路径、同样大小和修改时间的文件只转换一次（重启后也不会重复）
+        source_key = f"{media.resolve()}|{stat.st_size}|{stat.st_mtime_ns}"
+        job_id = self.store.add(media, self.output_path_for(media),
+                                lrc if lrc.exists() else None,
+                                metadata if metadata.exists() else None,
+                                source_key=source_key)
+        if job_id is not None:
+            extras = [p.name for p in (lrc, metadata) if p.exists()]
+            print(f"[入队] {media}" + (f"（{', '.join(extras)}）" if extras else ""))
+
+    def run(self, tick: float = DEFAULT_TICK_SECONDS) -> None:
+        requeued = self.store.requeue_running()
+        for job in requeued:
+            cleanup_partial_output(job['output'], job['input'])
+        if requeued:
+            print(f"恢复上次未完成的任务: {len(requeued)}个")
+
+        watcher = create_watcher(self.use_inotify)
+        print(f"正在监视: {self.root}（{type(watcher).__name__}，稳定等待{self.settle_seconds:g}秒）")
+        try:
+            # 启动时扫描一次，处理停机期间到达的文件
+            self.consider(watcher.add_tree(self.root))
+            while True:
+                changed, needs_rescan = watcher.poll(tick)
+                if needs_rescan:
+                    changed = {p for p in self.root.rglob('*') if p.is_file()}
+                self.consider(changed)
+                self.check_pending()
+                self.runner.pump()
+        finally:
+            watcher.close()
+
+
+def print_help():
+    """打印帮助信息"""
+    print("""
+监视文件夹自动转换
+
+用法:
+    python watch_folder.py <监视目录> [选项]
+
+选项:
+    -o <目录>            输出目录（默认与源文件同目录），保留子目录结构
+    -j <数量|auto>       同时转换的任务数（默认2；auto为按可用CPU数），
+                         每个FFmpeg的线程数按可用CPU数平均分配
+    --queue <文件>       持久化队列数据库（默认 watch_queue.db）
+    --settle <秒>        文件大小多久不变视为写入完成（默认5）
+    --poll               不使用inotify，强制轮询
+    -h, --help           显示帮助信息
+
+说明:
+    与视频同名的 .lrc 文件作为歌词嵌入，同名的 .txt 文件作为元数据文件
+    例如 live.mp4 + live.lrc + live.txt -> live.flac
+    """)
+
+
+def main():
+    args = sys.argv[1:]
+    if '-h' in args or '--help' in args or len(args) == 0:
+        print_help()
+        sys.exit(0)
+
+    root = Path(args[0])
+    output_dir = None
+    workers = DEFAULT_WORKERS
+    queue_file = DEFAULT_QUEUE_FILE
+    settle_seconds = DEFAULT_SETTLE_SECONDS
+    use_inotify = True
+
+    i = 1
+    while i < len(args):
+        if args[i] == '-o' and i + 1 < len(args):
+            output_dir = Path(args[i + 1])
+            i += 2
+        elif args[i] == '-j' and i + 1 < len(args):
+            try:
+                workers = parse_jobs(args[i + 1])
+            except ValueError:
+                print("错误: 任务数必须是正整数或auto")
+                sys.exit(1)
+            i += 2
+        elif args[i] == '--queue' and i + 1 < len(args):
+            queue_file = args[i + 1]
+            i += 2
+        elif args[i] == '--settle' and i + 1 < len(args):
+            try:
+                settle_seconds = float(args[i + 1])
+            except ValueError:
+                print("错误: 等待时间必须是数字")
+                sys.exit(1)
+            i += 2
+        elif args[i] == '--poll':
+            use_inotify = False
+            i += 1
+        else:
+            print(f"警告: 未知选项 {args[i]}")
+            i += 1
+
+    if not root.is_dir():
+        print(f"错误: 目录 '{root}' 不存在")
+        sys.exit(1)
+
+    store = JobStore(queue_file)
+    runner = JobRunner(store, workers)
+    print(f"{describe_budget()}: {runner.workers}个并行任务，每个FFmpeg {runner.ffmpeg_threads}个线程")
+    try:
+        FolderWatcher(root, store, runner, output_dir, settle_seconds, use_inotify).run()
+    except KeyboardInterrupt:
+        print("\n正在停止，等待进行中的任务完成...")
+    finally:
+        runner.shutdown()
+        print(f"队列状态: {store.counts()}")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
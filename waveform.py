@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+波形预览数据
+在后台把媒体文件流式解码为低采样率单声道PCM，边解码边用NumPy归约为峰值对（每段的最小/最大值），
+不保存完整的PCM；峰值按输入文件指纹缓存到磁盘，再次打开同一文件时直接读取。
+绘制时再把峰值对按像素列归约（缩放时只需重新归约，不需要重新解码）
+"""
+
+import os
+import sys
+import time
+import threading
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Optional, Tuple, Union
+
+import numpy as np
+
+from process_runner import run_process, cancel_scope
+from media_trace import span, traced, file_size
+from conversion_cache import default_cache_dir, fingerprint
+from audio_streams import resolve_audio_stream
+from cpu_budget import ffmpeg_thread_args
+
+# Constants
+WAVEFORM_SAMPLE_RATE = 8000       # 预览用的解码采样率
+PEAK_BUCKET_SAMPLES = 80          # 每个峰值对覆盖的样本数（10ms），最大缩放精度
+PEAK_CACHE_VERSION = 1
+PCM_READ_SIZE = PEAK_BUCKET_SAMPLES * 2 * 4096
+SECONDS_PER_PEAK = PEAK_BUCKET_SAMPLES / WAVEFORM_SAMPLE_RATE
+WAVEFORM_CACHE_MAX_BYTES = 256 * 1024 * 1024      # 约几百小时音频的峰值
+WAVEFORM_CACHE_MAX_AGE = 90 * 24 * 60 * 60        # 90天未打开的删除
+
+
+def waveform_cache_dir() -> Path:
+    """编码缓存目录下的waveform子目录（编码缓存按大小淘汰时不会删除）"""
+    return default_cache_dir() / 'waveform'
+
+
+def prune_waveform_cache(cache_dir: Optional[Union[str, Path]] = None,
+                         max_bytes: int = WAVEFORM_CACHE_MAX_BYTES, max_age: float = WAVEFORM_CACHE_MAX_AGE,
+                         keep: Optional[Path] = None) -> int:
+    """删除超过保留时间未打开的峰值缓存，总大小仍超过上限时按最近使用时间淘汰；返回删除数"""
+    cache_dir = Path(cache_dir) if cache_dir else waveform_cache_dir()
+    now = time.time()
+    entries = []
+    for path in cache_dir.glob('*.npy'):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, path, stat.st_size))
+
+    removed = 0
+    total = sum(size for _used, _path, size in entries)
+    for used, path, size in sorted(entries):
+        if path == keep:
+            continue
+        if now - used <= max_age and total <= max_bytes:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        removed += 1
+        total -= size
+    return removed
+
+
+def reduce_peaks(samples: np.ndarray, bucket: int = PEAK_BUCKET_SAMPLES) -> np.ndarray:
+    """把样本按bucket个一组归约为(最小值, 最大值)，返回形状为(N, 2)的int16数组；不足一组的尾部丢弃"""
+    usable = len(samples) - len(samples) % bucket
+    if usable <= 0:
+        return np.empty((0, 2), dtype=np.int16)
+    groups = samples[:usable].reshape(-1, bucket)
+    return np.stack((groups.min(axis=1), groups.max(axis=1)), axis=1)
+
+
+def peaks_for_width(peaks: np.ndarray, start: int, end: int, width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把peaks[start:end]归约到width个像素列，返回每列的(最小值数组, 最大值数组)
+    峰值对少于像素数时每个峰值对占一列
+    """
+    view = peaks[max(start, 0):max(end, 0)]
+    if len(view) == 0 or width <= 0:
+        return np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int16)
+    columns = min(width, len(view))
+    edges = np.linspace(0, len(view), columns + 1).astype(np.int64)[:-1]
+    return np.minimum.reduceat(view[:, 0], edges), np.maximum.reduceat(view[:, 1], edges)
+
+
+def _read_peaks(read_fd: int, chunks: list, progress: Optional[Callable[[float], None]]) -> None:
+    """读取PCM管道，每读到一块就归约为峰值；块大小是PEAK_BUCKET_SAMPLES的整数倍，余下的样本留到下一块"""
+    leftover = b''
+    decoded_samples = 0
+    with open(read_fd, 'rb') as pipe:
+        while True:
+            data = pipe.read(PCM_READ_SIZE)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % (PEAK_BUCKET_SAMPLES * 2)
+            leftover = data[usable:]
+            if usable:
+                chunks.append(reduce_peaks(np.frombuffer(data[:usable], dtype='<i2')))
+                decoded_samples += usable // 2
+                if progress:
+                    progress(decoded_samples / WAVEFORM_SAMPLE_RATE)
+
+
+@traced('decode_waveform')
+def decode_peaks(media_path: Union[str, Path], progress: Optional[Callable[[float], None]] = None,
+                 cancelled: Optional[Callable[[], bool]] = None) -> Optional[np.ndarray]:
+    """
+    流式解码并归约为峰值对，失败时返回None
+    progress(已解码秒数)在读取线程中调用；cancelled()返回True时终止FFmpeg（抛出ProcessCancelled）
+    """
+    input_args, audio_map = resolve_audio_stream(media_path)
+    cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', *ffmpeg_thread_args(), *input_args,
+           '-i', str(media_path), '-map', audio_map,
+           '-ac', '1', '-ar', str(WAVEFORM_SAMPLE_RATE), '-f', 's16le', '-acodec', 'pcm_s16le']
+
+    if sys.platform == 'win32':
+        # Windows不支持继承任意文件描述符：一次读取标准输出（每小时约58MB）再归约
+        with span('ffmpeg_waveform', bytes_in=file_size(media_path)):
+            with cancel_scope(cancelled) if cancelled else nullcontext():
+                result = run_process([*cmd, 'pipe:1'], 'ffmpeg_waveform', capture_output=True)
+        if result.returncode != 0 or not result.stdout:
+            return None
+        return reduce_peaks(np.frombuffer(result.stdout, dtype='<i2'))
+
+    read_fd, write_fd = os.pipe()
+    cmd.append(f'pipe:{write_fd}')
+    chunks = []
+    reader = threading.Thread(target=_read_peaks, args=(read_fd, chunks, progress), daemon=True)
+    reader.start()
+    try:
+        with span('ffmpeg_waveform', bytes_in=file_size(media_path)):
+            with cancel_scope(cancelled) if cancelled else nullcontext():
+                result = run_process(cmd, 'ffmpeg_waveform', capture_output=True, pass_fds=(write_fd,))
+    finally:
+        os.close(write_fd)
+        reader.join()
+
+    if result.returncode != 0 or not chunks:
+        return None
+    return np.concatenate(chunks)
+
+
+def load_peaks(media_path: Union[str, Path], use_cache: bool = True,
+               progress: Optional[Callable[[float], None]] = None,
+               cancelled: Optional[Callable[[], bool]] = None) -> Optional[np.ndarray]:
+    """
+    读取媒体文件的峰值对（每个覆盖SECONDS_PER_PEAK秒），有缓存时直接读取缓存
+    缓存键为输入文件指纹（见conversion_cache.fingerprint）和解码参数；
+    缓存的修改时间为最近打开时间，写入新缓存时按保留时间和总大小淘汰（见prune_waveform_cache）
+    """
+    cache_path = None
+    if use_cache:
+        try:
+            cache_dir = waveform_cache_dir()
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            key = f"{fingerprint(media_path)[:32]}_{WAVEFORM_SAMPLE_RATE}_{PEAK_BUCKET_SAMPLES}_v{PEAK_CACHE_VERSION}"
+            cache_path = cache_dir / f"{key}.npy"
+            if cache_path.exists():
+                with span('waveform_cache_hit'):
+                    peaks = np.load(cache_path)
+                os.utime(cache_path)
+                return peaks
+        except (OSError, ValueError):
+            cache_path = None
+
+    peaks = decode_peaks(media_path, progress, cancelled)
+    if peaks is not None and cache_path is not None:
+        temp_path = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.tmp.npy")
+        try:
+            np.save(temp_path, peaks)
+            os.replace(temp_path, cache_path)
+            prune_waveform_cache(cache_path.parent, keep=cache_path)
+        except OSError:
+            temp_path.unlink(missing_ok=True)
+    return peaks
@@ -22,7 +22,7 @@ if errorlevel 1 (
     echo.
     echo [错误] 启动失败，请检查：
     echo 1. 是否已安装Python
-    echo 2. 是否已安装依赖包：pip install Pillow requests
+    echo 2. 是否已安装依赖包：pip install Pillow requests numpy
     echo.
 )
 
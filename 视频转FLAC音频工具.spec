@@ -6,11 +6,11 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('*.py', '.')],
-    hiddenimports=['PIL._tkinter_finder', 'tkinter', 'PIL', 'requests'],
+    hiddenimports=['PIL._tkinter_finder', 'tkinter', 'PIL', 'requests', 'numpy'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=['matplotlib', 'numpy', 'pandas', 'scipy'],
+    excludes=['matplotlib', 'pandas', 'scipy'],
     noarchive=False,
     optimize=0,
 )